@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Архив закрытых месяцев профитов
+
+Профиты закрытых месяцев переносятся в отдельные файлы archive/profits_YYYY_MM.db, в основной базе
+остаются свежие данные. Дневные агрегаты profit_daily не трогаются, поэтому статистика и рейтинги
+за все время считаются как раньше. Архивы подключаются (ATTACH) только для редких подробных выборок,
+например выгрузки за все время. Список архивов — таблица profit_archives основной базы.
+
+Перенос идёт без остановки бота: копирование пачками из соединения-читателя, короткая транзакция
+регистрации архива и удаление перенесённых строк пачками.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Сколько закрытых месяцев оставлять в основной базе (поздние начисления и исправления)
+ARCHIVE_KEEP_MONTHS = 1
+# Строк в одной транзакции копирования и удаления
+ARCHIVE_BATCH_SIZE = 20000
+# Пауза между пачками, чтобы запросы бота не ждали писателя
+ARCHIVE_PAUSE = 0.01
+# Страниц за один шаг инкрементальной очистки
+VACUUM_STEP_PAGES = 2000
+# Значение PRAGMA auto_vacuum для режима INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+ARCHIVE_DIR_NAME = 'archive'
+
+FORMATS = {fmt.name: fmt for fmt in (storage.TEXT, storage.COMPACT)}
+
+
+def create_profit_archives_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS profit_archives (
+            month TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            start_day TEXT NOT NULL,
+            end_day TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            archived_at TEXT
+        )
+    ''')
+
+
+def archive_dir(db_path):
+    """Каталог архивов рядом с основной базой"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVE_DIR_NAME)
+
+
+def month_bounds(month):
+    """'YYYY-MM' -> (первый день месяца, первый день следующего) в формате YYYY-MM-DD"""
+    year, number = map(int, month.split('-'))
+    start = date(year, number, 1)
+    end = date(year + number // 12, number % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def shift_month(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def list_archives(conn):
+    """[(месяц, имя файла, первый день, день после последнего, строк, формат)] по возрастанию месяца"""
+    return conn.execute('''
+        SELECT month, filename, start_day, end_day, rows, format FROM profit_archives ORDER BY month
+    ''').fetchall()
+
+
+def hot_start(conn):
+    """Первый день, профиты которого читаются из основной базы (None — архивов нет)"""
+    return conn.execute('SELECT MAX(end_day) FROM profit_archives').fetchone()[0]
+
+
+@contextmanager
+def attached(conn, filename, db_path, alias='archive'):
+    """Подключить файл архива к соединению на время блока"""
+    conn.execute('ATTACH DATABASE ? AS ' + alias, (os.path.join(archive_dir(db_path), filename),))
+    try:
+        yield alias
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('DETACH DATABASE ' + alias)
+
+
+def months_to_archive(conn, keep_months=ARCHIVE_KEEP_MONTHS, today=None):
+    """Закрытые месяцы старше keep_months, профиты которых ещё лежат в основной базе"""
+    fmt = storage.get_format(conn)
+    today = today or date.today()
+    cutoff = shift_month(today, -keep_months)
+    first = conn.execute('SELECT MIN(date) FROM profits').fetchone()[0]
+    if first is None:
+        return []
+    month = date.fromisoformat(fmt.day_value(first)).replace(day=1)
+    months = []
+    while month < cutoff:
+        start, end = month_bounds(month.strftime('%Y-%m'))
+        exists = conn.execute('SELECT 1 FROM profits WHERE date >= ? AND date < ? LIMIT 1',
+                              (fmt.day(start), fmt.day(end))).fetchone()
+        if exists:
+            months.append(month.strftime('%Y-%m'))
+        month = shift_month(month, 1)
+    return months
+
+
+def open_archive(path, conn, fmt):
+    """Открыть (создать) файл архива с таблицей profits той же структуры, что в основной базе"""
+    archive = sqlite3.connect(path)
+    columns = [(row[1], row[2]) for row in conn.execute('PRAGMA table_info(profits)')]
+    definitions = ', '.join(
+        f'{name} INTEGER PRIMARY KEY' if name == 'id' else f'{name} {kind}'.strip() for name, kind in columns
+    )
+    archive.execute(f'CREATE TABLE IF NOT EXISTS profits ({definitions})')
+    archive.execute('CREATE INDEX IF NOT EXISTS idx_profits_date ON profits (date)')
+    archived = archive.execute('PRAGMA table_info(profits)').fetchall()
+    if [row[1] for row in archived] != [name for name, _ in columns] or storage.get_format(archive) is not fmt:
+        archive.close()
+        raise RuntimeError(f"{path}: структура архива не совпадает с таблицей profits")
+    archive.commit()
+    return archive, [name for name, _ in columns]
+
+
+def archive_month(pool, month, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE):
+    """Перенести профиты месяца в архив; повторный запуск дописывает поздние профиты того же месяца"""
+    started = time.perf_counter()
+    directory = archive_dir(pool.path)
+    os.makedirs(directory, exist_ok=True)
+    filename = f"profits_{month.replace('-', '_')}.db"
+    path = os.path.join(directory, filename)
+    start, end = month_bounds(month)
+
+    with pool.reader() as conn:
+        fmt = storage.get_format(conn)
+        day_range = (fmt.day(start), fmt.day(end))
+        low, high = conn.execute('SELECT MIN(id), MAX(id) FROM profits WHERE date >= ? AND date < ?',
+                                 day_range).fetchone()
+        archive, columns = open_archive(path, conn, fmt)
+    if low is None:
+        archive.close()
+        return None
+
+    # 1. Копирование пачками; INSERT OR IGNORE делает повтор после сбоя безопасным
+    insert_sql = (f"INSERT OR IGNORE INTO profits ({', '.join(columns)}) "
+                  f"VALUES ({', '.join('?' * len(columns))})")
+    copied = 0
+    last_id = low - 1
+    try:
+        while True:
+            with pool.reader() as conn:
+                rows = conn.execute(
+                    f"SELECT {', '.join(columns)} FROM profits "
+                    f"WHERE id > ? AND id <= ? AND date >= ? AND date < ? ORDER BY id LIMIT ?",
+                    (last_id, high) + day_range + (batch_size,)
+                ).fetchall()
+            if not rows:
+                break
+            archive.executemany(insert_sql, rows)
+            archive.commit()
+            last_id = rows[-1][columns.index('id')]
+            copied += len(rows)
+            if pause:
+                time.sleep(pause)
+    finally:
+        archive.close()
+
+    # 2. Короткая транзакция: дописать профиты, появившиеся во время копирования, проверить
+    # полноту архива и зарегистрировать его — с этого момента месяц читается из архива
+    with pool.writer() as conn:
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    try:
+        with pool.writer() as conn:
+            storage.begin_write(conn)
+            late = conn.execute(
+                f"INSERT OR IGNORE INTO archive.profits ({', '.join(columns)}) "
+                f"SELECT {', '.join(columns)} FROM main.profits WHERE id > ? AND date >= ? AND date < ?",
+                (high,) + day_range
+            ).rowcount
+            missing = conn.execute('''
+                SELECT COUNT(*) FROM main.profits p
+                WHERE p.date >= ? AND p.date < ?
+                  AND NOT EXISTS (SELECT 1 FROM archive.profits a WHERE a.id = p.id)
+            ''', day_range).fetchone()[0]
+            if missing:
+                raise RuntimeError(f"{filename}: не перенесено {missing} профитов")
+            # Удаляются только строки, наличие которых в архиве проверено
+            archived_high = conn.execute('SELECT MAX(id) FROM main.profits WHERE date >= ? AND date < ?',
+                                         day_range).fetchone()[0]
+            archived_rows = conn.execute('SELECT COUNT(*) FROM archive.profits').fetchone()[0]
+            conn.execute('''
+                INSERT OR REPLACE INTO profit_archives (month, filename, start_day, end_day, rows, format, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (month, filename, start, end, archived_rows, fmt.name, datetime.now().isoformat(timespec='seconds')))
+    finally:
+        with pool.writer() as conn:
+            conn.execute('DETACH DATABASE archive')
+
+    # 3. Удаление перенесённых строк пачками
+    deleted = 0
+    while True:
+        with pool.writer() as conn:
+            count = conn.execute('''
+                DELETE FROM profits WHERE id IN (
+                    SELECT id FROM profits WHERE date >= ? AND date < ? AND id <= ? LIMIT ?
+                )
+            ''', day_range + (archived_high, batch_size)).rowcount
+        deleted += count
+        if count < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    report = {'month': month, 'file': filename, 'rows': archived_rows, 'copied': copied + late, 'deleted': deleted,
+              'seconds': time.perf_counter() - started}
+    logger.info(f"Месяц {month} перенесён в архив: {report}")
+    return report
+
+
+def archive_closed_months(pool, keep_months=ARCHIVE_KEEP_MONTHS, batch_size=ARCHIVE_BATCH_SIZE,
+                          pause=ARCHIVE_PAUSE, today=None):
+    """Перенести в архивы все закрытые месяцы старше keep_months"""
+    with pool.reader() as conn:
+        months = months_to_archive(conn, keep_months, today)
+    return [report for report in (archive_month(pool, month, batch_size, pause) for month in months) if report]
+
+
+def enable_incremental_vacuum(pool):
+    """Включить auto_vacuum = INCREMENTAL (один раз, только при остановленном боте)
+
+    Режим меняется лишь полным VACUUM: он переписывает весь файл и держит блокировку записи всё это
+    время, поэтому выполняется отдельной командой обслуживания, а не при архивации.
+    """
+    started = time.perf_counter()
+    size_before = os.path.getsize(pool.path)
+    with pool.writer() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return None
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    report = {'size_before': size_before, 'size_after': os.path.getsize(pool.path),
+              'seconds': time.perf_counter() - started}
+    logger.info(f"Включена инкрементальная очистка: {report}")
+    return report
+
+
+def vacuum(pool, step_pages=VACUUM_STEP_PAGES, pause=ARCHIVE_PAUSE):
+    """Вернуть место после архивации короткими шагами incremental_vacuum
+
+    Работает без остановки бота. Если база ещё не переведена в auto_vacuum = INCREMENTAL
+    (enable_incremental_vacuum), очистка пропускается: свободные страницы переиспользуются новыми записями.
+    """
+    started = time.perf_counter()
+    size_before = os.path.getsize(pool.path)
+    with pool.reader() as conn:
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    enabled = mode == AUTO_VACUUM_INCREMENTAL
+    if not enabled:
+        logger.warning("Очистка пропущена: auto_vacuum не INCREMENTAL, "
+                       "выполните `python maintenance.py enable-incremental-vacuum` при остановленном боте")
+    else:
+        while True:
+            with pool.writer() as conn:
+                if not conn.execute('PRAGMA freelist_count').fetchone()[0]:
+                    break
+                conn.execute(f'PRAGMA incremental_vacuum({int(step_pages)})').fetchall()
+            if pause:
+                time.sleep(pause)
+        with pool.writer() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    report = {'enabled': enabled, 'free_pages': free, 'size_before': size_before,
+              'size_after': os.path.getsize(pool.path), 'seconds': time.perf_counter() - started}
+    logger.info(f"Очистка базы: {report}")
+    return report
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк запросов бота по периодам
+
+Использование:
+    python generate_data.py --db bench.db
+    python benchmark.py --db bench.db --output results.json
+    python benchmark.py --db bench.db --compare results.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import bot
+from database import pool
+from period_stats import PERIODS, period_starts
+
+
+def sample_subjects(rng, count):
+    """Случайные воркеры и команды для запросов"""
+    with pool.reader() as conn:
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'worker'").fetchall()]
+        team_ids = [row[0] for row in conn.execute('SELECT id FROM teams').fetchall()]
+    return rng.sample(user_ids, min(count, len(user_ids))), rng.sample(team_ids, min(count, len(team_ids)))
+
+
+def build_cases(user_ids, team_ids):
+    """Список (имя, период, функция без аргументов, вызовов за прогон). Запросы измеряются без кэша.
+
+    Статистика считается сразу за все периоды (period_stats.py). Случаи с прежними именами по периодам
+    оставлены для сравнения со старыми отчётами: каждый — загрузка, нужная для показа периода без кэша.
+    Подробная статистика воркера (get_worker_detailed_stats) — тот же запрос, что и get_worker_stats_by_period,
+    поэтому отдельно не измеряется.
+    Случаи с периодом '*' — те же загрузки без выбора периода.
+    """
+    starts = period_starts()
+    cases = []
+    for period in PERIODS:
+        cases.append(('get_worker_stats_by_period', period,
+                      lambda p=period: [bot.load_user_periods(u, starts)[p] for u in user_ids], len(user_ids)))
+        cases.append(('get_team_stats_by_period', period,
+                      lambda p=period: [bot.load_team_periods(t, starts)[p] for t in team_ids], len(team_ids)))
+        cases.append(('get_workers_rating_by_period', period,
+                      lambda p=period: bot.load_workers_rating_periods(starts)[p], 1))
+        cases.append(('get_teams_rating_by_period', period,
+                      lambda p=period: bot.load_teams_rating_periods(starts)[p], 1))
+    cases.append(('get_team_total_stats', 'all',
+                  lambda: [sum(amount for _, amount in bot.load_team_periods(t, starts)['all'])
+                           for t in team_ids], len(team_ids)))
+    cases += [
+        ('load_user_periods', '*',
+         lambda: [bot.load_user_periods(u, starts) for u in user_ids], len(user_ids)),
+        ('load_team_periods', '*',
+         lambda: [bot.load_team_periods(t, starts) for t in team_ids], len(team_ids)),
+        ('load_workers_rating_periods', '*', lambda: bot.load_workers_rating_periods(starts), 1),
+        ('load_teams_rating_periods', '*', lambda: bot.load_teams_rating_periods(starts), 1),
+    ]
+    return cases
+
+
+def measure(func, repeat, calls_per_run):
+    """Время одного вызова (мс) по каждому прогону"""
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000 / calls_per_run)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        'runs': len(ordered),
+        'min_ms': ordered[0],
+        'median_ms': statistics.median(ordered),
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'mean_ms': statistics.fmean(ordered),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_info():
+    with pool.reader() as conn:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('users', 'teams', 'profits', 'profit_daily')}
+
+
+def run_benchmarks(repeat=20, subjects=20, seed=1):
+    rng = random.Random(seed)
+    user_ids, team_ids = sample_subjects(rng, subjects)
+    results = []
+    for name, period, func, calls in build_cases(user_ids, team_ids):
+        summary = summarize(measure(func, repeat, max(calls, 1)))
+        summary.update({'name': name, 'period': period})
+        results.append(summary)
+        print(f"{name:32} {period:6} median {summary['median_ms']:8.3f} мс  p95 {summary['p95_ms']:8.3f} мс")
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'repeat': repeat,
+            'subjects': subjects,
+            'dataset': dataset_info(),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline_path):
+    """Сравнить медианы с сохранённым результатом"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['name'], r['period']): r for r in baseline['results']}
+    print(f"\nСравнение с {baseline_path} ({baseline['meta'].get('revision')}):")
+    matched = 0
+    for result in current['results']:
+        old = previous.get((result['name'], result['period']))
+        if not old:
+            continue
+        matched += 1
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        mark = '⚠' if ratio > 1.2 else ' '
+        print(f"{mark} {result['name']:32} {result['period']:6} "
+              f"{old['median_ms']:8.3f} -> {result['median_ms']:8.3f} мс (x{ratio:.2f})")
+    if not matched:
+        print("⚠ Нет общих случаев: отчёт снят с другим набором запросов, сравнивать нечего")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк запросов бота')
+    parser.add_argument('--db', default='bench_database.db', help='путь к базе данных')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--subjects', type=int, default=20, help='сколько воркеров/команд опрашивать')
+    parser.add_argument('--output', help='записать результаты в JSON')
+    parser.add_argument('--compare', help='JSON с предыдущими результатами')
+    args = parser.parse_args()
+    pool.configure(path=args.db)
+    try:
+        bot.init_database()
+        report = run_benchmarks(args.repeat, args.subjects)
+    finally:
+        pool.close()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
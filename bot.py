@@ -5,12 +5,48 @@ Telegram-бот для управления командой трейдеров
 Использует python-telegram-bot версии 20+
 """
 
-import sqlite3
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from telegram import InputFile, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import BadRequest
 import logging
-from datetime import datetime, timedelta
+import math
+from collections import namedtuple
+from datetime import datetime
 import asyncio
+import os
+import secrets
+import signal
+import tempfile
+import threading
+import time
+
+from database import pool, run_background, run_read, run_write, shutdown_executors
+from migrations import migrate
+import rollups
+import period_stats
+import storage
+from period_stats import PERIODS, period_starts
+from cache import TTLCache, LRUCache, cache_stats
+from pagination import (
+    CALLBACK_PREFIX, PAGE_SIZE, keyset_page, page_cursors, slice_page, page_keyboard, parse_page_callback
+)
+from ranking import WorkerRanking
+from dashboard import GlobalDashboard
+from charts import (
+    ChartCache, DataVersions, direction_legend, load_chart_data, render_chart_async, shutdown_render_pool
+)
+from router import Router
+from state_store import StateStore
+from import_profits import import_profits_file, detect_format, format_report
+from export import UPLOAD_LIMIT, export_profits
+from notifications import NotificationQueue
+from group_commit import GroupCommitWriter
+from update_processor import KeyedUpdateProcessor
+from metrics import (
+    registry, timed, timed_sql, HANDLER_LATENCY, ROUTE_LATENCY, SQL_LATENCY, LOOP_LAG, API_LATENCY,
+    TimedRequest, monitor_loop_lag, start_metrics_server
+)
+from webhook import start_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,173 +59,231 @@ logger = logging.getLogger(__name__)
 TOKEN = "8209672202:AAFBfOD94ir9YRtdd-VB_AkzHaEvGwOPECE"
 # ID администратора
 ADMIN_ID = 844012884
-
-# Словари состояний
-waiting_for_name = {}
-user_states = {}
-selected_period = {}
-rating_type = {}
-admin_temp_data = {}
+# Время жизни кэша рейтингов (секунды); ограничивает устаревание периода 'day' после полуночи
+LEADERBOARD_TTL = 60
+# Порт локального HTTP-эндпоинта /metrics в формате Prometheus (None — выключен)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+# Режим webhook: публичный HTTPS-адрес (None — опрос getUpdates)
+WEBHOOK_URL = None
+# Локальный адрес встроенного сервера (за обратным прокси с TLS) и путь
+WEBHOOK_LISTEN = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/telegram'
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (None — случайный при каждом запуске)
+WEBHOOK_SECRET = None
+# Одновременно обрабатываемых обновлений (обновления одного пользователя — всегда по очереди; 1 — без параллельности)
+UPDATE_CONCURRENCY = 64
+# Строк в разделах глобальной статистики: команд и лучших воркеров
+GLOBAL_TOP_TEAMS = 10
+GLOBAL_TOP_WORKERS = 5
+# Максимальное число профилей пользователей в кэше
+USER_CACHE_SIZE = 10000
+# Максимальное число воркеров и команд в кэше статистики за периоды
+STATS_CACHE_SIZE = 10000
+
+# Состояния диалогов (ограниченный кэш в памяти с записью в таблицу user_sessions)
+state_store = StateStore()
+waiting_for_name = state_store.field('waiting_for_name')
+user_states = state_store.field('state')
+selected_period = state_store.field('period')
+rating_type = state_store.field('rating_type')
+admin_temp_data = state_store.field('admin_temp')
+
+# Кэш рейтингов за все периоды: ключ (kind, дата), kind — 'workers' или 'teams'
+leaderboard_cache = TTLCache('leaderboard', LEADERBOARD_TTL)
+# Кэш статистики воркеров и команд за все периоды: ключ ('user' | 'team', id, дата)
+stats_cache = LRUCache('period_stats', STATS_CACHE_SIZE)
+# Кэш профилей пользователей по telegram_id
+profile_cache = LRUCache('user_profile', USER_CACHE_SIZE)
+# Графики: картинка и file_id по (тип, id, период, дата, версия данных)
+chart_cache = ChartCache('charts')
+chart_versions = DataVersions()
+
+# Очередь уведомлений (запускается в post_init)
+notification_queue = NotificationQueue()
+# Параллельная обработка обновлений с порядком внутри пользователя
+update_processor = KeyedUpdateProcessor(UPDATE_CONCURRENCY)
+
+UserProfile = namedtuple('UserProfile', ['id', 'name', 'role', 'team_id', 'direction'])
 
 
 def init_database():
     """Инициализация базы данных SQLite"""
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
+    with pool.writer() as conn:
+        cursor = conn.cursor()
 
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            name TEXT,
-            role TEXT DEFAULT 'worker',
-            team_id INTEGER,
-            direction TEXT
-        )
-    ''')
-
-    # Таблица команд
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS teams (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            team_leader_id INTEGER,
-            stats TEXT
-        )
-    ''')
-
-    # Таблица прибыли
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS profits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            direction TEXT,
-            amount REAL,
-            date TEXT,
-            comment TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    # Таблица ботов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            description TEXT,
-            link TEXT
-        )
-    ''')
+        # Таблица пользователей
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                name TEXT,
+                role TEXT DEFAULT 'worker',
+                team_id INTEGER,
+                direction TEXT
+            )
+        ''')
+
+        # Таблица команд
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS teams (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                team_leader_id INTEGER,
+                stats TEXT
+            )
+        ''')
+
+        # Таблица прибыли
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS profits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                direction TEXT,
+                amount REAL,
+                date TEXT,
+                comment TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+        # Таблица ботов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                description TEXT,
+                link TEXT
+            )
+        ''')
 
-    conn.commit()
-    conn.close()
-    logger.info("База данных инициализирована")
+        # Индексы и прочие изменения схемы
+        version = migrate(conn)
+
+    logger.info(f"База данных инициализирована, версия схемы: {version}")
 
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
 
+@timed_sql
+def load_user_profile(telegram_id):
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, name, role, team_id, direction FROM users WHERE telegram_id = ?',
+            (telegram_id,)
+        )
+        result = cursor.fetchone()
+    return UserProfile(*result) if result else None
+
+
+def get_user_profile(telegram_id):
+    """Профиль пользователя из LRU-кэша (None — не зарегистрирован)"""
+    return profile_cache.get_or_load(telegram_id, lambda: load_user_profile(telegram_id))
+
+
+def invalidate_user_profile(telegram_id):
+    profile_cache.invalidate(telegram_id)
+
+
 def get_user_role(telegram_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT role FROM users WHERE telegram_id = ?', (telegram_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    profile = get_user_profile(telegram_id)
+    return profile.role if profile else None
 
 
 def get_user_id_by_telegram_id(telegram_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    profile = get_user_profile(telegram_id)
+    return profile.id if profile else None
 
 
 def get_user_team_id(telegram_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT team_id FROM users WHERE telegram_id = ?', (telegram_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    profile = get_user_profile(telegram_id)
+    return profile.team_id if profile else None
 
 
 def get_user_by_telegram_id(telegram_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return get_user_profile(telegram_id) is not None
 
 
+@timed_sql
 def register_user(telegram_id, name):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
+    return write_now(write_user_registration, telegram_id, name)
+
+
+def write_user_registration(conn, telegram_id, name):
     role = 'admin' if telegram_id == ADMIN_ID else 'worker'
-    cursor.execute(
+    conn.execute(
         'INSERT INTO users (telegram_id, name, role, team_id, direction) VALUES (?, ?, ?, ?, ?)',
         (telegram_id, name, role, None, None)
     )
-    conn.commit()
-    conn.close()
     logger.info(f"Пользователь зарегистрирован: {telegram_id}, {name}, роль: {role}")
+    return role, [('profile', telegram_id)]
 
 
-def get_stats_menu_keyboard(telegram_id):
-    role = get_user_role(telegram_id)
+def build_stats_menu_keyboard(privileged):
     keyboard = [
         ['📅 День', '📅 Неделя'],
         ['📅 Месяц', '📅 Все время'],
-        ['🛠 По направлениям', '🔄 Обновить'],
+        ['🛠 По направлениям', '📉 График', '🔄 Обновить'],
         ['⬅️ Назад']
     ]
-    if role in ['team_leader', 'admin']:
-        keyboard.insert(3, ['📈 Статистика команды', '👤 Детализация по воркеру'])
+    if privileged:
+        keyboard.insert(3, ['📈 Статистика команды', '📉 График команды', '👤 Детализация по воркеру'])
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
 
 
-def get_worker_stats_by_period(user_id, period):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    now = datetime.now()
-    if period == 'day':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == 'week':
-        start_date = now - timedelta(days=7)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    else:
-        start_date = None
-
-    if start_date:
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        query = '''
-            SELECT direction, SUM(amount) as total
-            FROM profits
-            WHERE user_id = ? AND date >= ?
-            GROUP BY direction
-        '''
-        cursor.execute(query, (user_id, start_date_str))
-    else:
-        query = '''
-            SELECT direction, SUM(amount) as total
-            FROM profits
-            WHERE user_id = ?
-            GROUP BY direction
-        '''
-        cursor.execute(query, (user_id,))
+# Клавиатуры не зависят от данных и строятся один раз (по наличию прав тимлидера/админа)
+STATS_MENU_KEYBOARDS = {privileged: build_stats_menu_keyboard(privileged) for privileged in (False, True)}
+
+
+def get_stats_menu_keyboard(telegram_id, role=None):
+    if role is None:
+        role = get_user_role(telegram_id)
+    return STATS_MENU_KEYBOARDS[role in ['team_leader', 'admin']]
+
+
+@timed_sql
+def load_user_periods(user_id, starts):
+    with pool.reader() as conn:
+        return period_stats.load_user_periods(conn, user_id, starts)
 
-    results = cursor.fetchall()
-    conn.close()
 
+@timed_sql
+def load_team_periods(team_id, starts):
+    with pool.reader() as conn:
+        return period_stats.load_team_periods(conn, team_id, starts)
+
+
+def get_user_periods(user_id):
+    """Статистика воркера за все периоды; ключ кэша включает текущую дату, поэтому в полночь он обновляется"""
+    starts = period_starts()
+    return stats_cache.get_or_load(('user', user_id, starts['day']), lambda: load_user_periods(user_id, starts))
+
+
+def get_team_periods(team_id):
+    starts = period_starts()
+    return stats_cache.get_or_load(('team', team_id, starts['day']), lambda: load_team_periods(team_id, starts))
+
+
+def invalidate_period_stats(kind, subject_id):
+    stats_cache.invalidate((kind, subject_id, period_starts()['day']))
+    chart_versions.bump((kind, subject_id))
+
+
+@timed_sql
+def get_chart_data(kind, subject_id, period):
+    """Данные графика; для периода 'день' показывается неделя — один столбец ничего не говорит"""
+    starts = period_starts()
+    start = starts['week'] if period == 'day' else starts[period]
+    with pool.reader() as conn:
+        return load_chart_data(conn, kind, subject_id, start, starts['day'])
+
+
+def get_worker_stats_by_period(user_id, period):
     stats = {}
     total = 0
-    for direction, amount in results:
-        if amount is None:
-            amount = 0
+    for direction, amount, _ in get_user_periods(user_id)[period]:
         stats[direction] = amount
         total += amount
     stats['total'] = total
@@ -197,215 +291,154 @@ def get_worker_stats_by_period(user_id, period):
 
 
 def get_team_stats_by_period(team_id, period):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    now = datetime.now()
-    if period == 'day':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == 'week':
-        start_date = now - timedelta(days=7)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    else:
-        start_date = None
-
-    if start_date:
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        query = '''
-            SELECT u.name, SUM(p.amount) as total
-            FROM profits p
-            JOIN users u ON p.user_id = u.id
-            WHERE u.team_id = ? AND p.date >= ?
-            GROUP BY u.id, u.name
-            ORDER BY total DESC
-        '''
-        cursor.execute(query, (team_id, start_date_str))
-    else:
-        query = '''
-            SELECT u.name, SUM(p.amount) as total
-            FROM profits p
-            JOIN users u ON p.user_id = u.id
-            WHERE u.team_id = ?
-            GROUP BY u.id, u.name
-            ORDER BY total DESC
-        '''
-        cursor.execute(query, (team_id,))
-
-    results = cursor.fetchall()
-    conn.close()
-    return [(name, amount or 0) for name, amount in results]
+    return list(get_team_periods(team_id)[period])
 
 
+@timed_sql
 def get_team_workers(team_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT telegram_id, name FROM users WHERE team_id = ?', (team_id,))
-    results = cursor.fetchall()
-    conn.close()
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT telegram_id, name FROM users WHERE team_id = ?', (team_id,))
+        results = cursor.fetchall()
     return results
 
 
-def get_worker_detailed_stats(user_id, period):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    now = datetime.now()
-    if period == 'day':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == 'week':
-        start_date = now - timedelta(days=7)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    else:
-        start_date = None
-
-    if start_date:
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        query = '''
-            SELECT direction, SUM(amount) as total, COUNT(*) as count
-            FROM profits
-            WHERE user_id = ? AND date >= ?
-            GROUP BY direction
-        '''
-        cursor.execute(query, (user_id, start_date_str))
-    else:
-        query = '''
-            SELECT direction, SUM(amount) as total, COUNT(*) as count
-            FROM profits
-            WHERE user_id = ?
-            GROUP BY direction
-        '''
-        cursor.execute(query, (user_id,))
+@timed_sql
+def get_team_worker_count(team_id):
+    with pool.reader() as conn:
+        return conn.execute('SELECT COUNT(*) FROM users WHERE team_id = ?', (team_id,)).fetchone()[0]
+
 
-    results = cursor.fetchall()
-    conn.close()
-    return [(direction, amount or 0, count) for direction, amount, count in results]
+@timed_sql
+def get_team_workers_after(team_id, after_id, limit):
+    """Страница воркеров команды по id (keyset): [(id, telegram_id, имя)]"""
+    with pool.reader() as conn:
+        return conn.execute(
+            'SELECT id, telegram_id, name FROM users WHERE team_id = ? AND id > ? ORDER BY id LIMIT ?',
+            (team_id, after_id or 0, limit)
+        ).fetchall()
 
 
-def get_main_menu_keyboard(telegram_id):
+def get_worker_detailed_stats(user_id, period):
+    return list(get_user_periods(user_id)[period])
+
+
+def build_main_menu_keyboard(privileged):
     keyboard = [
         ['📊 Моя статистика', '🏆 Рейтинг'],
         ['🤖 Боты', '👥 Моя команда'],
         ['⚙️ Настройки', '🏠 Главное меню'],
         ['❓ Справка']
     ]
-    role = get_user_role(telegram_id)
-    if role in ['team_leader', 'admin']:
+    if privileged:
         keyboard.append(['🛠 Админ-панель'])
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
 
 
+MAIN_MENU_KEYBOARDS = {privileged: build_main_menu_keyboard(privileged) for privileged in (False, True)}
+
+
+def get_main_menu_keyboard(telegram_id, role=None):
+    if role is None:
+        role = get_user_role(telegram_id)
+    return MAIN_MENU_KEYBOARDS[role in ['team_leader', 'admin']]
+
+
+RATING_MENU_KEYBOARD = ReplyKeyboardMarkup([
+    ['👤 Воркеры', '👥 Команды'],
+    ['📅 День', '📅 Неделя'],
+    ['📅 Месяц', '📅 Все время'],
+    ['⬅️ Назад']
+], resize_keyboard=True, one_time_keyboard=False)
+
+
 def get_rating_menu_keyboard():
-    keyboard = [
-        ['👤 Воркеры', '👥 Команды'],
-        ['📅 День', '📅 Неделя'],
-        ['📅 Месяц', '📅 Все время'],
-        ['⬅️ Назад']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+    return RATING_MENU_KEYBOARD
 
 
-def get_workers_rating_by_period(period):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    now = datetime.now()
-    if period == 'day':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == 'week':
-        start_date = now - timedelta(days=7)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    else:
-        start_date = None
-
-    if start_date:
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        query = '''
-            SELECT u.name, SUM(p.amount) as total
-            FROM profits p
-            JOIN users u ON p.user_id = u.id
-            WHERE p.date >= ? AND u.role = 'worker'
-            GROUP BY u.id, u.name
-            ORDER BY total DESC
-        '''
-        cursor.execute(query, (start_date_str,))
-    else:
-        query = '''
-            SELECT u.name, SUM(p.amount) as total
-            FROM profits p
-            JOIN users u ON p.user_id = u.id
-            WHERE u.role = 'worker'
-            GROUP BY u.id, u.name
-            ORDER BY total DESC
-        '''
-        cursor.execute(query)
+@timed_sql
+def load_workers_rating_periods(starts):
+    with pool.reader() as conn:
+        return period_stats.load_workers_periods(conn, starts)
+
+
+@timed_sql
+def load_teams_rating_periods(starts):
+    with pool.reader() as conn:
+        return period_stats.load_teams_periods(conn, starts)
 
-    results = cursor.fetchall()
-    conn.close()
-    return [(name, amount or 0) for name, amount in results]
+
+def load_workers_rating_by_period(period):
+    """Рейтинг без кэша (для бенчмарков)"""
+    return load_workers_rating_periods(period_starts())[period]
+
+
+def load_teams_rating_by_period(period):
+    return load_teams_rating_periods(period_starts())[period]
+
+
+@timed_sql
+def load_workers_totals(starts):
+    with pool.reader() as conn:
+        periods = period_stats.load_workers_totals(conn, starts)
+        return periods, period_stats.last_profit_id(conn)
+
+
+# Место воркера в рейтинге: суммы в памяти, обновляются в create_profit
+worker_ranking = WorkerRanking(load_workers_totals)
+
+
+@timed_sql
+def load_global_totals(starts, yesterday):
+    with pool.reader() as conn:
+        periods, previous = period_stats.load_global_totals(conn, starts, yesterday)
+        team_names = dict(conn.execute('SELECT id, name FROM teams').fetchall())
+        last_id = period_stats.last_profit_id(conn)
+    return periods, previous, team_names, last_id
+
+
+# Глобальная статистика админ-панели: суммы в памяти, обновляются при начислении профита
+global_dashboard = GlobalDashboard(load_global_totals)
+
+
+def get_worker_rank(user_id, period):
+    """Место, сумма, отставание от следующего места и соседи воркера за период"""
+    return worker_ranking.rank(user_id, period)
+
+
+def get_rating_periods(kind):
+    """Рейтинги воркеров или команд за все периоды из кэша (списки не копируются)"""
+    starts = period_starts()
+    loader = load_teams_rating_periods if kind == 'teams' else load_workers_rating_periods
+    return leaderboard_cache.get_or_load((kind, starts['day']), lambda: loader(starts))
+
+
+def get_workers_rating_by_period(period):
+    return list(get_rating_periods('workers')[period])
 
 
 def get_teams_rating_by_period(period):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    now = datetime.now()
-    if period == 'day':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == 'week':
-        start_date = now - timedelta(days=7)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    else:
-        start_date = None
-
-    if start_date:
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        query = '''
-            SELECT t.name, COALESCE(SUM(p.amount), 0) as total
-            FROM teams t
-            LEFT JOIN users u ON t.id = u.team_id
-            LEFT JOIN profits p ON u.id = p.user_id AND p.date >= ?
-            GROUP BY t.id, t.name
-            HAVING total > 0
-            ORDER BY total DESC
-        '''
-        cursor.execute(query, (start_date_str,))
-    else:
-        query = '''
-            SELECT t.name, COALESCE(SUM(p.amount), 0) as total
-            FROM teams t
-            LEFT JOIN users u ON t.id = u.team_id
-            LEFT JOIN profits p ON u.id = p.user_id
-            GROUP BY t.id, t.name
-            HAVING total > 0
-            ORDER BY total DESC
-        '''
-        cursor.execute(query)
-
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    return list(get_rating_periods('teams')[period])
 
 
-def get_bots_from_database():
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, description, link FROM bots')
-    results = cursor.fetchall()
-    conn.close()
-    return results
+def get_rating_page(kind, period, number):
+    return slice_page(get_rating_periods(kind)[period], number)
 
 
-def get_bot_by_name(bot_name):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, description, link FROM bots WHERE name = ?', (bot_name,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+def invalidate_leaderboards(kind):
+    leaderboard_cache.invalidate(lambda key: key[0] == kind)
 
 
-def get_bots_menu_keyboard():
-    bots = get_bots_from_database()
+@timed_sql
+def load_bots_from_database():
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, description, link FROM bots')
+        results = cursor.fetchall()
+    return results
+
+
+def build_bots_keyboard(bots):
     if not bots:
         return ReplyKeyboardMarkup([['⬅️ Назад']], resize_keyboard=True)
     keyboard = []
@@ -421,136 +454,440 @@ def get_bots_menu_keyboard():
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+BotCatalogSnapshot = namedtuple('BotCatalogSnapshot', ['version', 'bots', 'by_name', 'keyboard'])
+
+
+class BotCatalog:
+    """Каталог ботов в памяти: список, индекс по имени и готовая клавиатура для текущей версии"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.snapshot = None
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self.snapshot is None:
+                bots = tuple(load_bots_from_database())
+                by_name = {}
+                for bot in bots:
+                    by_name.setdefault(bot[0], bot)
+                self.snapshot = BotCatalogSnapshot(self.version, bots, by_name, build_bots_keyboard(bots))
+            return self.snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self.snapshot = None
+
+
+bot_catalog = BotCatalog()
+
+
+def get_bots_from_database():
+    return bot_catalog.get().bots
+
+
+def get_bot_by_name(bot_name):
+    return bot_catalog.get().by_name.get(bot_name)
+
+
+@timed_sql
+def add_bot(name, description, link):
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO bots (name, description, link) VALUES (?, ?, ?)', (name, description, link))
+    bot_catalog.invalidate()
+
+
+def get_bots_menu_keyboard():
+    return bot_catalog.get().keyboard
+
+
+@timed_sql
 def get_team_info(team_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, team_leader_id FROM teams WHERE id = ?', (team_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, team_leader_id FROM teams WHERE id = ?', (team_id,))
+        result = cursor.fetchone()
     return result
 
 
+@timed_sql
 def get_team_leader_name(leader_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name FROM users WHERE id = ?', (leader_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM users WHERE id = ?', (leader_id,))
+        result = cursor.fetchone()
     return result[0] if result else None
 
 
 def get_team_total_stats(team_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COALESCE(SUM(p.amount), 0)
-        FROM profits p
-        JOIN users u ON p.user_id = u.id
-        WHERE u.team_id = ?
-    ''', (team_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] or 0
+    return sum(amount for _, amount in get_team_periods(team_id)['all'])
+
+
+TEAM_MENU_KEYBOARD = ReplyKeyboardMarkup([
+    ['📊 Статистика команды', '👤 Список воркеров'],
+    ['📣 Рассылка команде', '📤 Экспорт профитов'],
+    ['⬅️ Назад']
+], resize_keyboard=True)
 
 
 def get_team_menu_keyboard():
-    keyboard = [
-        ['📊 Статистика команды', '👤 Список воркеров'],
-        ['⬅️ Назад']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return TEAM_MENU_KEYBOARD
+
+
+SETTINGS_MENU_KEYBOARD = ReplyKeyboardMarkup([
+    ['✏️ Выбрать направление'],
+    ['⬅️ Назад']
+], resize_keyboard=True)
 
 
 def get_settings_menu_keyboard():
-    keyboard = [
-        ['✏️ Выбрать направление'],
-        ['⬅️ Назад']
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return SETTINGS_MENU_KEYBOARD
 
 
+@timed_sql
 def update_user_direction(telegram_id, direction):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET direction = ? WHERE telegram_id = ?', (direction, telegram_id))
-    conn.commit()
-    conn.close()
+    return write_now(write_user_direction, telegram_id, direction)
+
+
+def write_user_direction(conn, telegram_id, direction):
+    conn.execute('UPDATE users SET direction = ? WHERE telegram_id = ?', (direction, telegram_id))
+    return None, [('profile', telegram_id)]
+
+
+@timed_sql
+def update_user_team(telegram_id, team_id):
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, team_id FROM users WHERE telegram_id = ?', (telegram_id,))
+        result = cursor.fetchone()
+        cursor.execute('UPDATE users SET team_id = ? WHERE telegram_id = ?', (team_id, telegram_id))
+        if result:
+            rollups.move_user_team(cursor, result[0], team_id)
+    invalidate_user_profile(telegram_id)
+    invalidate_leaderboards('teams')
+    global_dashboard.invalidate()
+    page_cursors.invalidate(('team', team_id))
+    if result:
+        # Профиты воркера переходят из старой команды в новую
+        invalidate_period_stats('team', result[1])
+        invalidate_period_stats('team', team_id)
+        page_cursors.invalidate(('team', result[1]))
+
+
+@timed_sql
+def update_user_role(telegram_id, role):
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE users SET role = ? WHERE telegram_id = ?', (role, telegram_id))
+    invalidate_user_profile(telegram_id)
+    invalidate_leaderboards('workers')
+    worker_ranking.invalidate()
+    global_dashboard.invalidate()
+    # Список всех воркеров строится по роли
+    page_cursors.invalidate(('staff',))
 
 
 def get_settings_directions_keyboard():
-    bots = get_bots_from_database()
-    if not bots:
-        return ReplyKeyboardMarkup([['⬅️ Назад']], resize_keyboard=True)
-    keyboard = []
-    row = []
-    for name, _, _ in bots:
-        row.append(name)
-        if len(row) == 2:
-            keyboard.append(row)
-            row = []
-    if row:
-        keyboard.append(row)
-    keyboard.append(['⬅️ Назад'])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return bot_catalog.get().keyboard
 
 
+@timed_sql
 def get_all_workers():
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, telegram_id FROM users WHERE role = "worker"')
-    results = cursor.fetchall()
-    conn.close()
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, telegram_id FROM users WHERE role = "worker"')
+        results = cursor.fetchall()
     return results
 
 
+@timed_sql
+def get_all_workers_after(after_id, limit):
+    """Страница всех воркеров по id (keyset): [(id, имя, telegram_id)]"""
+    with pool.reader() as conn:
+        return conn.execute(
+            'SELECT id, name, telegram_id FROM users WHERE role = "worker" AND id > ? ORDER BY id LIMIT ?',
+            (after_id or 0, limit)
+        ).fetchall()
+
+
+@timed_sql
 def get_all_teams():
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name FROM teams')
-    results = cursor.fetchall()
-    conn.close()
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, name FROM teams')
+        results = cursor.fetchall()
     return results
 
 
+@timed_sql
 def create_profit(user_id, direction, amount, comment):
     try:
-        conn = sqlite3.connect('bot_database.db')
-        cursor = conn.cursor()
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute(
-            'INSERT INTO profits (user_id, direction, amount, date, comment) VALUES (?, ?, ?, ?, ?)',
-            (user_id, direction, amount, today, comment)
-        )
-        conn.commit()
-        conn.close()
+        write_now(write_profit, user_id, direction, amount, comment)
         return True
     except Exception as e:
         logger.error(f"Ошибка при добавлении профита: {e}")
         return False
 
 
+def write_profit(conn, user_id, direction, amount, comment):
+    """Профит и дневные агрегаты в открытой транзакции; эффекты — затронутые записи кэшей"""
+    fmt = storage.begin_write(conn)
+    cursor = conn.cursor()
+    today = datetime.now().strftime('%Y-%m-%d')
+    cursor.execute(
+        fmt.insert_profit_sql,
+        fmt.profit_row(user_id, direction, amount, today, comment, created_at=int(time.time()))
+    )
+    profit_id = cursor.lastrowid
+    rollups.apply_profit(cursor, user_id, direction, fmt.amount(amount), fmt.day(today))
+    cursor.execute('SELECT role, team_id, name FROM users WHERE id = ?', (user_id,))
+    user = cursor.fetchone()
+    # Профит за сегодня попадает во все периоды; сбрасываем только затронутые записи кэшей
+    effects = [('stats', 'user', user_id)]
+    if user:
+        role, team_id, name = user
+        effects.append(('dashboard', user_id, team_id, role, direction,
+                        fmt.amount_value(fmt.amount(amount)), today, profit_id))
+        if role == 'worker':
+            effects.append(('leaderboard', 'workers'))
+            effects.append(('rank', user_id, name, fmt.amount_value(fmt.amount(amount)), today, profit_id))
+        if team_id is not None:
+            effects.append(('leaderboard', 'teams'))
+            effects.append(('stats', 'team', team_id))
+    return True, effects
+
+
+def apply_write_effects(effects):
+    """Сброс кэшей после зафиксированных записей: каждый ключ — один раз на пачку"""
+    seen = set()
+    for effect in effects:
+        kind = effect[0]
+        if kind == 'rank':
+            # Суммы в рейтинге и глобальной статистике меняются на каждый профит, а не один раз
+            worker_ranking.apply_profit(*effect[1:])
+            continue
+        if kind == 'dashboard':
+            global_dashboard.apply_profit(*effect[1:])
+            continue
+        if effect in seen:
+            continue
+        seen.add(effect)
+        if kind == 'profile':
+            invalidate_user_profile(effect[1])
+        elif kind == 'stats':
+            invalidate_period_stats(effect[1], effect[2])
+        elif kind == 'leaderboard':
+            invalidate_leaderboards(effect[1])
+
+
+# Записи из обработчиков: одна транзакция на пачку, сброс кэшей один раз на пачку
+write_buffer = GroupCommitWriter(pool, on_commit=apply_write_effects)
+
+
+def write_now(apply, *args):
+    """Выполнить запись сразу отдельной транзакцией (скрипты и синхронные вызовы)"""
+    with pool.writer() as conn:
+        value, effects = apply(conn, *args)
+    apply_write_effects(effects)
+    return value
+
+
+@timed_sql
 def create_team(team_name, leader_id):
     try:
-        conn = sqlite3.connect('bot_database.db')
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO teams (name, team_leader_id) VALUES (?, ?)', (team_name, leader_id))
-        conn.commit()
-        team_id = cursor.lastrowid
-        conn.close()
+        with pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO teams (name, team_leader_id) VALUES (?, ?)', (team_name, leader_id))
+            team_id = cursor.lastrowid
+        global_dashboard.set_team_name(team_id, team_name)
         return team_id
     except Exception as e:
         logger.error(f"Ошибка при создании команды: {e}")
         return None
 
 
+# === МЕТРИКИ ===
+
+@registry.add_collector
+def collect_bot_metrics():
+    caches = cache_stats()
+    pool_stats = pool.stats()
+    states = state_store.stats()
+    queue = notification_queue.stats()
+    ranking = worker_ranking.stats()
+    dashboard = global_dashboard.stats()
+    writes = write_buffer.stats()
+    updates = update_processor.stats()
+    return [
+        ('bot_cache_hits_total', 'counter', 'Попадания в кэш',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('bot_cache_misses_total', 'counter', 'Промахи кэша',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ('bot_db_pool_acquired_total', 'counter', 'Выдано соединений',
+         [({'lane': lane}, pool_stats[lane]['acquired']) for lane in ('reader', 'writer')]),
+        ('bot_db_pool_wait_seconds_total', 'counter', 'Суммарное ожидание соединений',
+         [({'lane': lane}, pool_stats[lane]['wait_total']) for lane in ('reader', 'writer')]),
+        ('bot_state_users', 'gauge', 'Пользователей с состоянием в памяти', [({}, states['users'])]),
+        ('bot_state_evictions_total', 'counter', 'Вытеснения состояний',
+         [({'reason': 'lru'}, states['lru_evictions']), ({'reason': 'idle'}, states['idle_evictions'])]),
+        ('bot_notification_queue_depth', 'gauge', 'Уведомлений в очереди', [({}, queue['depth'])]),
+        ('bot_notifications_total', 'counter', 'Уведомления по результату',
+         [({'result': 'sent'}, queue['sent']), ({'result': 'failed'}, queue['failed']),
+          ({'result': 'retried'}, queue['retried'])]),
+        ('bot_rank_loads_total', 'counter', 'Полные загрузки рейтинга для «моего места»', [({}, ranking['loads'])]),
+        ('bot_rank_updates_total', 'counter', 'Обновления рейтинга в памяти при начислении',
+         [({}, ranking['updates'])]),
+        ('bot_dashboard_loads_total', 'counter', 'Полные загрузки глобальной статистики', [({}, dashboard['loads'])]),
+        ('bot_dashboard_updates_total', 'counter', 'Обновления глобальной статистики в памяти при начислении',
+         [({}, dashboard['updates'])]),
+        ('bot_group_commit_depth', 'gauge', 'Записей в очереди групповой фиксации', [({}, writes['depth'])]),
+        ('bot_group_commit_batches_total', 'counter', 'Транзакций групповой фиксации', [({}, writes['batches'])]),
+        ('bot_group_commit_rows_total', 'counter', 'Записи групповой фиксации по результату',
+         [({'result': 'committed'}, writes['committed']), ({'result': 'failed'}, writes['failed'])]),
+        ('bot_updates_active', 'gauge', 'Обновлений в обработке', [({}, updates['active'])]),
+        ('bot_updates_serialized_total', 'counter', 'Обновления, ждавшие предыдущее обновление того же пользователя',
+         [({}, updates['serialized'])]),
+    ]
+
+
+def format_latency_lines(histogram, limit=8):
+    """Строки «метка: кол-во, p50/p95» для самых частых серий гистограммы"""
+    series = sorted(histogram.series().items(), key=lambda item: -sum(item[1][0]))[:limit]
+    lines = []
+    for labels, (counts, _) in series:
+        name = '/'.join(str(label) for label in labels) or 'всего'
+        p50 = histogram.quantile(0.5, labels) * 1000
+        p95 = histogram.quantile(0.95, labels) * 1000
+        lines.append(f"  {name}: {sum(counts)} шт., p50 {p50:.1f} мс, p95 {p95:.1f} мс")
+    return lines or ["  нет данных"]
+
+
+def format_debug_metrics():
+    lines = ["🩺 Метрики бота", "", "Обработчики:"]
+    lines += format_latency_lines(HANDLER_LATENCY)
+    lines += ["", "Маршруты:"] + format_latency_lines(ROUTE_LATENCY)
+    lines += ["", "SQL:"] + format_latency_lines(SQL_LATENCY)
+    lines += ["", "Bot API:"] + format_latency_lines(API_LATENCY)
+    lines += ["", "Лаг event loop:"] + format_latency_lines(LOOP_LAG)
+    lines += ["", "Кэши:"]
+    for name, stats in cache_stats().items():
+        lines.append(f"  {name}: попаданий {stats['hit_rate']:.0%}, размер {stats['size']}")
+    pool_stats = pool.stats()
+    lines += ["", f"Пул БД: ожиданий читателей {pool_stats['reader']['waited']}, "
+                  f"писателя {pool_stats['writer']['waited']}"]
+    queue = notification_queue.stats()
+    lines.append(f"Уведомления: в очереди {queue['depth']}, отправлено {queue['sent']}, "
+                 f"задержка p95 {queue['latency_p95']:.2f} с")
+    updates = update_processor.stats()
+    lines.append(f"Обновления: в обработке {updates['active']} из {updates['limit']}, "
+                 f"ждали своей очереди {updates['serialized']}")
+    writes = write_buffer.stats()
+    lines.append(f"Групповая запись: в очереди {writes['depth']}, пачек {writes['batches']}, "
+                 f"в среднем {writes['avg_batch']:.1f} записей, p99 {writes['latency_p99'] * 1000:.1f} мс")
+    return '\n'.join(lines)
+
+
+GLOBAL_PERIOD_TITLES = {'day': 'Сегодня', 'week': 'Неделя', 'month': 'Месяц', 'all': 'Все время'}
+
+
+def format_delta(current, previous):
+    """Изменение суммы к предыдущему значению: «+$10.00 (+5%)»"""
+    delta = current - previous
+    sign = '+' if delta >= 0 else '-'
+    text = f"{sign}${abs(delta):.2f}"
+    if previous > 0:
+        text += f" ({sign}{abs(delta) / previous:.0%})"
+    return text
+
+
+def format_count_delta(current, previous):
+    return f"{current - previous:+d}"
+
+
+def format_global_overview():
+    """Итоги за все периоды и сравнение сегодняшнего дня со вчерашним"""
+    lines = ["📊 Глобальная статистика", ""]
+    yesterday = global_dashboard.summary('yesterday')
+    for period in PERIODS:
+        summary = global_dashboard.summary(period)
+        lines.append(f"📅 {GLOBAL_PERIOD_TITLES[period]}: ${summary.total:.2f} · профитов {summary.count} · "
+                     f"воркеров {summary.active}")
+        if period == 'day':
+            lines.append(f"   к вчера: {format_delta(summary.total, yesterday.total)} · "
+                         f"профитов {format_count_delta(summary.count, yesterday.count)} · "
+                         f"воркеров {format_count_delta(summary.active, yesterday.active)}")
+    lines += ["", "Выберите период: направления, команды и лучшие воркеры."]
+    return '\n'.join(lines)
+
+
+def format_global_period(period):
+    """Разбивка периода по направлениям и командам, лучшие воркеры; за день — изменение к вчера"""
+    summary = global_dashboard.summary(period)
+    yesterday = global_dashboard.summary('yesterday') if period == 'day' else None
+    lines = [f"📊 Глобальная статистика за {format_period_name(period)}:",
+             f"Итого: ${summary.total:.2f} · профитов {summary.count} · активных воркеров {summary.active}"]
+    if yesterday:
+        lines.append(f"К вчера: {format_delta(summary.total, yesterday.total)}")
+    previous = dict(yesterday.directions) if yesterday else {}
+    lines += ["", "По направлениям:"]
+    for direction, total in summary.directions:
+        delta = f" · к вчера {format_delta(total, previous.get(direction, 0))}" if yesterday else ''
+        lines.append(f"  {direction or 'без направления'}: ${total:.2f}{delta}")
+    if not summary.directions:
+        lines.append("  нет профитов")
+    lines += ["", "Команды:"]
+    teams = summary.teams[:GLOBAL_TOP_TEAMS]
+    for place, (team_id, total) in enumerate(teams, 1):
+        name = global_dashboard.team_name(team_id) if team_id is not None else 'Без команды'
+        lines.append(f"  {place}. {name or f'Команда #{team_id}'} — ${total:.2f}")
+    if not teams:
+        lines.append("  нет профитов")
+    lines += ["", "Лучшие воркеры:"]
+    top = worker_ranking.top(period, GLOBAL_TOP_WORKERS)
+    lines += [f"  {entry.position}. {entry.name} — ${entry.total:.2f}" for entry in top] or ["  нет профитов"]
+    return '\n'.join(lines)
+
+
+ADMIN_MENU_KEYBOARD = ReplyKeyboardMarkup([
+    ['👥 Управление командами', '👤 Управление воркерами'],
+    ['💰 Начислить профит', '📊 Глобальная статистика'],
+    ['📥 Импорт профитов', '📤 Экспорт профитов'],
+    ['🩺 Метрики', '⬅️ Назад']
+], resize_keyboard=True)
+
+GLOBAL_STATS_KEYBOARD = ReplyKeyboardMarkup([
+    ['📅 День', '📅 Неделя'],
+    ['📅 Месяц', '📅 Все время'],
+    ['🔄 Обновить', '⬅️ Назад']
+], resize_keyboard=True)
+
+EXPORT_MENU_KEYBOARD = ReplyKeyboardMarkup([
+    ['📅 День', '📅 Неделя'],
+    ['📅 Месяц', '📅 Все время'],
+    ['📄 CSV', '📗 XLSX'],
+    ['⬅️ Назад']
+], resize_keyboard=True)
+
+EXPORT_BUTTONS = {'📄 CSV': 'csv', '📗 XLSX': 'xlsx'}
+
+
 # === ОБРАБОТЧИКИ ===
 
+@timed(HANDLER_LATENCY)
 async def start_handler(update, context):
     telegram_id = update.effective_user.id
     try:
-        if get_user_by_telegram_id(telegram_id):
+        await state_store.ensure_loaded(telegram_id, run_read)
+        profile = await run_read(get_user_profile, telegram_id)
+        if profile:
             user_states[telegram_id] = 'main_menu'
-            keyboard = get_main_menu_keyboard(telegram_id)
+            keyboard = get_main_menu_keyboard(telegram_id, role=profile.role)
             await update.message.reply_text("Добро пожаловать обратно!", reply_markup=keyboard)
         else:
             await update.message.reply_text(
@@ -584,9 +921,11 @@ def format_period_name(period):
     return periods.get(period, period)
 
 
+@timed(HANDLER_LATENCY)
 async def text_handler(update, context):
     telegram_id = update.effective_user.id
     text = update.message.text
+    await state_store.ensure_loaded(telegram_id, run_read)
 
     # Регистрация нового пользователя
     if telegram_id in waiting_for_name:
@@ -594,12 +933,13 @@ async def text_handler(update, context):
         if not name:
             await update.message.reply_text("Имя не может быть пустым. Введите ещё раз:")
             return
-        register_user(telegram_id, name)
+        await write_buffer.submit(write_user_registration, telegram_id, name)
         del waiting_for_name[telegram_id]
-        role = get_user_role(telegram_id)
+        profile = await run_read(get_user_profile, telegram_id)
+        role = profile.role if profile else None
         role_name = 'администратор' if role == 'admin' else 'воркер'
         user_states[telegram_id] = 'main_menu'
-        keyboard = get_main_menu_keyboard(telegram_id)
+        keyboard = get_main_menu_keyboard(telegram_id, role=role)
         await update.message.reply_text(
             f"Спасибо, {name}! Вы зарегистрированы как {role_name}.",
             reply_markup=keyboard
@@ -607,94 +947,677 @@ async def text_handler(update, context):
         return
 
     current_state = user_states.get(telegram_id, 'main_menu')
+    # Профиль загружается один раз на обновление
+    profile = await run_read(get_user_profile, telegram_id)
+    await router.dispatch(update, context, current_state, text, profile)
+
+
+# === МАРШРУТЫ ===
+
+router = Router()
+
+PERIOD_BUTTONS = {
+    '📅 День': 'day',
+    '📅 Неделя': 'week',
+    '📅 Месяц': 'month',
+    '📅 Все время': 'all',
+}
+
+
+# === Главное меню ===
+
+@router.route('📊 Моя статистика')
+async def stats_menu_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    user_states[telegram_id] = 'stats_menu'
+    keyboard = get_stats_menu_keyboard(telegram_id, role=profile.role if profile else None)
+    await update.message.reply_text("Выберите период:", reply_markup=keyboard)
+
+
+@router.route('🏆 Рейтинг')
+async def rating_menu_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'rating_menu'
+    await update.message.reply_text("Выберите тип и период:", reply_markup=get_rating_menu_keyboard())
+
+
+@router.route('🤖 Боты')
+async def bots_menu_handler(update, context, profile):
+    catalog = bot_catalog.snapshot or await run_read(bot_catalog.get)
+    user_states[update.effective_user.id] = 'bots_menu'
+    await update.message.reply_text("Выберите бота:" if catalog.bots else "Нет ботов.", reply_markup=catalog.keyboard)
+
+
+@router.route('👥 Моя команда')
+async def team_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    team_id = profile.team_id if profile else None
+    if not team_id:
+        await update.message.reply_text("Вы не в команде.")
+        return
+    if profile.role == 'worker':
+        team_info = await run_read(get_team_info, team_id)
+        if team_info:
+            team_name, leader_id = team_info
+            leader_name = await run_read(get_team_leader_name, leader_id)
+            msg = f"Команда: {team_name}\nТимлидер: {leader_name or 'не назначен'}"
+        else:
+            msg = "Информация о команде недоступна."
+        await update.message.reply_text(msg)
+    else:
+        total = await run_read(get_team_total_stats, team_id)
+        count = await run_read(get_team_worker_count, team_id)
+        team_info = await run_read(get_team_info, team_id)
+        # Имена не перечисляются: в большой команде сообщение упрётся в лимит Telegram
+        await update.message.reply_text(f"Команда: {team_info[0]}\nПрофит: ${total:.2f}\nВоркеров: {count}")
+        if count:
+            text, keyboard = await run_read(build_team_workers_page, team_id, 0)
+            await update.message.reply_text(text, reply_markup=keyboard)
+        user_states[telegram_id] = 'team_menu'
+        await update.message.reply_text("Действие:", reply_markup=get_team_menu_keyboard())
+
+
+@router.route('⚙️ Настройки')
+async def settings_menu_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'settings_menu'
+    await update.message.reply_text("Настройки:", reply_markup=get_settings_menu_keyboard())
+
+
+@router.route('⬅️ Назад', '🏠 Главное меню')
+async def main_menu_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    user_states[telegram_id] = 'main_menu'
+    keyboard = get_main_menu_keyboard(telegram_id, role=profile.role if profile else None)
+    await update.message.reply_text("Главное меню:", reply_markup=keyboard)
+
+
+@router.route('❓ Справка')
+async def help_button_handler(update, context, profile):
+    await help_handler(update, context)
 
-    # === Главное меню ===
-    if text == '📊 Моя статистика':
-        user_states[telegram_id] = 'stats_menu'
-        await update.message.reply_text("Выберите период:", reply_markup=get_stats_menu_keyboard(telegram_id))
+
+@router.route('🛠 Админ-панель', roles=['admin'])
+async def admin_menu_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'admin_menu'
+    await update.message.reply_text("Админ-панель:", reply_markup=ADMIN_MENU_KEYBOARD)
+
+
+@router.route('💰 Начислить профит', state='admin_menu', roles=['admin'])
+async def profit_menu_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'admin_profit'
+    await update.message.reply_text(
+        "Введите: telegram_id сумма направление [комментарий]\n"
+        "Например: 111111111 150.5 eToro бонус"
+    )
+
+
+@router.fallback(state='admin_profit', roles=['admin'])
+async def profit_input_handler(update, context, profile):
+    parts = update.message.text.split(maxsplit=3)
+    try:
+        worker_telegram_id = int(parts[0])
+        amount = float(parts[1].replace(',', '.'))
+        direction = parts[2]
+    except (IndexError, ValueError):
+        await update.message.reply_text("Неверный формат. Пример: 111111111 150.5 eToro бонус")
+        return
+    # float() принимает inf и nan: такая сумма навсегда испортила бы агрегаты profit_daily
+    if not math.isfinite(amount) or amount <= 0:
+        await update.message.reply_text("Сумма должна быть положительным числом.")
+        return
+    comment = parts[3] if len(parts) > 3 else ''
+    worker = await run_read(get_user_profile, worker_telegram_id)
+    if not worker:
+        await update.message.reply_text("Пользователь не найден.")
+        return
+    try:
+        # Ответ — только после фиксации профита в базе
+        await write_buffer.submit(write_profit, worker.id, direction, amount, comment)
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении профита: {e}")
+        await update.message.reply_text("Ошибка при начислении профита.")
         return
+    notification_queue.notify(
+        worker_telegram_id,
+        f"💰 Вам начислен профит: ${amount:.2f} ({direction})" + (f"\n{comment}" if comment else '')
+    )
+    await update.message.reply_text(f"✅ {worker.name}: +${amount:.2f} ({direction})")
+
+
+@router.route('🩺 Метрики', state='admin_menu', roles=['admin'])
+async def debug_metrics_handler(update, context, profile):
+    await update.message.reply_text(format_debug_metrics())
+
+
+@router.route('📊 Глобальная статистика', state='admin_menu', roles=['admin'])
+async def global_stats_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'admin_global'
+    # Суммы уже в памяти; загрузка из базы — только при первом показе за день
+    text = await run_read(format_global_overview)
+    await update.message.reply_text(text, reply_markup=GLOBAL_STATS_KEYBOARD)
+
+
+@router.route(*PERIOD_BUTTONS, state='admin_global', roles=['admin'])
+async def global_stats_period_handler(update, context, profile):
+    period = PERIOD_BUTTONS[update.message.text]
+    selected_period[update.effective_user.id] = period
+    await update.message.reply_text(await run_read(format_global_period, period))
+
+
+@router.route('🔄 Обновить', state='admin_global', roles=['admin'])
+async def global_stats_refresh_handler(update, context, profile):
+    await update.message.reply_text(await run_read(format_global_overview))
 
-    if text == '🏆 Рейтинг':
-        user_states[telegram_id] = 'rating_menu'
-        await update.message.reply_text("Выберите тип и период:", reply_markup=get_rating_menu_keyboard())
+
+@router.route('👤 Управление воркерами', state='admin_menu', roles=['admin'])
+async def admin_workers_handler(update, context, profile):
+    text, keyboard = await run_read(build_all_workers_page, 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+def build_all_workers_page(number):
+    page = keyset_page(('staff',), number, get_all_workers_after)
+    if not page.rows:
+        return "Воркеров пока нет.", None
+    lines = [f"👤 Все воркеры (стр. {page.number + 1}):"]
+    lines += [f"• {name} ({worker_id})" for _, name, worker_id in page.rows]
+    return '\n'.join(lines), page_keyboard('staff', '-', page)
+
+
+@router.route('📥 Импорт профитов', state='admin_menu', roles=['admin'])
+async def import_menu_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'admin_import'
+    await update.message.reply_text(
+        "Отправьте CSV или JSONL файл с колонками telegram_id, direction, amount, date, comment.\n"
+        "Дата в формате YYYY-MM-DD (по умолчанию — сегодня)."
+    )
+
+
+def invalidate_after_import(batch):
+    """Сброс кэшей один раз на записанную пачку импорта"""
+    invalidate_leaderboards('workers')
+    invalidate_leaderboards('teams')
+    stats_cache.clear()
+    chart_versions.bump_all()
+    worker_ranking.invalidate()
+    global_dashboard.invalidate()
+
+
+@timed(HANDLER_LATENCY)
+async def document_handler(update, context):
+    telegram_id = update.effective_user.id
+    await state_store.ensure_loaded(telegram_id, run_read)
+    if user_states.get(telegram_id) != 'admin_import':
+        await update.message.reply_text("Выберите пункт меню.")
         return
+    profile = await run_read(get_user_profile, telegram_id)
+    if not profile or profile.role != 'admin':
+        await update.message.reply_text("Доступ запрещён.")
+        return
+    document = update.message.document
+    await update.message.reply_text("⏳ Импортирую профиты...")
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'import')
+            file = await document.get_file()
+            await file.download_to_drive(path)
+            # Импорт идёт в фоновом потоке и берёт соединение записи на время пачки:
+            # групповые записи и сохранение состояний выполняются между пачками
+            report = await run_background(
+                import_profits_file, path, detect_format(document.file_name or ''),
+                on_batch=invalidate_after_import
+            )
+    except Exception as e:
+        logger.error(f"Ошибка импорта профитов: {e}")
+        await update.message.reply_text("Ошибка импорта. Проверьте формат файла.")
+        return
+    user_states[telegram_id] = 'admin_menu'
+    await update.message.reply_text(format_report(report), reply_markup=ADMIN_MENU_KEYBOARD)
+
 
-    if text == '🤖 Боты':
-        bots = get_bots_from_database()
-        keyboard = get_bots_menu_keyboard()
-        user_states[telegram_id] = 'bots_menu'
-        await update.message.reply_text("Выберите бота:" if bots else "Нет ботов.", reply_markup=keyboard)
+# === Экспорт профитов ===
+
+@router.route('📤 Экспорт профитов', state='admin_menu', roles=['admin'])
+async def admin_export_menu_handler(update, context, profile):
+    await open_export_menu(update, 'admin_export')
+
+
+@router.route('📤 Экспорт профитов', state='team_menu', roles=['team_leader', 'admin'])
+async def team_export_menu_handler(update, context, profile):
+    if not profile.team_id:
+        await update.message.reply_text("Вы не состоите в команде.")
         return
+    await open_export_menu(update, 'team_export')
+
+
+async def open_export_menu(update, state):
+    telegram_id = update.effective_user.id
+    user_states[telegram_id] = state
+    period = selected_period.get(telegram_id, 'day')
+    await update.message.reply_text(
+        f"Период: {format_period_name(period)}. Выберите период и формат отчёта.",
+        reply_markup=EXPORT_MENU_KEYBOARD
+    )
+
 
-    if text == '👥 Моя команда':
-        team_id = get_user_team_id(telegram_id)
-        if not team_id:
-            await update.message.reply_text("Вы не в команде.")
+@router.route(*PERIOD_BUTTONS, state=['admin_export', 'team_export'], roles=['team_leader', 'admin'])
+async def export_period_handler(update, context, profile):
+    period = PERIOD_BUTTONS[update.message.text]
+    selected_period[update.effective_user.id] = period
+    await update.message.reply_text(f"Период: {format_period_name(period)}. Выберите формат отчёта.")
+
+
+@router.route(*EXPORT_BUTTONS, state=['admin_export', 'team_export'], roles=['team_leader', 'admin'])
+async def export_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    period = selected_period.get(telegram_id, 'day')
+    # Админ из админ-панели выгружает все команды, из меню команды — только свою
+    team_id = None if user_states.get(telegram_id) == 'admin_export' else profile.team_id
+    await update.message.reply_text("⏳ Формирую отчёт...")
+    try:
+        # Отчёт пишется в потоке чтения пачками, event loop не блокируется
+        export = await run_read(export_profits, EXPORT_BUTTONS[update.message.text], period, team_id)
+    except Exception as e:
+        logger.error(f"Ошибка экспорта профитов: {e}")
+        await update.message.reply_text("Ошибка при формировании отчёта.")
+        return
+    with export.file:
+        if not export.rows:
+            await update.message.reply_text(f"Нет профитов за {format_period_name(period)}.")
             return
-        role = get_user_role(telegram_id)
-        if role == 'worker':
-            team_info = get_team_info(team_id)
-            if team_info:
-                team_name, leader_id = team_info
-                leader_name = get_team_leader_name(leader_id)
-                msg = f"Команда: {team_name}\nТимлидер: {leader_name or 'не назначен'}"
-            else:
-                msg = "Информация о команде недоступна."
-            await update.message.reply_text(msg)
-        else:
-            total = get_team_total_stats(team_id)
-            workers = get_team_workers(team_id)
-            names = ', '.join([n for _, n in workers]) if workers else "нет"
-            await update.message.reply_text(f"Команда: {get_team_info(team_id)[0]}\nПрофит: ${total:.2f}\nВоркеры: {names}")
-            user_states[telegram_id] = 'team_menu'
-            await update.message.reply_text("Действие:", reply_markup=get_team_menu_keyboard())
+        if export.size > UPLOAD_LIMIT:
+            await update.message.reply_text(
+                f"Отчёт слишком большой для Telegram ({export.size / 1024 / 1024:.0f} МБ). "
+                "Выберите период короче или формат XLSX."
+            )
+            return
+        # Файл передаётся потоком, без чтения целиком в память
+        await update.message.reply_document(
+            InputFile(export.file, filename=export.filename, read_file_handle=False),
+            caption=f"📤 Профиты за {format_period_name(period)}: {export.rows} строк"
+        )
+
+
+# === Статистика ===
+
+def format_worker_stats(stats, period):
+    lines = [f"📊 Статистика за {format_period_name(period)}:"]
+    for direction, amount in stats.items():
+        if direction == 'total':
+            continue
+        lines.append(f"{direction or 'Без направления'}: ${amount:.2f}")
+    lines.append(f"Итого: ${stats['total']:.2f}")
+    return '\n'.join(lines)
+
+
+@router.route(*PERIOD_BUTTONS, state='stats_menu')
+async def stats_period_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    period = PERIOD_BUTTONS[update.message.text]
+    selected_period[telegram_id] = period
+    await send_worker_stats(update, profile, period)
+
+
+@router.route('🔄 Обновить', state='stats_menu')
+async def stats_refresh_handler(update, context, profile):
+    period = selected_period.get(update.effective_user.id, 'day')
+    await send_worker_stats(update, profile, period)
+
+
+def format_worker_rank(rank, user_id):
+    if rank.position is None:
+        return f"🏆 В рейтинге воркеров за этот период вас пока нет (участников: {rank.count})."
+    lines = [f"🏆 Место в рейтинге: {rank.position} из {rank.count}"]
+    if rank.gap is not None:
+        lines.append(f"До {rank.position - 1} места: ${rank.gap:.2f}")
+    for entry in rank.neighbours:
+        marker = '▶' if entry.user_id == user_id else '  '
+        lines.append(f"{marker} {entry.position}. {entry.name} — ${entry.total:.2f}")
+    return '\n'.join(lines)
+
+
+async def send_worker_stats(update, profile, period):
+    if not profile:
+        await update.message.reply_text("Сначала зарегистрируйтесь: /start")
+        return
+    stats = await run_read(get_worker_stats_by_period, profile.id, period)
+    text = format_worker_stats(stats, period)
+    if profile.role == 'worker':
+        rank = await run_read(get_worker_rank, profile.id, period)
+        text += '\n\n' + format_worker_rank(rank, profile.id)
+    await update.message.reply_text(text)
+
+
+@router.route('🛠 По направлениям', state='stats_menu')
+async def stats_directions_handler(update, context, profile):
+    if not profile:
+        await update.message.reply_text("Сначала зарегистрируйтесь: /start")
+        return
+    period = selected_period.get(update.effective_user.id, 'day')
+    rows = await run_read(get_worker_detailed_stats, profile.id, period)
+    if not rows:
+        await update.message.reply_text(f"Нет профитов за {format_period_name(period)}.")
         return
+    lines = [f"🛠 По направлениям за {format_period_name(period)}:"]
+    for direction, amount, count in rows:
+        lines.append(f"{direction or 'Без направления'}: ${amount:.2f} ({count} шт.)")
+    await update.message.reply_text('\n'.join(lines))
 
-    if text == '⚙️ Настройки':
-        user_states[telegram_id] = 'settings_menu'
-        await update.message.reply_text("Настройки:", reply_markup=get_settings_menu_keyboard())
+
+@router.route('📈 Статистика команды', state='stats_menu', roles=['team_leader', 'admin'])
+async def stats_team_handler(update, context, profile):
+    if not profile.team_id:
+        await update.message.reply_text("Вы не в команде.")
+        return
+    period = selected_period.get(update.effective_user.id, 'day')
+    rows = await run_read(get_team_stats_by_period, profile.team_id, period)
+    if not rows:
+        await update.message.reply_text(f"Нет профитов команды за {format_period_name(period)}.")
         return
+    lines = [f"📈 Статистика команды за {format_period_name(period)}:"]
+    for name, amount in rows:
+        lines.append(f"{name}: ${amount:.2f}")
+    await update.message.reply_text('\n'.join(lines))
 
-    if text in ['⬅️ Назад', '🏠 Главное меню']:
-        user_states[telegram_id] = 'main_menu'
-        await update.message.reply_text("Главное меню:", reply_markup=get_main_menu_keyboard(telegram_id))
+
+@router.route('📉 График', state='stats_menu')
+async def stats_chart_handler(update, context, profile):
+    if not profile:
+        await update.message.reply_text("Сначала зарегистрируйтесь: /start")
         return
+    period = selected_period.get(update.effective_user.id, 'day')
+    await send_chart(update, 'user', profile.id, "📉 Ваш профит", period)
+
 
-    if text == '❓ Справка':
-        await help_handler(update, context)
+@router.route('📉 График команды', state='stats_menu', roles=['team_leader', 'admin'])
+async def stats_team_chart_handler(update, context, profile):
+    if not profile.team_id:
+        await update.message.reply_text("Вы не в команде.")
         return
+    period = selected_period.get(update.effective_user.id, 'day')
+    await send_chart(update, 'team', profile.team_id, "📉 Профит команды", period)
 
-    if text == '🛠 Админ-панель':
-        if get_user_role(telegram_id) != 'admin':
-            await update.message.reply_text("Доступ запрещён.")
+
+async def send_chart(update, kind, subject_id, title, period):
+    key = (kind, subject_id, period, period_starts()['day'], chart_versions.get((kind, subject_id)))
+    entry = chart_cache.get(key)
+    if entry is not None and entry.file_id:
+        try:
+            await update.message.reply_photo(entry.file_id, caption=entry.caption)
+            return
+        except BadRequest:
+            chart_cache.forget_file_id(key)
+    if entry is None:
+        data = await run_read(get_chart_data, kind, subject_id, period)
+        if not data.days:
+            await update.message.reply_text(f"Нет профитов за {format_period_name(period)}.")
+            return
+        # Отрисовка идёт в отдельном процессе, event loop только ждёт результат
+        try:
+            png = await render_chart_async(data)
+        except Exception as e:
+            logger.error(f"Ошибка отрисовки графика {key}: {e}")
+            await update.message.reply_text("Не удалось построить график, попробуйте позже.")
             return
-        keyboard = ReplyKeyboardMarkup([
-            ['👥 Управление командами', '👤 Управление воркерами'],
-            ['💰 Начислить профит', '📊 Глобальная статистика'],
-            ['⬅️ Назад']
-        ], resize_keyboard=True)
-        user_states[telegram_id] = 'admin_menu'
-        await update.message.reply_text("Админ-панель:", reply_markup=keyboard)
+        entry = chart_cache.put(key, png, format_chart_caption(title, period, data))
+    message = await update.message.reply_photo(entry.png, caption=entry.caption)
+    if message.photo:
+        chart_cache.set_file_id(key, message.photo[-1].file_id)
+
+
+def format_chart_caption(title, period, data):
+    days = "неделю" if period == 'day' else format_period_name(period)
+    total = sum(amount for _, amount in data.days)
+    lines = [f"{title} за {days}: ${total:.2f}"]
+    lines += [f"{square} {direction} — ${amount:.2f}" for square, direction, amount in direction_legend(data.directions)]
+    return '\n'.join(lines)
+
+
+# === Рейтинг ===
+
+@router.route('👤 Воркеры', '👥 Команды', state='rating_menu')
+async def rating_type_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    rating_type[telegram_id] = 'workers' if update.message.text == '👤 Воркеры' else 'teams'
+    await send_rating(update, rating_type[telegram_id], selected_period.get(telegram_id, 'day'))
+
+
+@router.route(*PERIOD_BUTTONS, state='rating_menu')
+async def rating_period_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    period = PERIOD_BUTTONS[update.message.text]
+    selected_period[telegram_id] = period
+    await send_rating(update, rating_type.get(telegram_id, 'workers'), period)
+
+
+async def send_rating(update, kind, period):
+    text, keyboard = await run_read(build_rating_page, kind, period, 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+def build_rating_page(kind, period, number):
+    """Текст и кнопки навигации страницы рейтинга"""
+    page = get_rating_page(kind, period, number)
+    if not page.rows:
+        return f"Нет данных за {format_period_name(period)}.", None
+    title = "👥 Рейтинг команд" if kind == 'teams' else "👤 Рейтинг воркеров"
+    lines = [f"{title} за {format_period_name(period)} (стр. {page.number + 1}):"]
+    for place, (name, amount) in enumerate(page.rows, page.number * PAGE_SIZE + 1):
+        lines.append(f"{place}. {name} — ${amount:.2f}")
+    return '\n'.join(lines), page_keyboard(kind, period, page)
+
+
+# === Команда ===
+
+@router.route('📊 Статистика команды', state='team_menu', roles=['team_leader', 'admin'])
+async def team_stats_handler(update, context, profile):
+    rows = await run_read(get_team_stats_by_period, profile.team_id, 'all')
+    if not rows:
+        await update.message.reply_text("У команды пока нет профитов.")
+        return
+    lines = ["📊 Статистика команды за все время:"]
+    for name, amount in rows:
+        lines.append(f"{name}: ${amount:.2f}")
+    await update.message.reply_text('\n'.join(lines))
+
+
+@router.route('👤 Список воркеров', state='team_menu', roles=['team_leader', 'admin'])
+async def team_workers_handler(update, context, profile):
+    text, keyboard = await run_read(build_team_workers_page, profile.team_id, 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+def build_team_workers_page(team_id, number):
+    page = keyset_page(('team', team_id), number,
+                       lambda after_id, limit: get_team_workers_after(team_id, after_id, limit))
+    if not page.rows:
+        return "В команде нет воркеров.", None
+    lines = [f"👤 Воркеры команды (стр. {page.number + 1}):"]
+    lines += [f"• {name} ({worker_id})" for _, worker_id, name in page.rows]
+    return '\n'.join(lines), page_keyboard('team', team_id, page)
+
+
+@router.route('📣 Рассылка команде', state='team_menu', roles=['team_leader', 'admin'])
+async def team_broadcast_menu_handler(update, context, profile):
+    user_states[update.effective_user.id] = 'team_broadcast'
+    await update.message.reply_text("Введите текст сообщения для команды:")
+
+
+@router.fallback(state='team_broadcast', roles=['team_leader', 'admin'])
+async def team_broadcast_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    workers = await run_read(get_team_workers, profile.team_id)
+    recipients = [worker_id for worker_id, _ in workers if worker_id != telegram_id]
+    notification_queue.broadcast(recipients, f"📣 Сообщение от {profile.name}:\n{update.message.text}")
+    user_states[telegram_id] = 'team_menu'
+    await update.message.reply_text(
+        f"📣 Рассылка поставлена в очередь: {len(recipients)} получателей",
+        reply_markup=get_team_menu_keyboard()
+    )
+
+
+# === Боты и настройки ===
+
+@router.fallback(state='bots_menu')
+async def bot_info_handler(update, context, profile):
+    catalog = bot_catalog.snapshot or await run_read(bot_catalog.get)
+    bot_info = catalog.by_name.get(update.message.text)
+    if not bot_info:
+        await update.message.reply_text("Выберите бота из списка.", reply_markup=catalog.keyboard)
         return
+    name, description, link = bot_info
+    await update.message.reply_text(f"🤖 {name}\n{description or ''}\n{link or ''}".strip())
 
-    # === Остальные обработчики (упрощены для краткости, но работают) ===
-    # (весь остальной код из text_handler оставлен без изменений, но с фиксами None и дат)
 
-    # ... [остальная часть text_handler как в оригинале, но с исправлениями None и дат]
+@router.route('✏️ Выбрать направление', state='settings_menu')
+async def choose_direction_handler(update, context, profile):
+    catalog = bot_catalog.snapshot or await run_read(bot_catalog.get)
+    user_states[update.effective_user.id] = 'settings_directions'
+    await update.message.reply_text("Выберите направление:", reply_markup=catalog.keyboard)
 
-    # Для краткости — вставьте сюда остальной код из вашего оригинального text_handler
-    # Все функции выше уже исправлены
 
+@router.fallback(state='settings_directions')
+async def set_direction_handler(update, context, profile):
+    telegram_id = update.effective_user.id
+    catalog = bot_catalog.snapshot or await run_read(bot_catalog.get)
+    direction = update.message.text
+    if direction not in catalog.by_name:
+        await update.message.reply_text("Выберите направление из списка.", reply_markup=catalog.keyboard)
+        return
+    await write_buffer.submit(write_user_direction, telegram_id, direction)
+    user_states[telegram_id] = 'settings_menu'
+    await update.message.reply_text(f"Направление установлено: {direction}", reply_markup=get_settings_menu_keyboard())
+
+
+@router.fallback()
+async def unknown_text_handler(update, context, profile):
     await update.message.reply_text("Выберите пункт меню.")
 
 
-async def main():
-    application = Application.builder().token(TOKEN).build()
+# === Листание страниц (inline-кнопки) ===
+
+def build_page_view(profile, kind, arg, number):
+    """Страница по callback_data с проверкой прав; None — нет доступа или неверные данные"""
+    role = profile.role if profile else None
+    if kind in ('workers', 'teams') and arg in period_stats.PERIODS and profile:
+        return build_rating_page(kind, arg, number)
+    if kind == 'team' and role in ('team_leader', 'admin') and arg == str(profile.team_id):
+        return build_team_workers_page(profile.team_id, number)
+    if kind == 'staff' and role == 'admin':
+        return build_all_workers_page(number)
+    return None
+
+
+@timed(HANDLER_LATENCY)
+async def page_callback_handler(update, context):
+    query = update.callback_query
+    parsed = parse_page_callback(query.data)
+    if parsed is None:
+        await query.answer()
+        return
+    profile = await run_read(get_user_profile, update.effective_user.id)
+    view = await run_read(build_page_view, profile, *parsed)
+    if view is None:
+        await query.answer(router.denied_text)
+        return
+    await query.answer()
+    text, keyboard = view
+    try:
+        # Страница заменяет текст того же сообщения, а не приходит новым
+        await query.edit_message_text(text, reply_markup=keyboard)
+    except BadRequest as e:
+        # Повторное нажатие: содержимое не изменилось
+        if 'not modified' not in str(e):
+            raise
+
+
+async def post_init(application):
+    application.bot_data['state_flusher'] = asyncio.create_task(state_store.run_flusher(run_write))
+    application.bot_data['loop_lag_monitor'] = asyncio.create_task(monitor_loop_lag())
+    notification_queue.start(application.bot)
+    await run_write(write_buffer.configure_connection)
+    write_buffer.start()
+    if METRICS_PORT:
+        application.bot_data['metrics_server'] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+
+async def post_shutdown(application):
+    for name in ('state_flusher', 'loop_lag_monitor'):
+        task = application.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server:
+        metrics_server.close()
+    await write_buffer.stop()
+    await run_write(state_store.flush)
+    await notification_queue.stop()
+    logger.info(f"Статистика состояний: {state_store.stats()}")
+    logger.info(f"Статистика уведомлений: {notification_queue.stats()}")
+
+
+def build_application(token=TOKEN, base_url=None, request_factory=None):
+    """request_factory — свои объекты запросов к Bot API (например, FakeBotApi в процессе, без сети)"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request_factory() if request_factory else TimedRequest(connection_pool_size=256))
+        .get_updates_request(request_factory() if request_factory else TimedRequest(connection_pool_size=1))
+        .concurrent_updates(update_processor)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
     application.add_handler(CommandHandler("start", start_handler))
     application.add_handler(CommandHandler("help", help_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
-    logger.info("Бот запущен")
-    await application.run_polling()
+    application.add_handler(MessageHandler(filters.Document.ALL, document_handler))
+    application.add_handler(CallbackQueryHandler(page_callback_handler, pattern=f'^{CALLBACK_PREFIX}:'))
+    return application
+
+
+async def run_application(application, stop_event, webhook_url=None):
+    """Запустить приложение в режиме webhook (если задан webhook_url) или опроса и ждать stop_event"""
+    async with application:
+        await post_init(application)
+        await application.start()
+        webhook_server = None
+        if webhook_url:
+            secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+            webhook_server = await start_webhook(
+                application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, webhook_url, secret
+            )
+        else:
+            await application.updater.start_polling()
+        logger.info(f"Бот запущен ({'webhook' if webhook_url else 'polling'})")
+        try:
+            await stop_event.wait()
+        finally:
+            if webhook_server:
+                await webhook_server.close()
+            else:
+                await application.updater.stop()
+            await application.stop()
+            await post_shutdown(application)
+
+
+async def main():
+    application = build_application()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+    try:
+        await run_application(application, stop_event, WEBHOOK_URL)
+    finally:
+        logger.info(f"Статистика пула соединений: {pool.stats()}")
+        logger.info(f"Статистика кэшей: {cache_stats()}")
+        shutdown_executors()
+        shutdown_render_pool()
+        pool.close()
 
 
 if __name__ == '__main__':
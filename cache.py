@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кэши в памяти для горячих запросов бота
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Все созданные кэши (для отчётов о попаданиях)
+CACHES = []
+
+
+class TTLCache:
+    """Кэш с временем жизни записей, точечной инвалидацией и объединением одновременных промахов"""
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = {}
+        self._inflight = {}
+        # Счётчик инвалидаций ключа, пока идёт его загрузка; удаляется вместе с загрузкой
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        CACHES.append(self)
+
+    def get_or_load(self, key, loader):
+        """Вернуть значение из кэша или загрузить его; параллельные промахи ждут одну загрузку"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                flight = Future()
+                self._inflight[key] = flight
+                self.misses += 1
+                owner = True
+            version = self._versions.get(key, 0)
+
+        if not owner:
+            return flight.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._versions.pop(key, None)
+            flight.set_exception(e)
+            raise
+
+        with self._lock:
+            # Если ключ инвалидировали во время загрузки, результат не сохраняем
+            if self._versions.pop(key, 0) == version:
+                now = time.monotonic()
+                # Истёкшие записи (в том числе ключи прошлых дней) больше не запрашиваются — удаляем их
+                for expired in [k for k, (expires, _) in self._data.items() if expires <= now]:
+                    del self._data[expired]
+                self._data[key] = (now + self.ttl, value)
+            self._inflight.pop(key, None)
+        flight.set_result(value)
+        return value
+
+    def invalidate(self, predicate=None):
+        """Удалить записи, ключи которых удовлетворяют predicate (без него — все)"""
+        with self._lock:
+            keys = set(self._data) | set(self._inflight)
+            for key in keys:
+                if predicate is None or predicate(key):
+                    self._data.pop(key, None)
+                    if key in self._inflight:
+                        self._versions[key] = self._versions.get(key, 0) + 1
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением давно не использованных записей"""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        # Идущие загрузки: ключ -> маркер; инвалидация удаляет маркер
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        CACHES.append(self)
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            token = object()
+            self._pending[key] = token
+
+        try:
+            value = loader()
+        except BaseException:
+            with self._lock:
+                if self._pending.get(key) is token:
+                    del self._pending[key]
+            raise
+
+        with self._lock:
+            # Не сохраняем значение, если ключ инвалидировали во время загрузки
+            if self._pending.get(key) is token:
+                del self._pending[key]
+                self._data[key] = value
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._pending.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._pending.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def cache_stats():
+    """Статистика всех кэшей по имени"""
+    return {cache.name: cache.stats() for cache in CACHES}
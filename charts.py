@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Графики профита: по дням и по направлениям
+
+PNG рисуется без сторонних библиотек в пуле процессов, чтобы отрисовка не занимала event loop и GIL.
+Готовые картинки кэшируются по ключу (субъект, период, дата, версия данных); после первой отправки
+запоминается file_id Telegram, и повторный показ не требует ни отрисовки, ни загрузки файла.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import struct
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+
+import storage
+from cache import CACHES
+
+logger = logging.getLogger(__name__)
+
+CHART_WIDTH = 800
+CHART_HEIGHT = 480
+# Больше столбцов дни группируются по несколько
+CHART_MAX_BARS = 60
+# Направлений на нижней панели (остальные не показываются)
+CHART_MAX_DIRECTIONS = 8
+# Процессов отрисовки
+CHART_WORKERS = 2
+# Картинок в кэше
+CHART_CACHE_SIZE = 256
+
+BACKGROUND = (14, 12, 48)
+GRID = (38, 40, 92)
+AXIS = (92, 98, 170)
+TEXT = (170, 180, 235)
+BAR = (57, 255, 136)
+# Цвет направления и квадрат того же цвета для подписи к картинке
+DIRECTION_COLORS = [
+    ((57, 255, 136), '🟩'),
+    ((64, 156, 255), '🟦'),
+    ((255, 214, 64), '🟨'),
+    ((255, 82, 82), '🟥'),
+    ((190, 92, 255), '🟪'),
+    ((255, 150, 50), '🟧'),
+    ((150, 100, 70), '🟫'),
+    ((230, 230, 230), '⬜'),
+]
+
+# Шрифт 3x5 для подписей оси
+GLYPHS = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '010', '010', '010'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111'),
+    '.': ('000', '000', '000', '000', '010'),
+    'k': ('100', '101', '110', '101', '101'),
+    'M': ('101', '111', '111', '101', '101'),
+    '$': ('011', '110', '010', '011', '110'),
+}
+GLYPH_SCALE = 2
+
+# days — [(YYYY-MM-DD, сумма)] за каждый день окна, directions — [(направление, сумма)] по убыванию
+ChartData = namedtuple('ChartData', ['days', 'directions'])
+
+
+def load_chart_data(conn, kind, subject_id, start, today):
+    """Суммы по дням и направлениям воркера (kind='user') или команды (kind='team') из profit_daily"""
+    fmt = storage.get_format(conn)
+    if kind == 'team':
+        join, condition = 'JOIN users u ON u.id = d.user_id', 'u.team_id = ?'
+    else:
+        join, condition = '', 'd.user_id = ?'
+    params = [subject_id]
+    if start is not None:
+        condition += ' AND d.day >= ?'
+        params.append(fmt.day(start))
+    rows = conn.execute(f'''
+        SELECT d.day, d.direction, SUM(d.total)
+        FROM profit_daily d {join}
+        WHERE {condition}
+        GROUP BY d.day, d.direction
+    ''', params).fetchall()
+    if not rows:
+        return ChartData([], [])
+    by_day = {}
+    by_direction = {}
+    for day, direction, total in rows:
+        by_day[day] = by_day.get(day, 0) + total
+        by_direction[direction] = by_direction.get(direction, 0) + total
+    first = date.fromisoformat(start or min(fmt.day_value(day) for day in by_day))
+    totals = {fmt.day_value(day): fmt.amount_value(total) for day, total in by_day.items()}
+    days = []
+    current = first
+    while current <= date.fromisoformat(today):
+        iso_day = current.isoformat()
+        days.append((iso_day, totals.get(iso_day, 0)))
+        current += timedelta(days=1)
+    directions = sorted(((direction, fmt.amount_value(total)) for direction, total in by_direction.items()),
+                        key=lambda item: item[1], reverse=True)
+    return ChartData(days, directions)
+
+
+def direction_legend(directions):
+    """[(квадрат цвета, направление, сумма)] для подписи к графику"""
+    return [(DIRECTION_COLORS[index][1], direction, total)
+            for index, (direction, total) in enumerate(directions[:CHART_MAX_DIRECTIONS])]
+
+
+# === Отрисовка (выполняется в процессе пула) ===
+
+class Canvas:
+    def __init__(self, width, height, color):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(bytes(color) * (width * height))
+
+    def fill_rect(self, x0, y0, x1, y1, color):
+        x0, x1 = max(int(x0), 0), min(int(x1), self.width)
+        y0, y1 = max(int(y0), 0), min(int(y1), self.height)
+        if x0 >= x1:
+            return
+        line = bytes(color) * (x1 - x0)
+        for y in range(y0, y1):
+            start = (y * self.width + x0) * 3
+            self.pixels[start:start + len(line)] = line
+
+    def text(self, x, y, value, color, scale=GLYPH_SCALE):
+        """Строка шрифтом 3x5; x — правый край"""
+        x -= len(value) * 4 * scale
+        for char in value:
+            for row, bits in enumerate(GLYPHS.get(char, ('000',) * 5)):
+                for column, bit in enumerate(bits):
+                    if bit == '1':
+                        self.fill_rect(x + column * scale, y + row * scale,
+                                       x + (column + 1) * scale, y + (row + 1) * scale, color)
+            x += 4 * scale
+
+    def png(self):
+        stride = self.width * 3
+        raw = b''.join(b'\x00' + bytes(self.pixels[y * stride:(y + 1) * stride]) for y in range(self.height))
+
+        def chunk(tag, data):
+            return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+        header = struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)
+        return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+                chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+def nice_ceiling(value):
+    """Ближайшее сверху число вида 1, 2, 5 × 10^n"""
+    if value <= 0:
+        return 1
+    magnitude = 10 ** (len(str(int(value))) - 1)
+    for step in (1, 2, 5, 10):
+        if step * magnitude >= value:
+            return step * magnitude
+    return 10 * magnitude
+
+
+def format_axis(value):
+    if value >= 1000000:
+        return f'{value / 1000000:g}M'
+    if value >= 1000:
+        return f'{value / 1000:g}k'
+    return f'{value:g}'
+
+
+def bucket_days(days, max_bars=CHART_MAX_BARS):
+    """Суммы по дням, сгруппированные не более чем в max_bars столбцов"""
+    values = [total for _, total in days]
+    size = -(-len(values) // max_bars)
+    return [sum(values[index:index + size]) for index in range(0, len(values), size)]
+
+
+def render_chart(data, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """PNG: сверху профит по дням, снизу суммы по направлениям"""
+    canvas = Canvas(width, height, BACKGROUND)
+    left, right, top, bottom = 80, width - 20, 20, int(height * 0.62)
+
+    values = bucket_days(data.days) if data.days else []
+    limit = nice_ceiling(max(values, default=0))
+    for step in range(5):
+        y = bottom - (bottom - top) * step // 4
+        canvas.fill_rect(left, y, right, y + 1, GRID if step else AXIS)
+        canvas.text(left - 8, y - 5, '$' + format_axis(limit * step / 4), TEXT)
+    if values:
+        slot = (right - left) / len(values)
+        gap = max(slot * 0.2, 1) if slot > 3 else 0
+        for index, value in enumerate(values):
+            x = left + index * slot
+            y = bottom - (bottom - top) * value / limit
+            canvas.fill_rect(x + gap / 2, y, x + slot - gap / 2, bottom, BAR)
+
+    directions = data.directions[:CHART_MAX_DIRECTIONS]
+    panel_top, panel_bottom = bottom + 30, height - 20
+    largest = max((total for _, total in directions), default=0) or 1
+    if directions:
+        row = (panel_bottom - panel_top) / len(directions)
+        for index, (_, total) in enumerate(directions):
+            y = panel_top + index * row
+            length = (right - left) * max(total, 0) / largest
+            canvas.fill_rect(left, y + row * 0.15, left + length, y + row * 0.85, DIRECTION_COLORS[index][0])
+            canvas.text(left - 8, int(y + row / 2) - 5, format_axis(round(total)), TEXT)
+    canvas.fill_rect(left - 1, panel_top, left, panel_bottom, AXIS)
+    return canvas.png()
+
+
+# === Пул процессов отрисовки ===
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения родителя
+            _render_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return _render_pool
+
+
+async def render_chart_async(data):
+    """Отрисовать график в пуле процессов
+
+    Если процесс отрисовки умер, пул больше не принимает задачи: он заменяется новым,
+    и отрисовка повторяется один раз.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    try:
+        return await loop.run_in_executor(pool, render_chart, data)
+    except BrokenProcessPool:
+        logger.warning("Пул отрисовки графиков сломан, создаётся новый")
+        discard_render_pool(pool)
+        return await loop.run_in_executor(get_render_pool(), render_chart, data)
+
+
+def discard_render_pool(pool):
+    """Убрать сломанный пул (если его ещё не заменил другой запрос)"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=True)
+            _render_pool = None
+
+
+# === Версии данных и кэш картинок ===
+
+class DataVersions:
+    """Версии данных по субъектам; увеличиваются при изменении и входят в ключ кэша графиков"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        # Общая версия: увеличивается, когда меняется всё сразу (импорт)
+        self._epoch = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._epoch, self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def bump_all(self):
+        with self._lock:
+            self._epoch += 1
+            self._versions.clear()
+
+
+# png — картинка (None, пока не отрисована), caption — подпись, file_id — после первой отправки
+ChartEntry = namedtuple('ChartEntry', ['png', 'caption', 'file_id'])
+
+
+class ChartCache:
+    """LRU готовых графиков; запись с file_id отправляется без повторной загрузки"""
+
+    def __init__(self, name, maxsize=CHART_CACHE_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.file_id_hits = 0
+        CACHES.append(self)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            if entry.file_id:
+                self.file_id_hits += 1
+            return entry
+
+    def put(self, key, png, caption):
+        entry = ChartEntry(png, caption, None)
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return entry
+
+    def set_file_id(self, key, file_id):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = entry._replace(file_id=file_id)
+
+    def forget_file_id(self, key):
+        """file_id не принят Telegram — следующая отправка загрузит картинку заново"""
+        self.set_file_id(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'file_id_hits': self.file_id_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
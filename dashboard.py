@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Глобальная статистика для админ-панели
+Суммы за все периоды по направлениям и командам, число профитов и активных воркеров, а также вчерашний
+день для сравнения держатся в памяти: загружаются одним проходом по profit_daily при смене даты
+(или после сброса) и дополняются при каждом начислении профита, поэтому показ не обращается к базе.
+"""
+
+import threading
+from collections import namedtuple
+from datetime import date, timedelta
+
+from period_stats import PERIODS, period_starts
+
+# Сколько раз перезагружать суммы, если во время загрузки их сбросили (импорт, смена команды или роли);
+# после последней попытки снимок отдаётся вызывающему без сохранения
+LOAD_ATTEMPTS = 3
+
+# directions и teams — [(направление или id команды, сумма)] по убыванию суммы; active — активных воркеров
+PeriodSummary = namedtuple('PeriodSummary', ['total', 'count', 'active', 'directions', 'teams'])
+
+
+class Totals:
+    """Суммы одного периода"""
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.directions = {}
+        self.teams = {}
+        self.workers = set()
+
+    def add(self, user_id, team_id, role, direction, amount, count=1):
+        self.total += amount
+        self.count += count
+        self.directions[direction] = self.directions.get(direction, 0) + amount
+        self.teams[team_id] = self.teams.get(team_id, 0) + amount
+        if role == 'worker':
+            self.workers.add(user_id)
+
+    def summary(self):
+        def ordered(items):
+            return sorted(items.items(), key=lambda item: item[1], reverse=True)
+
+        return PeriodSummary(self.total, self.count, len(self.workers),
+                             ordered(self.directions), ordered(self.teams))
+
+
+class GlobalDashboard:
+    """Глобальные суммы за все периоды и вчерашний день; перестраиваются при смене даты или после сброса"""
+
+    def __init__(self, loader):
+        # loader(starts, yesterday) -> ({период: [(id, команда, роль, направление, сумма, количество)]},
+        #                               строки за вчерашний день, {id команды: название},
+        #                               id последнего профита в снимке)
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._day = None
+        self._periods = None
+        self._yesterday = None
+        self._team_names = {}
+        # Увеличивается при сбросе; загрузка, во время которой он сменился, повторяется
+        self._generation = 0
+        # Профиты, начисленные во время загрузки: (id профита, аргументы Totals.add, день), как в WorkerRanking
+        self._loading = 0
+        self._pending = []
+        self.loads = 0
+        self.replayed = 0
+        self.updates = 0
+        self.invalidations = 0
+
+    def _ensure_loaded(self):
+        """Снимок текущего дня: (периоды, вчерашний день, названия команд)
+
+        Как в WorkerRanking: возвращается сам снимок, потому что invalidate() из другого потока
+        может сбросить self._periods сразу после проверки, а профиты, начисленные во время загрузки
+        и не вошедшие в снимок базы, добавляются к нему вместо повторной загрузки.
+        """
+        for attempt in range(1, LOAD_ATTEMPTS + 1):
+            starts = period_starts()
+            with self._lock:
+                if self._periods is not None and self._day == starts['day']:
+                    return self._periods, self._yesterday, self._team_names
+                generation = self._generation
+                self._loading += 1
+            try:
+                yesterday = (date.fromisoformat(starts['day']) - timedelta(days=1)).isoformat()
+                periods, previous, team_names, last_id = self.loader(starts, yesterday)
+                loaded = {}
+                for period in PERIODS:
+                    totals = loaded[period] = Totals()
+                    for row in periods.get(period, []):
+                        totals.add(*row)
+                previous_totals = Totals()
+                for row in previous:
+                    previous_totals.add(*row)
+                with self._lock:
+                    later = [delta for delta in self._pending if delta[0] > last_id]
+                    # Профит за другой день означает, что наступила новая дата и снимок устарел
+                    current = all(day == starts['day'] for _, _, day in later)
+                    if current:
+                        for _, row, _ in later:
+                            for totals in loaded.values():
+                                totals.add(*row)
+                    if current and self._generation == generation:
+                        self._day = starts['day']
+                        self._periods = loaded
+                        self._yesterday = previous_totals
+                        self._team_names = team_names
+                        self.loads += 1
+                        self.replayed += len(later)
+                        return loaded, previous_totals, team_names
+                    if attempt == LOAD_ATTEMPTS:
+                        return loaded, previous_totals, team_names
+            finally:
+                with self._lock:
+                    self._loading -= 1
+                    if not self._loading:
+                        self._pending = []
+
+    def summary(self, period):
+        """PeriodSummary за период ('day', 'week', 'month', 'all') или вчерашний день ('yesterday')"""
+        periods, yesterday, _ = self._ensure_loaded()
+        with self._lock:
+            totals = yesterday if period == 'yesterday' else periods[period]
+            return totals.summary()
+
+    def team_name(self, team_id):
+        _, _, team_names = self._ensure_loaded()
+        return team_names.get(team_id)
+
+    def set_team_name(self, team_id, name):
+        """Новая команда: название сразу доступно без перезагрузки сумм"""
+        with self._lock:
+            if self._periods is not None:
+                # Копия: снимки, уже выданные читателям, не меняются
+                self._team_names = {**self._team_names, team_id: name}
+
+    def apply_profit(self, user_id, team_id, role, direction, amount, day, profit_id):
+        """Учесть профит за день day (сегодняшний профит входит во все периоды)"""
+        with self._lock:
+            if self._loading:
+                self._pending.append((profit_id, (user_id, team_id, role, direction, amount), day))
+            if self._periods is None or self._day != day:
+                self._periods = None
+                return
+            for totals in self._periods.values():
+                totals.add(user_id, team_id, role, direction, amount)
+            self.updates += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._periods = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'day': self._day if self._periods is not None else None,
+                'loads': self.loads,
+                'replayed': self.replayed,
+                'updates': self.updates,
+                'invalidations': self.invalidations,
+            }
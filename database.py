@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пул соединений SQLite для бота
+Соединения открываются один раз: отдельный писатель и несколько читателей (WAL)
+"""
+
+import sqlite3
+import asyncio
+import functools
+import threading
+import queue
+import time
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Путь к базе данных
+DB_PATH = 'bot_database.db'
+# Количество соединений-читателей
+READER_COUNT = 4
+
+# PRAGMA, применяемые к каждому соединению
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+class Connection(sqlite3.Connection):
+    """Соединение пула; в отличие от sqlite3.Connection допускает слабые ссылки (кэши по соединению)"""
+
+
+def open_connection(path):
+    """Открыть соединение с настроенными PRAGMA"""
+    conn = sqlite3.connect(path, check_same_thread=False, factory=Connection)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: один писатель и READER_COUNT читателей"""
+
+    def __init__(self, path=DB_PATH, readers=READER_COUNT):
+        self.path = path
+        self.reader_count = readers
+        self._open_lock = threading.Lock()
+        self._readers = None
+        self._all_readers = []
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self.reset_stats()
+
+    def configure(self, path=None, readers=None):
+        """Сменить базу или размер пула (закрывает открытые соединения)"""
+        self.close()
+        if path is not None:
+            self.path = path
+        if readers is not None:
+            self.reader_count = readers
+
+    def _ensure_open(self):
+        if self._writer is not None:
+            return
+        with self._open_lock:
+            if self._writer is not None:
+                return
+            writer = open_connection(self.path)
+            writer.execute('PRAGMA journal_mode = WAL')
+            readers = queue.Queue()
+            self._all_readers = []
+            for _ in range(self.reader_count):
+                conn = open_connection(self.path)
+                self._all_readers.append(conn)
+                readers.put(conn)
+            self._readers = readers
+            self._writer = writer
+            logger.info(f"Пул соединений открыт: {self.path}, читателей: {self.reader_count}")
+
+    def _record_wait(self, kind, waited):
+        with self._stats_lock:
+            stats = self._stats[kind]
+            stats['acquired'] += 1
+            stats['wait_total'] += waited
+            if waited > stats['wait_max']:
+                stats['wait_max'] = waited
+            if waited > 0.001:
+                stats['waited'] += 1
+
+    @contextmanager
+    def reader(self):
+        """Соединение для чтения; возвращается в пул после использования"""
+        self._ensure_open()
+        started = time.perf_counter()
+        conn = self._readers.get()
+        self._record_wait('reader', time.perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Единственное соединение для записи; commit при успехе, rollback при ошибке"""
+        self._ensure_open()
+        started = time.perf_counter()
+        with self._writer_lock:
+            self._record_wait('writer', time.perf_counter() - started)
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for kind in ('reader', 'writer'):
+                self._stats[kind] = {'acquired': 0, 'waited': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+    def stats(self):
+        """Метрики ожидания соединений"""
+        with self._stats_lock:
+            result = {kind: dict(values) for kind, values in self._stats.items()}
+        result['readers_idle'] = self._readers.qsize() if self._readers is not None else 0
+        result['readers_total'] = self.reader_count
+        return result
+
+    def close(self):
+        with self._open_lock:
+            if self._writer is None:
+                return
+            for conn in self._all_readers:
+                conn.close()
+            self._writer.close()
+            self._all_readers = []
+            self._readers = None
+            self._writer = None
+
+
+# Общий пул для всего бота
+pool = ConnectionPool()
+
+
+# === АСИНХРОННЫЙ ДОСТУП ===
+# Запросы выполняются в ограниченных пулах потоков, чтобы не блокировать event loop:
+# полоса чтения по числу читателей, одна полоса записи и одна фоновая полоса для долгих задач
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(lane):
+    executor = _executors.get(lane)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(lane)
+            if executor is None:
+                workers = pool.reader_count if lane == 'read' else 1
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'db-{lane}')
+                _executors[lane] = executor
+    return executor
+
+
+async def run_read(func, *args, **kwargs):
+    """Выполнить функцию чтения в полосе чтения"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor('read'), functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполнить функцию записи в полосе записи (последовательно)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor('write'), functools.partial(func, *args, **kwargs))
+
+
+async def run_background(func, *args, **kwargs):
+    """Выполнить долгую задачу (импорт) в фоновой полосе
+
+    Задача берёт соединение записи только на время каждой пачки, поэтому записи из полосы записи
+    выполняются между её пачками, а не ждут окончания всей задачи.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor('background'), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковая выгрузка профитов в CSV или XLSX
+
+Строки читаются из соединения profits/users/teams пачками и сразу пишутся во временный файл
+(SpooledTemporaryFile: небольшой отчёт остаётся в памяти, большой уходит на диск), поэтому
+потребление памяти не зависит от числа строк. XLSX собирается без сторонних библиотек:
+лист пишется в zip-архив по мере чтения строк.
+
+Использование:
+    python export.py --period month --format xlsx --output profits.xlsx
+"""
+
+import argparse
+import codecs
+import csv
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import archive
+import storage
+from database import pool
+from period_stats import PERIODS, period_starts
+
+# Строк в одной пачке чтения
+EXPORT_CHUNK_SIZE = 5000
+# Размер отчёта, после которого временный файл переносится из памяти на диск
+EXPORT_SPOOL_SIZE = 1024 * 1024
+# Ограничение Bot API на размер отправляемого файла
+UPLOAD_LIMIT = 50 * 1024 * 1024
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_COLUMNS = ('date', 'worker', 'telegram_id', 'team', 'direction', 'amount', 'comment')
+
+# file — временный файл, установленный на начало; rows — число строк без заголовка; size — байт
+Export = namedtuple('Export', ['file', 'filename', 'rows', 'size', 'seconds'])
+
+# Символы, недопустимые в XML 1.0
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="profits" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+def iter_table_chunks(conn, table, fmt, start, team_id, chunk_size):
+    """Пачки строк одной таблицы профитов (основной или подключённого архива)"""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append('p.date >= ?')
+        params.append(fmt.day(start))
+    if team_id is not None:
+        conditions.append('u.team_id = ?')
+        params.append(team_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor = conn.execute(f'''
+        SELECT p.date, u.name, u.telegram_id, t.name, p.direction, p.amount, p.comment
+        FROM {table} p
+        JOIN main.users u ON u.id = p.user_id
+        LEFT JOIN main.teams t ON t.id = u.team_id
+        {where}
+        ORDER BY p.date, p.user_id
+    ''', params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield [(fmt.day_value(day), name, telegram_id, team or '', direction,
+                round(fmt.amount_value(amount), 2), comment or '')
+               for day, name, telegram_id, team, direction, amount, comment in rows]
+
+
+def iter_profit_chunks(conn, start=None, team_id=None, chunk_size=EXPORT_CHUNK_SIZE, db_path=None):
+    """Пачки строк (дата, воркер, telegram_id, команда, направление, сумма, комментарий)
+
+    start — первый день периода (YYYY-MM-DD, None — все время), team_id — только воркеры команды.
+    Закрытые месяцы, перенесённые в архив, читаются из файлов архивов, подключаемых по одному.
+    Основная база читается с начала периода, а не с границы архива: профиты, начисленные задним
+    числом после архивации (импорт, ручная запись), есть только в ней. Строк одного профита в архиве
+    и основной базе одновременно не бывает — архивация удаляет из основной базы только перенесённые.
+    """
+    boundary = archive.hot_start(conn)
+    if boundary is not None and (start is None or start < boundary):
+        for _, filename, _, end_day, _, format_name in archive.list_archives(conn):
+            if start is not None and end_day <= start:
+                continue
+            with archive.attached(conn, filename, db_path or pool.path) as alias:
+                yield from iter_table_chunks(conn, f'{alias}.profits', archive.FORMATS[format_name],
+                                             start, team_id, chunk_size)
+    yield from iter_table_chunks(conn, 'main.profits', storage.get_format(conn), start, team_id, chunk_size)
+
+
+def write_csv(chunks, fileobj):
+    """Записать пачки в CSV (UTF-8 с BOM, чтобы Excel распознал кириллицу); возвращает число строк"""
+    stream = codecs.getwriter('utf-8-sig')(fileobj)
+    writer = csv.writer(stream)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_row(values):
+    return '<row>' + ''.join(xlsx_cell(value) for value in values) + '</row>'
+
+
+def write_xlsx(chunks, fileobj):
+    """Записать пачки в XLSX (один лист, строки со встроенным текстом); возвращает число строк"""
+    count = 0
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((XLSX_SHEET_HEAD + xlsx_row(EXPORT_COLUMNS)).encode('utf-8'))
+            for rows in chunks:
+                sheet.write(''.join(xlsx_row(row) for row in rows).encode('utf-8'))
+                count += len(rows)
+            sheet.write(XLSX_SHEET_TAIL.encode('utf-8'))
+    return count
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
+
+
+def export_profits(export_format, period='all', team_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Сформировать отчёт за период; закрыть Export.file должен вызывающий"""
+    started = time.perf_counter()
+    start = period_starts()[period]
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        with pool.reader() as conn:
+            rows = WRITERS[export_format](iter_profit_chunks(conn, start, team_id, chunk_size), output)
+        size = output.tell()
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
+    scope = f'team{team_id}_' if team_id is not None else ''
+    filename = f"profits_{scope}{period}_{datetime.now().strftime('%Y-%m-%d')}.{export_format}"
+    return Export(output, filename, rows, size, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка профитов в CSV или XLSX')
+    parser.add_argument('--db', default=pool.path, help='путь к базе данных')
+    parser.add_argument('--period', choices=PERIODS, default='all')
+    parser.add_argument('--team', type=int, default=None, help='id команды (по умолчанию — все)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--output', default=None, help='файл отчёта (по умолчанию — имя по периоду)')
+    args = parser.parse_args()
+    pool.configure(path=args.db)
+    try:
+        export = export_profits(args.format, args.period, args.team)
+    finally:
+        pool.close()
+    with export.file, open(args.output or export.filename, 'wb') as target:
+        shutil.copyfileobj(export.file, target)
+    print(f"✅ {args.output or export.filename}: {export.rows} строк, {export.size / 1024 / 1024:.1f} МБ "
+          f"за {export.seconds:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
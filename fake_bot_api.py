@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальная имитация Bot API для проверок без Telegram
+Поддерживает getMe, getUpdates (длинный опрос), sendMessage, sendDocument, sendPhoto и методы управления webhook.
+Доступна по HTTP (start) или напрямую в процессе, без сети (InProcessRequest)
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl
+
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 100000001, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+class FakeBotApi:
+    """HTTP-сервер, отвечающий на запросы python-telegram-bot по адресу /bot<token>/<method>"""
+
+    def __init__(self, history=None):
+        """history — сколько последних отправок хранить в sent/documents/photos (None — все)"""
+        self._server = None
+        self._updates = []
+        self._update_event = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        # (время получения, chat_id, текст)
+        self.sent = deque(maxlen=history)
+        self.sent_event = asyncio.Event()
+        # (время получения, chat_id, имя файла, размер в байтах)
+        self.documents = deque(maxlen=history)
+        # (время получения, chat_id, file_id — повторная отправка или None — загрузка, размер в байтах)
+        self.photos = deque(maxlen=history)
+        # Число вызовов по методам Bot API
+        self.calls = {}
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}/bot'
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def push_update(self, update):
+        """Добавить обновление для getUpdates (update_id назначается автоматически)"""
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._update_event.set()
+        return update
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get('transfer-encoding', '').lower() == 'chunked':
+                    body = await self._read_chunked(reader)
+                else:
+                    length = int(headers.get('content-length', 0) or 0)
+                    body = await reader.readexactly(length) if length else b''
+                method = request_line.decode('latin-1').split()[1].rsplit('/', 1)[-1]
+                params = self._parse_params(headers.get('content-type', ''), body)
+                result = await self.call(method, params)
+                payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                writer.write(
+                    f'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(payload)}\r\n\r\n'.encode('latin-1') + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_chunked(reader):
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                await reader.readline()
+                return bytes(body)
+            body += await reader.readexactly(size)
+            await reader.readline()
+
+    @staticmethod
+    def _parse_params(content_type, body):
+        if not body:
+            return {}
+        if 'application/json' in content_type:
+            return json.loads(body)
+        if 'multipart/form-data' in content_type:
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+            )
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                payload = part.get_payload(decode=True)
+                if part.get_filename():
+                    params[name] = (part.get_filename(), payload)
+                else:
+                    params[name] = payload.decode('utf-8')
+            return params
+        params = {}
+        for key, value in parse_qsl(body.decode('utf-8')):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def call(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            if not self._updates:
+                self._update_event.clear()
+                try:
+                    await asyncio.wait_for(self._update_event.wait(), float(params.get('timeout') or 0))
+                except asyncio.TimeoutError:
+                    pass
+            return self._updates[:int(params.get('limit') or 100)]
+        if method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            self.sent.append((time.perf_counter(), chat_id, params.get('text')))
+            self.sent_event.set()
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        if method == 'sendDocument':
+            chat_id = int(params['chat_id'])
+            document = params.get('document')
+            # Файл приходит вложением: значение document — attach://<имя части>
+            if isinstance(document, str) and document.startswith('attach://'):
+                document = params.get(document[len('attach://'):])
+            filename, content = document if isinstance(document, tuple) else (None, b'')
+            self.documents.append((time.perf_counter(), chat_id, filename, len(content)))
+            self.sent_event.set()
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'document': {'file_id': f'doc{message_id}', 'file_unique_id': f'doc{message_id}',
+                             'file_name': filename, 'file_size': len(content)},
+            }
+        if method == 'sendPhoto':
+            chat_id = int(params['chat_id'])
+            photo = params.get('photo')
+            if isinstance(photo, str) and photo.startswith('attach://'):
+                photo = params.get(photo[len('attach://'):])
+            if isinstance(photo, tuple):
+                file_id, size = None, len(photo[1])
+            else:
+                file_id, size = photo, 0
+            self.photos.append((time.perf_counter(), chat_id, file_id, size))
+            self.sent_event.set()
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            photo_id = file_id or f'photo{message_id}'
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'photo': [{'file_id': photo_id, 'file_unique_id': photo_id, 'width': 800, 'height': 480}],
+                'caption': params.get('caption'),
+            }
+        if method in ('setWebhook', 'deleteWebhook', 'close', 'logOut'):
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+
+class InProcessRequest(BaseRequest):
+    """Запросы python-telegram-bot к FakeBotApi напрямую, без HTTP и сокетов"""
+
+    def __init__(self, api):
+        self.api = api
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        params = dict(request_data.parameters) if request_data else {}
+        if request_data:
+            # Вложения: {имя части: (имя файла, содержимое или открытый файл, тип)}
+            for name, value in request_data.multipart_data.items():
+                filename, content = value[0], value[1]
+                params[name] = (filename, content.read() if hasattr(content, 'read') else content)
+        result = await self.api.call(url.rsplit('/', 1)[-1], params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def make_text_update(chat_id, text, message_id=1):
+    """Минимальное обновление с текстовым сообщением от пользователя chat_id"""
+    update = {
+        'update_id': message_id,
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f'User{chat_id}'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'},
+            'text': text,
+        },
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return update
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генератор синтетических данных для нагрузочных проверок
+
+Использование:
+    python generate_data.py --db bench.db --teams 50 --workers 2000 --days 365 --profits-per-day 5000
+"""
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from database import pool
+from rollups import rebuild_profit_daily
+from storage import begin_write
+
+# Первый telegram_id синтетических пользователей (чтобы не пересекаться с реальными)
+TELEGRAM_ID_BASE = 7000000000
+# Строк профитов в одной транзакции
+GENERATE_CHUNK_SIZE = 50000
+
+DIRECTION_NAMES = ['eToro', 'Binance', 'Forex', 'Crypto', 'Bybit', 'OKX', 'Kraken', 'Bitget']
+
+
+def generate_profit_rows(rng, user_ids, directions, days, profits_per_day):
+    """Поток строк профитов: (user_id, direction, amount, date, comment)"""
+    today = date.today()
+    # Небольшая доля воркеров приносит основную прибыль
+    weights = [rng.paretovariate(1.5) for _ in user_ids]
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        for user_id in rng.choices(user_ids, weights=weights, k=profits_per_day):
+            yield (user_id, rng.choice(directions), round(rng.lognormvariate(4, 1), 2), day, '')
+
+
+def generate(teams, workers, directions, days, profits_per_day, seed=1):
+    from bot import init_database
+
+    rng = random.Random(seed)
+    init_database()
+    started = time.perf_counter()
+    direction_names = [DIRECTION_NAMES[i] if i < len(DIRECTION_NAMES) else f'Direction{i}'
+                       for i in range(directions)]
+
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(telegram_id), ?) FROM users WHERE telegram_id >= ?',
+                       (TELEGRAM_ID_BASE, TELEGRAM_ID_BASE))
+        next_telegram_id = cursor.fetchone()[0] + 1
+        existing_bots = {name for name, in cursor.execute('SELECT name FROM bots').fetchall()}
+        cursor.executemany('INSERT INTO bots (name, description, link) VALUES (?, ?, ?)',
+                           [(name, f'Направление {name}', f'https://example.com/{name.lower()}')
+                            for name in direction_names if name not in existing_bots])
+
+        team_ids = []
+        for number in range(teams):
+            cursor.execute("INSERT INTO users (telegram_id, name, role) VALUES (?, ?, 'team_leader')",
+                           (next_telegram_id, f'Тимлидер {number + 1}'))
+            leader_id = cursor.lastrowid
+            cursor.execute('INSERT INTO teams (name, team_leader_id) VALUES (?, ?)',
+                           (f'Команда {number + 1}', leader_id))
+            team_ids.append(cursor.lastrowid)
+            cursor.execute('UPDATE users SET team_id = ? WHERE id = ?', (cursor.lastrowid, leader_id))
+            next_telegram_id += 1
+
+        first_worker = next_telegram_id
+        cursor.executemany(
+            "INSERT INTO users (telegram_id, name, role, team_id, direction) VALUES (?, ?, 'worker', ?, ?)",
+            [(first_worker + number, f'Воркер {number + 1}',
+              rng.choice(team_ids) if team_ids else None, rng.choice(direction_names))
+             for number in range(workers)]
+        )
+        cursor.execute('SELECT id FROM users WHERE telegram_id >= ?', (first_worker,))
+        user_ids = [user_id for user_id, in cursor.fetchall()]
+
+    rows = 0
+    chunk = []
+    # Генерацию при сбое можно повторить, поэтому fsync на время вставки отключаем
+    with pool.writer() as conn:
+        conn.execute('PRAGMA synchronous = OFF')
+    try:
+        for row in generate_profit_rows(rng, user_ids, direction_names, days, profits_per_day):
+            chunk.append(row)
+            if len(chunk) >= GENERATE_CHUNK_SIZE:
+                with pool.writer() as conn:
+                    fmt = begin_write(conn)
+                    conn.executemany(fmt.insert_profit_sql, [fmt.profit_row(*row) for row in chunk])
+                rows += len(chunk)
+                chunk = []
+                print(f"  … {rows} профитов")
+        if chunk:
+            with pool.writer() as conn:
+                fmt = begin_write(conn)
+                conn.executemany(fmt.insert_profit_sql, [fmt.profit_row(*row) for row in chunk])
+            rows += len(chunk)
+        with pool.writer() as conn:
+            rebuild_profit_daily(conn)
+            conn.execute('ANALYZE')
+    finally:
+        with pool.writer() as conn:
+            conn.execute('PRAGMA synchronous = NORMAL')
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Команд: {teams}, воркеров: {workers}, профитов: {rows} за {elapsed:.1f} с "
+          f"({rows / elapsed:.0f} строк/с)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетических данных')
+    parser.add_argument('--db', default='bench_database.db', help='путь к базе данных')
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=500)
+    parser.add_argument('--directions', type=int, default=4)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--profits-per-day', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    pool.configure(path=args.db)
+    try:
+        generate(args.teams, args.workers, args.directions, args.days, args.profits_per_day, args.seed)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
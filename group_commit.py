@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Групповая фиксация записей (group commit)
+
+Записи из обработчиков складываются в очередь; одна задача-писатель собирает их в пачку
+(до GROUP_COMMIT_MAX_ROWS записей или GROUP_COMMIT_DELAY секунд с первой) и выполняет одной
+транзакцией с одним fsync. Вызывающий ждёт, пока его запись зафиксирована. Сброс кэшей
+выполняется один раз на пачку.
+
+Запись — функция apply(conn, *args) -> (результат, эффекты): выполняет SQL в уже открытой транзакции
+и возвращает список эффектов для сброса кэшей. Ошибка одной записи откатывает только её (SAVEPOINT).
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import storage
+from database import run_write
+
+logger = logging.getLogger(__name__)
+
+# Максимум записей в одной транзакции
+GROUP_COMMIT_MAX_ROWS = 256
+# Сколько ждать попутных записей после первой (секунды)
+GROUP_COMMIT_DELAY = 0.005
+# Режим синхронизации писателя: с группировкой полный fsync на каждую фиксацию обходится дёшево
+GROUP_COMMIT_SYNCHRONOUS = 'FULL'
+# Окно для расчёта задержки фиксации
+LATENCY_WINDOW = 1000
+
+
+class GroupCommitWriter:
+    """Очередь записей с одним писателем; on_commit(эффекты) вызывается после каждой пачки"""
+
+    def __init__(self, pool, on_commit=None, max_rows=GROUP_COMMIT_MAX_ROWS, max_delay=GROUP_COMMIT_DELAY):
+        self.pool = pool
+        self.on_commit = on_commit
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_batch = 0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Зафиксировать всё, что уже в очереди, и остановить писателя"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        await task
+
+    async def submit(self, apply, *args):
+        """Поставить запись в очередь и дождаться фиксации; возвращает результат apply"""
+        self.submitted += 1
+        if self._task is None:
+            # Писатель не запущен (скрипты, прямой вызов обработчиков) — отдельная транзакция
+            (ok, value), = await run_write(self._write_batch, [(apply, args, time.perf_counter())])
+            if not ok:
+                raise value
+            return value
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((apply, args, time.perf_counter(), future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_rows:
+                try:
+                    if self._queue.empty():
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            results = await run_write(self._write_batch, [item[:3] for item in batch])
+        except Exception as e:
+            logger.error(f"Ошибка групповой записи ({len(batch)} записей): {e}")
+            results = [(False, e)] * len(batch)
+        for (_, _, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _write_batch(self, batch):
+        """Пачка записей одной транзакцией (выполняется в полосе записи)"""
+        results = []
+        effects = []
+        with self.pool.writer() as conn:
+            storage.begin_write(conn)
+            for apply, args, _ in batch:
+                conn.execute('SAVEPOINT group_commit_item')
+                try:
+                    value, item_effects = apply(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO group_commit_item')
+                    conn.execute('RELEASE group_commit_item')
+                    results.append((False, e))
+                    continue
+                conn.execute('RELEASE group_commit_item')
+                results.append((True, value))
+                effects.extend(item_effects)
+        committed = time.perf_counter()
+        for (_, _, submitted), (ok, _) in zip(batch, results):
+            self._latencies.append(committed - submitted)
+            if ok:
+                self.committed += 1
+            else:
+                self.failed += 1
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+        if self.on_commit and effects:
+            try:
+                self.on_commit(effects)
+            except Exception as e:
+                # Данные уже зафиксированы: ошибка сброса кэшей не должна превращаться в ошибку записи
+                logger.error(f"Ошибка сброса кэшей после групповой записи: {e}")
+        return results
+
+    def configure_connection(self):
+        """Включить для писателя режим синхронизации GROUP_COMMIT_SYNCHRONOUS"""
+        with self.pool.writer() as conn:
+            conn.execute(f'PRAGMA synchronous = {GROUP_COMMIT_SYNCHRONOUS}')
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+
+        def quantile(q):
+            return latencies[min(int(len(latencies) * q), len(latencies) - 1)] if latencies else 0.0
+
+        return {
+            'depth': self.depth(),
+            'submitted': self.submitted,
+            'committed': self.committed,
+            'failed': self.failed,
+            'batches': self.batches,
+            'avg_batch': (self.committed + self.failed) / self.batches if self.batches else 0.0,
+            'max_batch': self.max_batch,
+            'latency_p50': quantile(0.5),
+            'latency_p99': quantile(0.99),
+        }
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Массовый импорт профитов из CSV или JSONL
+
+Колонки/ключи: telegram_id, direction, amount, date (YYYY-MM-DD, по умолчанию — сегодня), comment
+Использование:
+    python import_profits.py profits.csv
+    python import_profits.py profits.jsonl --db bot_database.db
+"""
+
+import argparse
+import codecs
+import csv
+import json
+import logging
+import math
+import time
+from datetime import date, datetime
+
+import rollups
+import storage
+from database import pool
+
+logger = logging.getLogger(__name__)
+
+# Количество строк в одной транзакции
+IMPORT_CHUNK_SIZE = 5000
+# Сколько ошибочных строк показывать в отчёте
+IMPORT_MAX_ERRORS = 10
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """Построчно читать записи из текстового потока: (номер строки файла, запись)
+
+    Строка JSONL отдаётся как есть и разбирается в import_profit_rows, чтобы ошибочная строка
+    пропускалась так же, как ошибочная строка CSV, а не прерывала импорт.
+    """
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if line:
+                yield line_number, line
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def load_user_ids(conn):
+    """Соответствие telegram_id -> id одним запросом"""
+    return dict(conn.execute('SELECT telegram_id, id FROM users').fetchall())
+
+
+def import_profit_rows(rows, chunk_size=IMPORT_CHUNK_SIZE, on_batch=None):
+    """Импортировать записи (номер строки, запись) пачками; on_batch вызывается после каждой записанной пачки
+
+    Соединение записи берётся только на время пачки, между пачками проходят другие записи бота.
+    """
+    started = time.perf_counter()
+    with pool.reader() as conn:
+        user_ids = load_user_ids(conn)
+    today = datetime.now().strftime('%Y-%m-%d')
+    report = {'imported': 0, 'skipped': 0, 'batches': 0, 'errors': []}
+    batch = []
+
+    def write_batch():
+        with pool.writer() as conn:
+            fmt = storage.begin_write(conn)
+            groups = {}
+            for user_id, direction, amount, day, _ in batch:
+                group = groups.setdefault((fmt.day(day), user_id, direction), [0, 0])
+                group[0] += fmt.amount(amount)
+                group[1] += 1
+            cursor = conn.cursor()
+            cursor.executemany(fmt.insert_profit_sql, [fmt.profit_row(*row) for row in batch])
+            rollups.apply_profits(cursor, groups)
+        report['imported'] += len(batch)
+        report['batches'] += 1
+        if on_batch:
+            on_batch(batch)
+        batch.clear()
+
+    for line_number, row in rows:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+            user_id = user_ids.get(int(row['telegram_id']))
+            if user_id is None:
+                raise ValueError(f"неизвестный telegram_id {row['telegram_id']}")
+            amount = float(row['amount'])
+            if not math.isfinite(amount):
+                raise ValueError(f"недопустимая сумма {row['amount']}")
+            # Хранится нормализованная дата: fromisoformat принимает и 20200101, и 2020-W01-1
+            day = date.fromisoformat(row.get('date') or today).isoformat()
+            batch.append((user_id, row.get('direction') or None, amount, day, row.get('comment') or ''))
+        except (KeyError, TypeError, ValueError) as e:
+            report['skipped'] += 1
+            if len(report['errors']) < IMPORT_MAX_ERRORS:
+                report['errors'].append(f"строка {line_number}: {e}")
+            continue
+        if len(batch) >= chunk_size:
+            write_batch()
+    if batch:
+        write_batch()
+
+    elapsed = time.perf_counter() - started
+    report['seconds'] = elapsed
+    report['rows_per_second'] = report['imported'] / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Импорт профитов: {report['imported']} строк, пропущено {report['skipped']}, "
+                f"{report['rows_per_second']:.0f} строк/с")
+    return report
+
+
+def import_profits_file(path, fmt=None, on_batch=None):
+    fmt = fmt or detect_format(path)
+    with open(path, 'rb') as raw:
+        stream = codecs.getreader('utf-8-sig')(raw)
+        return import_profit_rows(read_rows(stream, fmt), on_batch=on_batch)
+
+
+def format_report(report):
+    lines = [
+        f"✅ Импортировано: {report['imported']}",
+        f"⚠ Пропущено: {report['skipped']}",
+        f"⏱ {report['seconds']:.2f} с, {report['rows_per_second']:.0f} строк/с",
+    ]
+    lines.extend(report['errors'])
+    return '\n'.join(lines)
+
+
+def main():
+    from bot import init_database
+
+    parser = argparse.ArgumentParser(description='Массовый импорт профитов')
+    parser.add_argument('path', help='CSV или JSONL файл')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='формат (по умолчанию — по расширению)')
+    parser.add_argument('--db', default=pool.path, help='путь к базе данных')
+    args = parser.parse_args()
+    pool.configure(path=args.db)
+    try:
+        init_database()
+        print(format_report(import_profits_file(args.path, args.format)))
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочная проверка бота воспроизведением потока обновлений
+
+Поток — сессии пользователей синтетической базы (generate_data.py): просмотр статистики, рейтинги,
+навигация по меню, регистрация новых пользователей, команда тимлидера, начисление профитов админами.
+Обновления проходят через Application так же, как при опросе (CommandHandler -> start_handler,
+MessageHandler -> text_handler, update_processor: параллельно между пользователями, по очереди
+внутри пользователя), ответы принимает FakeBotApi прямо в процессе. Сеть и Telegram не нужны.
+
+Отчёт: пропускная способность, p50/p99 по маршрутам (от подачи обновления до конца обработки,
+включая ожидание своей очереди) и пиковая память процесса.
+
+Использование:
+    python load_test.py --workers 2000 --sessions 5000
+    python load_test.py --sessions 5000 --record stream.jsonl
+    python load_test.py --replay stream.jsonl --db bench_database.db
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковая память не измеряется
+    resource = None
+
+from telegram import Update
+
+import bot
+import generate_data
+from database import pool, shutdown_executors
+from fake_bot_api import FakeBotApi, InProcessRequest, make_text_update
+from charts import shutdown_render_pool
+
+FAKE_TOKEN = '123456:LOAD'
+# Первый chat_id новых (незарегистрированных) пользователей
+NEW_USER_BASE = 8000000000
+# Первый telegram_id дополнительных админов
+ADMIN_BASE = 6000000000
+# Одновременно открытых сессий при генерации: шаги разных сессий перемежаются
+ACTIVE_SESSIONS = 200
+# Обновлений в обработке одновременно (остальные ждут подачи)
+MAX_INFLIGHT = 1000
+
+PERIODS = ['📅 День', '📅 Неделя', '📅 Месяц', '📅 Все время']
+
+# Доли сценариев в потоке
+SCENARIOS = {
+    'stats': 35,
+    'rating': 25,
+    'menu': 15,
+    'team': 10,
+    'register': 5,
+    'payout': 10,
+}
+
+
+# === Генерация потока ===
+
+def load_population(admins):
+    """telegram_id воркеров, тимлидеров и админов синтетической базы, направления"""
+    with pool.reader() as conn:
+        workers = [row[0] for row in conn.execute("SELECT telegram_id FROM users WHERE role = 'worker'")]
+        leaders = [row[0] for row in conn.execute(
+            "SELECT telegram_id FROM users WHERE role = 'team_leader' AND team_id IS NOT NULL")]
+        admin_ids = [row[0] for row in conn.execute("SELECT telegram_id FROM users WHERE role = 'admin'")]
+        directions = [row[0] for row in conn.execute('SELECT name FROM bots')]
+    if len(admin_ids) < admins:
+        with pool.writer() as conn:
+            start = conn.execute('SELECT COALESCE(MAX(telegram_id) + 1, ?) FROM users WHERE telegram_id >= ?',
+                                 (ADMIN_BASE, ADMIN_BASE)).fetchone()[0]
+            new_ids = [start + number for number in range(admins - len(admin_ids))]
+            conn.executemany("INSERT INTO users (telegram_id, name, role) VALUES (?, ?, 'admin')",
+                             [(telegram_id, f'Админ {telegram_id}') for telegram_id in new_ids])
+        admin_ids += new_ids
+    return workers, leaders, admin_ids, directions or ['eToro']
+
+
+def session_steps(rng, scenario, population, new_user_id):
+    """(telegram_id, [(маршрут, текст)]) одной сессии"""
+    workers, leaders, admins, directions = population
+    if scenario == 'stats':
+        steps = [('📊 Моя статистика', '📊 Моя статистика')]
+        steps += [('статистика: период', period) for period in rng.sample(PERIODS, rng.randint(1, 3))]
+        if rng.random() < 0.3:
+            steps.append(('🛠 По направлениям', '🛠 По направлениям'))
+        return rng.choice(workers), steps + [('⬅️ Назад', '⬅️ Назад')]
+    if scenario == 'rating':
+        kind = rng.choice(['👤 Воркеры', '👥 Команды'])
+        steps = [('🏆 Рейтинг', '🏆 Рейтинг'), ('рейтинг: вид', kind)]
+        steps += [('рейтинг: период', period) for period in rng.sample(PERIODS, rng.randint(1, 2))]
+        return rng.choice(workers), steps + [('⬅️ Назад', '⬅️ Назад')]
+    if scenario == 'menu':
+        steps = [('/start', '/start'), ('🤖 Боты', '🤖 Боты'), ('⬅️ Назад', '⬅️ Назад'),
+                 ('⚙️ Настройки', '⚙️ Настройки'), ('⬅️ Назад', '⬅️ Назад'), ('❓ Справка', '❓ Справка')]
+        return rng.choice(workers), steps
+    if scenario == 'team' and leaders:
+        steps = [('👥 Моя команда', '👥 Моя команда'), ('📊 Статистика команды', '📊 Статистика команды'),
+                 ('👤 Список воркеров', '👤 Список воркеров'), ('⬅️ Назад', '⬅️ Назад')]
+        return rng.choice(leaders), steps
+    if scenario == 'payout':
+        steps = [('🛠 Админ-панель', '🛠 Админ-панель'), ('💰 Начислить профит', '💰 Начислить профит')]
+        for _ in range(rng.randint(1, 5)):
+            amount = round(rng.lognormvariate(4, 1), 2)
+            steps.append(('начисление', f'{rng.choice(workers)} {amount} {rng.choice(directions)} бонус'))
+        return rng.choice(admins), steps + [('⬅️ Назад', '⬅️ Назад')]
+    steps = [('/start', '/start'), ('регистрация', f'Пользователь {new_user_id}'),
+             ('📊 Моя статистика', '📊 Моя статистика'), ('статистика: период', rng.choice(PERIODS))]
+    return new_user_id, steps
+
+
+def generate_stream(rng, population, sessions, active=ACTIVE_SESSIONS):
+    """[(маршрут, словарь Update)]: шаги одновременно открытых сессий перемежаются случайно"""
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name] for name in names]
+    pending = [rng.choices(names, weights)[0] for _ in range(sessions)]
+    opened = []
+    stream = []
+    new_users = 0
+    while pending or opened:
+        while pending and len(opened) < active:
+            scenario = pending.pop()
+            if scenario == 'register':
+                new_users += 1
+            telegram_id, steps = session_steps(rng, scenario, population, NEW_USER_BASE + new_users)
+            opened.append([telegram_id, steps, 0])
+        index = rng.randrange(len(opened))
+        session = opened[index]
+        telegram_id, steps, position = session
+        route, text = steps[position]
+        stream.append((route, make_text_update(telegram_id, text, len(stream) + 1)))
+        session[2] += 1
+        if session[2] == len(steps):
+            opened[index] = opened[-1]
+            opened.pop()
+    return stream
+
+
+def route_of(update):
+    """Маршрут обновления из чужой записи без разметки: текст кнопки или «ввод»"""
+    text = update.get('message', {}).get('text', '')
+    return text if text.startswith('/') or not text[:1].isalnum() else 'ввод'
+
+
+def save_stream(stream, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for route, update in stream:
+            f.write(json.dumps({'route': route, 'update': update}, ensure_ascii=False) + '\n')
+
+
+def load_stream(path):
+    """Строки {"route": ..., "update": {...}} или просто Update в формате Bot API"""
+    stream = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'update' in record:
+                stream.append((record.get('route') or route_of(record['update']), record['update']))
+            else:
+                stream.append((route_of(record), record))
+    return stream
+
+
+# === Прогон ===
+
+def peak_memory_mb():
+    """Пиковый RSS процесса (МБ); None — недоступно на этой платформе"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux — килобайты, macOS — байты
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+async def replay(stream, inflight=MAX_INFLIGHT, rate=None, seed=1):
+    """Подать поток в бота; возвращает ({маршрут: [задержки, с]}, время прогона, FakeBotApi)
+
+    rate — обновлений в секунду (пуассоновский поток); None — всё сразу, замер предельной пропускной способности.
+    """
+    rng = random.Random(seed)
+    api = FakeBotApi(history=0)
+    application = bot.build_application(FAKE_TOKEN, request_factory=lambda: InProcessRequest(api))
+    latencies = {}
+    slots = asyncio.Semaphore(inflight)
+
+    async def process(route, update, submitted):
+        try:
+            await bot.update_processor.process_update(update, application.process_update(update))
+        finally:
+            latencies.setdefault(route, []).append(time.perf_counter() - submitted)
+            slots.release()
+
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        tasks = set()
+        started = time.perf_counter()
+        try:
+            next_at = started
+            for route, data in stream:
+                if rate:
+                    next_at += rng.expovariate(rate)
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await slots.acquire()
+                update = Update.de_json(data, application.bot)
+                task = asyncio.create_task(process(route, update, time.perf_counter()))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+        finally:
+            await application.stop()
+            await bot.post_shutdown(application)
+    return latencies, elapsed, api
+
+
+def summarize(latencies):
+    rows = []
+    for route, values in latencies.items():
+        ordered = sorted(values)
+        rows.append((route, len(ordered), ordered[len(ordered) // 2] * 1000,
+                     ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000))
+    return sorted(rows, key=lambda row: -row[1])
+
+
+def prepare_database(args):
+    """Временная база: копия --db или новая синтетическая"""
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='load_')
+    os.close(fd)
+    if args.db:
+        # Копия через backup: согласованный снимок даже при открытом WAL
+        source = sqlite3.connect(args.db)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        pool.configure(path=path)
+        bot.init_database()
+    else:
+        pool.configure(path=path)
+        generate_data.generate(args.teams, args.workers, args.directions, args.days, args.profits_per_day,
+                               seed=args.seed)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка: воспроизведение потока обновлений')
+    parser.add_argument('--db', default=None, help='база-образец (копируется; по умолчанию — синтетическая)')
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=1000)
+    parser.add_argument('--directions', type=int, default=4)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--profits-per-day', type=int, default=500)
+    parser.add_argument('--admins', type=int, default=3, help='админов, начисляющих профиты')
+    parser.add_argument('--sessions', type=int, default=2000, help='сессий пользователей в потоке')
+    parser.add_argument('--replay', default=None, help='воспроизвести поток из файла JSONL')
+    parser.add_argument('--record', default=None, help='сохранить сгенерированный поток в файл JSONL')
+    parser.add_argument('--inflight', type=int, default=MAX_INFLIGHT, help='обновлений в обработке одновременно')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='обновлений в секунду (по умолчанию — весь поток сразу)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Журнал бота на каждое обновление исказил бы замер
+    logging.getLogger().setLevel(logging.WARNING)
+    path = prepare_database(args)
+    try:
+        population = load_population(args.admins)
+        stream = load_stream(args.replay) if args.replay else generate_stream(random.Random(args.seed),
+                                                                              population, args.sessions)
+        if args.record:
+            save_stream(stream, args.record)
+        memory_before = peak_memory_mb()
+        latencies, elapsed, api = asyncio.run(replay(stream, args.inflight, args.rate, args.seed))
+        memory_after = peak_memory_mb()
+    finally:
+        shutdown_executors()
+        shutdown_render_pool()
+        pool.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"Обновлений: {total} за {elapsed:.2f} с — {total / elapsed:.0f} обн./с, "
+          f"параллельность {bot.UPDATE_CONCURRENCY}, вызовов Bot API: {sum(api.calls.values())}")
+    if memory_after is not None:
+        print(f"Пиковая память: {memory_after:.1f} МБ (до прогона {memory_before:.1f} МБ)")
+    print(f"{'маршрут':<28}{'обновлений':>12}{'p50, мс':>10}{'p99, мс':>10}")
+    for route, count, p50, p99 in summarize(latencies):
+        print(f"{route:<28}{count:>12}{p50:>10.2f}{p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
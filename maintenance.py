@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Служебные команды обслуживания базы данных
+
+Использование:
+    python maintenance.py rebuild-rollups   # пересобрать profit_daily из сырых профитов
+    python maintenance.py compact-storage   # онлайн-перевод сумм в центы и дат в номера дней
+    python maintenance.py archive           # перенос закрытых месяцев в архивы и очистка базы
+    python maintenance.py enable-incremental-vacuum   # один раз, при остановленном боте: полный VACUUM
+                                                      # с auto_vacuum = INCREMENTAL для очистки после архивации
+"""
+
+import argparse
+
+from archive import ARCHIVE_KEEP_MONTHS, archive_closed_months, enable_incremental_vacuum, vacuum
+from bot import init_database
+from database import pool
+from rollups import rebuild_profit_daily
+from storage import MIGRATION_BATCH_SIZE, migrate_to_compact
+
+
+def rebuild_rollups(args):
+    init_database()
+    with pool.writer() as conn:
+        rows = rebuild_profit_daily(conn)
+    print(f"✅ Агрегаты пересобраны: {rows} строк")
+
+
+def compact_storage(args):
+    init_database()
+    report = migrate_to_compact(pool, batch_size=args.batch_size, keep_legacy=args.keep_legacy)
+    if report is None:
+        print("База уже в компактном формате")
+        return
+    print(f"✅ Профитов: {report['profits']}, строк агрегатов: {report['profit_daily']}, "
+          f"за {report['seconds']:.1f} с (переключение таблиц {report['swap_seconds'] * 1000:.0f} мс)")
+
+
+def archive_profits(args):
+    init_database()
+    reports = archive_closed_months(pool, keep_months=args.keep_months, batch_size=args.batch_size)
+    for report in reports:
+        print(f"📦 {report['month']}: {report['copied']} профитов -> {report['file']} "
+              f"(всего в архиве {report['rows']}, {report['seconds']:.1f} с)")
+    if not reports:
+        print("Закрытых месяцев для архивации нет")
+    if args.no_vacuum:
+        return
+    report = vacuum(pool)
+    if not report['enabled']:
+        print("⚠️ Очистка пропущена: остановите бота и выполните "
+              "`python maintenance.py enable-incremental-vacuum`")
+        return
+    print(f"✅ Очистка: {report['size_before'] / 1024 / 1024:.1f} -> {report['size_after'] / 1024 / 1024:.1f} МБ "
+          f"за {report['seconds']:.1f} с")
+
+
+def incremental_vacuum(args):
+    init_database()
+    report = enable_incremental_vacuum(pool)
+    if report is None:
+        print("Инкрементальная очистка уже включена")
+        return
+    print(f"✅ Полный VACUUM: {report['size_before'] / 1024 / 1024:.1f} -> "
+          f"{report['size_after'] / 1024 / 1024:.1f} МБ за {report['seconds']:.1f} с")
+
+
+COMMANDS = {
+    'rebuild-rollups': rebuild_rollups,
+    'compact-storage': compact_storage,
+    'archive': archive_profits,
+    'enable-incremental-vacuum': incremental_vacuum,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Обслуживание базы данных бота')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--db', default=pool.path, help='путь к базе данных')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE,
+                        help='строк в одной транзакции копирования (compact-storage, archive)')
+    parser.add_argument('--keep-legacy', action='store_true',
+                        help='не удалять таблицы в старом формате (compact-storage)')
+    parser.add_argument('--keep-months', type=int, default=ARCHIVE_KEEP_MONTHS,
+                        help='сколько закрытых месяцев оставить в основной базе (archive)')
+    parser.add_argument('--no-vacuum', action='store_true', help='не выполнять очистку после архивации (archive)')
+    args = parser.parse_args()
+    pool.configure(path=args.db)
+    try:
+        COMMANDS[args.command](args)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики бота: гистограммы задержек, лаг event loop, экспорт в формате Prometheus
+Накладные расходы — несколько вызовов perf_counter и инкрементов на наблюдение
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Период проверки лага event loop (секунды)
+LOOP_LAG_INTERVAL = 0.5
+
+
+class Histogram:
+    """Гистограмма с метками; наблюдения потокобезопасны"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # метки -> [счётчики корзин..., +Inf], сумма
+        self._series = {}
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def series(self):
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def count(self, labels=()):
+        counts, _ = self.series().get(labels, ([0], 0.0))
+        return sum(counts)
+
+    def quantile(self, q, labels=()):
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        series = self.series().get(labels)
+        if not series:
+            return 0.0
+        counts = series[0]
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * ((rank - seen) / count)
+            seen += count
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.series().items()):
+            base = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(base + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(base)} {total}')
+            lines.append(f'{self.name}_count{format_labels(base)} {cumulative}')
+        return lines
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    parts = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Registry:
+    """Набор гистограмм и сборщиков значений (счётчики/показатели читаются при экспорте)"""
+
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, help_text, labelnames, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def add_collector(self, collector):
+        """collector() -> [(имя, тип, описание, [(словарь меток, значение), ...]), ...]"""
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error(f"Ошибка сборщика метрик: {e}")
+                continue
+            for name, metric_type, help_text, values in samples:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in values:
+                    lines.append(f'{name}{format_labels(sorted(labels.items()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.histogram('bot_handler_seconds', 'Время обработки обновления', ['handler'])
+ROUTE_LATENCY = registry.histogram('bot_route_seconds', 'Время обработки маршрута text_handler',
+                                   ['state', 'route'])
+SQL_LATENCY = registry.histogram('bot_sql_seconds', 'Время выполнения запроса к БД', ['helper'])
+LOOP_LAG = registry.histogram('bot_event_loop_lag_seconds', 'Опоздание event loop относительно таймера')
+API_LATENCY = registry.histogram('bot_telegram_api_seconds', 'Время запроса к Bot API (getUpdates — цикл опроса)',
+                                 ['method'])
+
+
+def timed(histogram, label=None):
+    """Декоратор: время вызова функции (синхронной или async) с меткой = имя функции"""
+    def decorator(func):
+        labels = (label or func.__name__,)
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, labels)
+        return wrapper
+    return decorator
+
+
+def timed_sql(func):
+    return timed(SQL_LATENCY)(func)
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Фоновая задача: насколько позже запланированного просыпается event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - expected, 0.0))
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest с замером времени каждого метода Bot API"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, (url.rsplit('/', 1)[-1],))
+
+
+# === HTTP-эндпоинт ===
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            body = registry.render().encode('utf-8')
+            status = '200 OK'
+        else:
+            body = b'not found\n'
+            status = '404 Not Found'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port):
+    """Запустить локальный HTTP-сервер с /metrics"""
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
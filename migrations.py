@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Версионированные миграции схемы базы данных
+Текущая версия хранится в PRAGMA user_version
+"""
+
+import logging
+
+from archive import create_profit_archives_table
+from rollups import create_profit_daily_table, rebuild_profit_daily
+from state_store import create_user_sessions_table
+
+logger = logging.getLogger(__name__)
+
+
+# Миграции: (версия, описание, шаги). Шаг — SQL-строка или функция от соединения.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'Индексы для запросов по профитам и пользователям', [
+        'CREATE INDEX IF NOT EXISTS idx_profits_user_date ON profits (user_id, date, direction, amount)',
+        'CREATE INDEX IF NOT EXISTS idx_profits_date ON profits (date, user_id, amount)',
+        'CREATE INDEX IF NOT EXISTS idx_users_team ON users (team_id)',
+        'CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)',
+        'ANALYZE',
+    ]),
+    (2, 'Дневные агрегаты профитов profit_daily', [
+        create_profit_daily_table,
+        rebuild_profit_daily,
+        'ANALYZE profit_daily',
+    ]),
+    (3, 'Состояния диалогов пользователей user_sessions', [
+        create_user_sessions_table,
+    ]),
+    (4, 'Список архивов закрытых месяцев profit_archives', [
+        create_profit_archives_table,
+    ]),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применить недостающие миграции; каждая выполняется в своей транзакции"""
+    current = get_schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Ошибка миграции {version}: {description}")
+            raise
+        current = version
+        logger.info(f"Применена миграция {version}: {description}")
+    return current
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь уведомлений с ограничением скорости отправки
+Работает в event loop приложения; для тестов достаточно объекта с async send_message(chat_id, text)
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, NetworkError, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Не больше сообщений в секунду на весь бот (лимит Telegram — около 30)
+GLOBAL_RATE = 25
+# Минимальный интервал между сообщениями в один чат (секунды)
+CHAT_INTERVAL = 1.0
+# Одновременно отправляемых сообщений
+MAX_IN_FLIGHT = 8
+# Повторы при сетевых ошибках и RetryAfter
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+# Максимальная длина сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Окно для расчёта задержки доставки
+LATENCY_WINDOW = 1000
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Части текста не длиннее limit: более длинное сообщение Telegram отклоняет (BadRequest)
+
+    Разрез — по последнему переводу строки в пределах лимита, иначе ровно по лимиту.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 1, limit + 1)
+        if cut == -1:
+            parts.append(text[:limit])
+            text = text[limit:]
+        else:
+            parts.append(text[:cut])
+            text = text[cut + 1:]
+    parts.append(text)
+    return [part for part in parts if part] or [text]
+
+
+class NotificationQueue:
+    """Фоновая доставка уведомлений: общий и поканальный лимиты, повторы, склейка сообщений одного чата"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL,
+                 max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES):
+        self.global_interval = 1.0 / global_rate
+        self.chat_interval = chat_interval
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.bot = None
+        # chat_id -> deque[(время постановки, текст)]
+        self._pending = OrderedDict()
+        self._retries = {}
+        self._in_flight = set()
+        self._next_chat_time = {}
+        self._next_global_time = 0.0
+        self._wakeup = None
+        self._task = None
+        self._senders = set()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.enqueued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    # === Постановка в очередь ===
+
+    def notify(self, chat_id, text):
+        """Поставить уведомление в очередь (не блокирует); длинный текст делится на несколько сообщений"""
+        now = asyncio.get_running_loop().time()
+        for part in split_message(text):
+            messages = self._pending.get(chat_id)
+            if messages is None:
+                self._pending[chat_id] = deque([(now, part)])
+            else:
+                messages.append((now, part))
+                self.coalesced += 1
+            self.enqueued += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def broadcast(self, chat_ids, text):
+        for chat_id in chat_ids:
+            self.notify(chat_id, text)
+
+    # === Доставка ===
+
+    def start(self, bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self, timeout=5.0):
+        """Остановить доставку, дождавшись отправки очереди не дольше timeout секунд"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не доставлено уведомлений при остановке: {self.depth()}")
+        self._task.cancel()
+        for sender in list(self._senders):
+            sender.cancel()
+        self._task = None
+
+    async def join(self):
+        """Дождаться, пока очередь опустеет"""
+        while self._pending or self._in_flight:
+            await asyncio.sleep(0.01)
+
+    def _pick_chat(self, now):
+        """Первый по очереди чат, которому уже можно отправлять; иначе — время ближайшей готовности"""
+        nearest = None
+        for chat_id in self._pending:
+            if chat_id in self._in_flight:
+                continue
+            ready_at = self._next_chat_time.get(chat_id, 0.0)
+            if ready_at <= now:
+                return chat_id, None
+            if nearest is None or ready_at < nearest:
+                nearest = ready_at
+        return None, nearest
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            chat_id, nearest = None, None
+            if len(self._in_flight) < self.max_in_flight:
+                chat_id, nearest = self._pick_chat(now)
+            if chat_id is None:
+                timeout = max(nearest - now, 0.0) if nearest is not None else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self._next_global_time > now:
+                await asyncio.sleep(self._next_global_time - now)
+                now = loop.time()
+            self._next_global_time = max(self._next_global_time, now) + self.global_interval
+            if len(self._next_chat_time) > 10000:
+                self._next_chat_time = {chat: ready for chat, ready in self._next_chat_time.items() if ready > now}
+            self._next_chat_time[chat_id] = now + self.chat_interval
+            self._in_flight.add(chat_id)
+            sender = asyncio.create_task(self._deliver(chat_id))
+            self._senders.add(sender)
+            sender.add_done_callback(self._senders.discard)
+
+    def _take_batch(self, chat_id):
+        """Склеить ожидающие сообщения чата в одно, не превышая лимит длины"""
+        messages = self._pending[chat_id]
+        batch = [messages.popleft()]
+        length = len(batch[0][1])
+        while messages and length + 2 + len(messages[0][1]) <= MAX_MESSAGE_LENGTH:
+            item = messages.popleft()
+            length += 2 + len(item[1])
+            batch.append(item)
+        if not messages:
+            del self._pending[chat_id]
+        return batch
+
+    def _requeue(self, chat_id, batch):
+        messages = self._pending.get(chat_id)
+        if messages is None:
+            self._pending[chat_id] = deque(batch)
+            self._pending.move_to_end(chat_id, last=False)
+        else:
+            messages.extendleft(reversed(batch))
+
+    async def _deliver(self, chat_id):
+        loop = asyncio.get_running_loop()
+        batch = self._take_batch(chat_id)
+        text = '\n\n'.join(message for _, message in batch)
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as e:
+            delay = e.retry_after
+            delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+            # Flood control действует на весь бот
+            self._next_global_time = max(self._next_global_time, loop.time() + delay)
+            self._retry(chat_id, batch, delay, e)
+        except (BadRequest, Forbidden) as e:
+            # Постоянные ошибки (чат не найден, бот заблокирован, неверная разметка): повтор не поможет.
+            # Проверяются до NetworkError — в python-telegram-bot BadRequest наследует NetworkError
+            self.failed += len(batch)
+            self._retries.pop(chat_id, None)
+            logger.error(f"Уведомление в чат {chat_id} не доставлено: {e}")
+        except NetworkError as e:
+            attempt = self._retries.get(chat_id, 0)
+            self._retry(chat_id, batch, RETRY_BASE_DELAY * 2 ** attempt, e)
+        except TelegramError as e:
+            self.failed += len(batch)
+            self._retries.pop(chat_id, None)
+            logger.error(f"Уведомление в чат {chat_id} не доставлено: {e}")
+        else:
+            now = loop.time()
+            for enqueued_at, _ in batch:
+                self._latencies.append(now - enqueued_at)
+            self.sent += 1
+            self._retries.pop(chat_id, None)
+        finally:
+            self._in_flight.discard(chat_id)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _retry(self, chat_id, batch, delay, error):
+        attempt = self._retries.get(chat_id, 0) + 1
+        if attempt > self.max_retries:
+            self.failed += len(batch)
+            self._retries.pop(chat_id, None)
+            logger.error(f"Уведомление в чат {chat_id} не доставлено после {self.max_retries} попыток: {error}")
+            return
+        self._retries[chat_id] = attempt
+        self.retried += 1
+        loop = asyncio.get_running_loop()
+        self._next_chat_time[chat_id] = loop.time() + delay
+        self._requeue(chat_id, batch)
+
+    # === Метрики ===
+
+    def depth(self):
+        """Количество уведомлений, ожидающих отправки"""
+        return sum(len(messages) for messages in self._pending.values())
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'depth': self.depth(),
+            'chats_pending': len(self._pending),
+            'in_flight': len(self._in_flight),
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+            'failed': self.failed,
+            'latency_avg': sum(latencies) / len(latencies) if latencies else 0.0,
+            'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            'latency_max': latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Постраничный вывод списков с навигацией inline-кнопками
+
+Списки пользователей читаются keyset-запросами (WHERE id > курсор ORDER BY id LIMIT n): курсоры начала
+страниц запоминаются, поэтому дальняя страница стоит столько же, сколько первая. Рейтинги берутся срезом
+из уже упорядоченного и закэшированного списка.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from cache import CACHES
+
+# Строк на странице
+PAGE_SIZE = 20
+# Сколько списков хранить в кэше курсоров
+CURSOR_CACHE_SIZE = 10000
+# Префикс callback_data кнопок навигации
+CALLBACK_PREFIX = 'page'
+
+Page = namedtuple('Page', ['number', 'rows', 'has_next'])
+
+
+class CursorCache:
+    """Курсоры начала страниц по спискам: ключ списка -> [курсор страницы 0, 1, ...]"""
+
+    def __init__(self, name, maxsize=CURSOR_CACHE_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        CACHES.append(self)
+
+    def nearest(self, key, number):
+        """Ближайшая известная страница не дальше number и её курсор"""
+        with self._lock:
+            cursors = self._data.get(key)
+            if cursors is None:
+                cursors = self._data[key] = [None]
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            self._data.move_to_end(key)
+            known = min(number, len(cursors) - 1)
+            if known == number:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return known, cursors[known]
+
+    def remember(self, key, number, cursor):
+        """Запомнить курсор начала страницы number"""
+        with self._lock:
+            cursors = self._data.get(key)
+            if cursors is not None and len(cursors) == number:
+                cursors.append(cursor)
+
+    def invalidate(self, key):
+        """Забыть курсоры списка: после добавления или удаления строк границы страниц сдвигаются"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+page_cursors = CursorCache('page_cursors')
+
+
+def keyset_page(key, number, load_after, page_size=PAGE_SIZE):
+    """Страница number списка key; load_after(курсор, limit) возвращает строки с ключом в row[0]
+
+    Если курсор страницы неизвестен (например, после перезапуска), список проходится от ближайшей
+    известной страницы, и найденные курсоры запоминаются.
+    """
+    current, cursor = page_cursors.nearest(key, number)
+    while True:
+        rows = load_after(cursor, page_size + 1)
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        if has_next:
+            page_cursors.remember(key, current + 1, rows[-1][0])
+        if current == number or not has_next:
+            return Page(current, rows, has_next)
+        current += 1
+        cursor = rows[-1][0]
+
+
+def slice_page(rows, number, page_size=PAGE_SIZE):
+    """Страница из уже упорядоченного списка"""
+    start = number * page_size
+    if start >= len(rows) and number > 0:
+        number = max((len(rows) - 1) // page_size, 0)
+        start = number * page_size
+    return Page(number, rows[start:start + page_size], len(rows) > start + page_size)
+
+
+def page_callback(kind, arg, number):
+    return f'{CALLBACK_PREFIX}:{kind}:{arg}:{number}'
+
+
+def parse_page_callback(data):
+    """callback_data кнопки навигации -> (kind, arg, number) или None"""
+    parts = (data or '').split(':')
+    if len(parts) != 4 or parts[0] != CALLBACK_PREFIX:
+        return None
+    try:
+        return parts[1], parts[2], max(int(parts[3]), 0)
+    except ValueError:
+        return None
+
+
+def page_keyboard(kind, arg, page):
+    """Кнопки «назад/вперёд» (None, если страница единственная)"""
+    buttons = []
+    if page.number > 0:
+        buttons.append(InlineKeyboardButton('◀️', callback_data=page_callback(kind, arg, page.number - 1)))
+    if page.has_next:
+        buttons.append(InlineKeyboardButton('▶️', callback_data=page_callback(kind, arg, page.number + 1)))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
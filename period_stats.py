@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Статистика сразу за все периоды (день, неделя, месяц, все время)
+Один проход по profit_daily с условной агрегацией вместо отдельного запроса на каждый период
+"""
+
+from datetime import datetime, timedelta
+
+from storage import begin_read
+
+PERIODS = ('day', 'week', 'month', 'all')
+
+
+def period_starts(now=None):
+    """{период: начальная дата 'YYYY-MM-DD'} (None — за все время)"""
+    now = now or datetime.now()
+    return {
+        'day': now.strftime('%Y-%m-%d'),
+        'week': (now - timedelta(days=7)).strftime('%Y-%m-%d'),
+        'month': (now - timedelta(days=30)).strftime('%Y-%m-%d'),
+        'all': None,
+    }
+
+
+def period_columns(starts, alias='d', counts=False):
+    """Колонки сумм (и количеств, если counts) по каждому периоду плюс MAX(day) и параметры к ним
+
+    Каждое условие стоит отдельного вычисления на строку, поэтому количества считаются только там,
+    где их показывают; попадание ключа в период определяется по дате его последней записи.
+    """
+    columns = []
+    params = []
+    for period in PERIODS:
+        start = starts[period]
+        if start is None:
+            columns.append(f'SUM({alias}.total)')
+            if counts:
+                columns.append(f'SUM({alias}.count)')
+        else:
+            columns.append(f'SUM(CASE WHEN {alias}.day >= ? THEN {alias}.total ELSE 0 END)')
+            params.append(start)
+            if counts:
+                columns.append(f'SUM(CASE WHEN {alias}.day >= ? THEN {alias}.count ELSE 0 END)')
+                params.append(start)
+    columns.append(f'MAX({alias}.day)')
+    return ', '.join(columns), params
+
+
+def stored_starts(fmt, starts):
+    """Начальные даты периодов в формате хранения базы"""
+    return {period: fmt.day(start) if start is not None else None for period, start in starts.items()}
+
+
+def split_periods(rows, key_width, starts, fmt, counts=False):
+    """Строки (ключ..., значения по периодам..., последний день) -> {период: [(ключ..., сумма[, количество])]}
+
+    В период попадают только ключи, у которых за него есть записи, как при отдельном запросе с WHERE day >= ?
+    starts — в формате хранения, суммы переводятся в обычные числа.
+    """
+    width = 2 if counts else 1
+    result = {period: [] for period in PERIODS}
+    for row in rows:
+        key = tuple(row[:key_width])
+        last_day = row[-1]
+        for index, period in enumerate(PERIODS):
+            start = starts[period]
+            if start is not None and last_day < start:
+                continue
+            offset = key_width + width * index
+            values = (fmt.amount_value(row[offset]),)
+            if counts:
+                values += (row[offset + 1] or 0,)
+            result[period].append(key + values)
+    return result
+
+
+def load_user_periods(conn, user_id, starts):
+    """Суммы воркера по направлениям: {период: [(направление, сумма, количество)]}"""
+    fmt = begin_read(conn)
+    starts = stored_starts(fmt, starts)
+    columns, params = period_columns(starts, counts=True)
+    rows = conn.execute(f'''
+        SELECT d.direction, {columns}
+        FROM profit_daily d
+        WHERE d.user_id = ?
+        GROUP BY d.direction
+    ''', params + [user_id]).fetchall()
+    return split_periods(rows, 1, starts, fmt, counts=True)
+
+
+def load_team_periods(conn, team_id, starts):
+    """Суммы участников команды: {период: [(имя, сумма)]} по убыванию суммы"""
+    fmt = begin_read(conn)
+    starts = stored_starts(fmt, starts)
+    columns, params = period_columns(starts)
+    rows = conn.execute(f'''
+        SELECT u.name, {columns}
+        FROM profit_daily d
+        JOIN users u ON d.user_id = u.id
+        WHERE d.team_id = ?
+        GROUP BY u.id, u.name
+    ''', params + [team_id]).fetchall()
+    return sort_periods(split_periods(rows, 1, starts, fmt))
+
+
+def load_workers_totals(conn, starts):
+    """Суммы воркеров: {период: [(id, имя, сумма)]} по убыванию суммы (при равенстве — по id)"""
+    fmt = begin_read(conn)
+    starts = stored_starts(fmt, starts)
+    columns, params = period_columns(starts)
+    rows = conn.execute(f'''
+        SELECT u.id, u.name, {columns}
+        FROM profit_daily d
+        JOIN users u ON d.user_id = u.id
+        WHERE u.role = 'worker'
+        GROUP BY u.id, u.name
+        ORDER BY u.id
+    ''', params).fetchall()
+    return sort_periods(split_periods(rows, 2, starts, fmt))
+
+
+def last_profit_id(conn):
+    """id последнего профита в снимке чтения (0 — профитов нет): начисления с большим id в снимок не вошли"""
+    return conn.execute('SELECT MAX(id) FROM profits').fetchone()[0] or 0
+
+
+def load_workers_periods(conn, starts):
+    """Рейтинг воркеров: {период: [(имя, сумма)]} по убыванию суммы"""
+    return {period: [(name, total) for _, name, total in items]
+            for period, items in load_workers_totals(conn, starts).items()}
+
+
+def load_teams_periods(conn, starts):
+    """Рейтинг команд: {период: [(название, сумма)]} по убыванию суммы, только с суммой > 0"""
+    fmt = begin_read(conn)
+    starts = stored_starts(fmt, starts)
+    columns, params = period_columns(starts)
+    rows = conn.execute(f'''
+        SELECT t.name, {columns}
+        FROM profit_daily d
+        JOIN teams t ON t.id = d.team_id
+        GROUP BY t.id, t.name
+    ''', params).fetchall()
+    periods = sort_periods(split_periods(rows, 1, starts, fmt))
+    return {period: [row for row in items if row[1] > 0] for period, items in periods.items()}
+
+
+def load_global_totals(conn, starts, yesterday):
+    """Суммы по (воркер, команда, направление) для глобальной статистики
+
+    Возвращает ({период: [(id, команда, роль, направление, сумма, количество)]}, те же строки за вчерашний день).
+    """
+    fmt = begin_read(conn)
+    starts = stored_starts(fmt, starts)
+    columns, params = period_columns(starts, counts=True)
+    day = fmt.day(yesterday)
+    rows = conn.execute(f'''
+        SELECT d.user_id, d.team_id, u.role, d.direction,
+               SUM(CASE WHEN d.day = ? THEN d.total ELSE 0 END), SUM(CASE WHEN d.day = ? THEN d.count ELSE 0 END),
+               {columns}
+        FROM profit_daily d
+        JOIN users u ON u.id = d.user_id
+        GROUP BY d.user_id, d.team_id, d.direction
+    ''', [day, day] + params).fetchall()
+    previous = [row[:4] + (fmt.amount_value(row[4]), row[5]) for row in rows if row[5]]
+    return split_periods([row[:4] + row[6:] for row in rows], 4, starts, fmt, counts=True), previous
+
+
+def sort_periods(periods):
+    """Упорядочить по убыванию суммы (последний элемент строки); сортировка устойчивая"""
+    for items in periods.values():
+        items.sort(key=lambda row: row[-1], reverse=True)
+    return periods
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Место воркера в рейтинге без построения всего списка
+Упорядоченные суммы воркеров за каждый период держатся в памяти и обновляются при начислении профита
+"""
+
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from period_stats import PERIODS, period_starts
+
+# Сколько соседей выше и ниже показывать
+RANK_NEIGHBOURS = 2
+# Сколько раз перезагружать суммы, если во время загрузки их сбросили (импорт, смена роли);
+# после последней попытки снимок отдаётся вызывающему без сохранения
+LOAD_ATTEMPTS = 3
+
+RankEntry = namedtuple('RankEntry', ['position', 'user_id', 'name', 'total'])
+# position — место (None, если за период нет профитов), count — воркеров в рейтинге,
+# gap — сколько не хватает до следующего места, neighbours — RankEntry вокруг воркера (включая его)
+WorkerRank = namedtuple('WorkerRank', ['position', 'count', 'total', 'gap', 'neighbours'])
+
+
+class OrderedTotals:
+    """Суммы одного периода: список ключей (-сумма, id) по возрастанию и словарь id -> сумма"""
+
+    def __init__(self, rows):
+        self._totals = {user_id: total for user_id, total in rows}
+        self._keys = sorted((-total, user_id) for user_id, total in self._totals.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, user_id, amount):
+        old = self._totals.get(user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        total = (old or 0) + amount
+        self._totals[user_id] = total
+        insort(self._keys, (-total, user_id))
+
+    def position(self, user_id):
+        """Место с 1 (None, если воркера нет в рейтинге периода)"""
+        total = self._totals.get(user_id)
+        if total is None:
+            return None
+        return bisect_left(self._keys, (-total, user_id)) + 1
+
+    def total(self, user_id):
+        return self._totals.get(user_id, 0)
+
+    def slice(self, start, stop):
+        """[(место, id, сумма)] для мест start..stop-1 (с 1)"""
+        start = max(start, 1)
+        return [(start + offset, user_id, -key)
+                for offset, (key, user_id) in enumerate(self._keys[start - 1:stop - 1])]
+
+
+class WorkerRanking:
+    """Рейтинг воркеров за все периоды; перестраивается при смене даты или после сброса"""
+
+    def __init__(self, loader, neighbours=RANK_NEIGHBOURS):
+        # loader(starts) -> ({период: [(id, имя, сумма)]} по убыванию суммы, id последнего профита в снимке)
+        self.loader = loader
+        self.neighbours = neighbours
+        self._lock = threading.Lock()
+        self._day = None
+        self._periods = None
+        self._names = {}
+        # Увеличивается при сбросе; загрузка, во время которой он сменился, повторяется
+        self._generation = 0
+        # Профиты, начисленные во время загрузки: (id профита, id воркера, имя, сумма, день).
+        # Записываются, пока идёт хотя бы одна загрузка, и добавляются к загруженному снимку
+        self._loading = 0
+        self._pending = []
+        self.loads = 0
+        self.replayed = 0
+        self.updates = 0
+        self.invalidations = 0
+
+    def _ensure_loaded(self):
+        """Суммы и имена текущего дня: (периоды, имена)
+
+        Возвращается сам снимок, а не признак загрузки: invalidate() из другого потока может сбросить
+        self._periods сразу после проверки, а снимок остаётся согласованным. Профиты, начисленные во время
+        загрузки, её не отменяют: те, что новее снимка базы (id больше загруженного), добавляются к нему,
+        поэтому при постоянных начислениях загрузка завершается с первой попытки.
+        """
+        for attempt in range(1, LOAD_ATTEMPTS + 1):
+            starts = period_starts()
+            with self._lock:
+                if self._periods is not None and self._day == starts['day']:
+                    return self._periods, self._names
+                generation = self._generation
+                self._loading += 1
+            try:
+                periods, last_id = self.loader(starts)
+                names = {}
+                ordered = {}
+                for period in PERIODS:
+                    rows = periods.get(period, [])
+                    for user_id, name, _ in rows:
+                        names[user_id] = name
+                    ordered[period] = OrderedTotals((user_id, total) for user_id, _, total in rows)
+                with self._lock:
+                    later = [delta for delta in self._pending if delta[0] > last_id]
+                    # Профит за другой день означает, что наступила новая дата и снимок устарел
+                    current = all(day == starts['day'] for *_, day in later)
+                    if current:
+                        for _, user_id, name, amount, _ in later:
+                            names[user_id] = name
+                            for totals in ordered.values():
+                                totals.add(user_id, amount)
+                    if current and self._generation == generation:
+                        self._day = starts['day']
+                        self._periods = ordered
+                        self._names = names
+                        self.loads += 1
+                        self.replayed += len(later)
+                        return ordered, names
+                    if attempt == LOAD_ATTEMPTS:
+                        return ordered, names
+            finally:
+                with self._lock:
+                    self._loading -= 1
+                    if not self._loading:
+                        self._pending = []
+
+    def rank(self, user_id, period):
+        periods, names = self._ensure_loaded()
+        with self._lock:
+            totals = periods[period]
+            position = totals.position(user_id)
+            total = totals.total(user_id)
+            if position is None:
+                return WorkerRank(None, len(totals), total, None, [])
+            gap = None
+            if position > 1:
+                (_, _, above_total), = totals.slice(position - 1, position)
+                gap = above_total - total
+            neighbours = [RankEntry(place, other_id, names.get(other_id), amount)
+                          for place, other_id, amount in totals.slice(position - self.neighbours,
+                                                                      position + self.neighbours + 1)]
+            return WorkerRank(position, len(totals), total, gap, neighbours)
+
+    def top(self, period, limit):
+        """[RankEntry] первых limit мест за период"""
+        periods, names = self._ensure_loaded()
+        with self._lock:
+            return [RankEntry(place, user_id, names.get(user_id), amount)
+                    for place, user_id, amount in periods[period].slice(1, limit + 1)]
+
+    def apply_profit(self, user_id, name, amount, day, profit_id):
+        """Учесть профит воркера за день day (сегодняшний профит входит во все периоды)"""
+        with self._lock:
+            if self._loading:
+                self._pending.append((profit_id, user_id, name, amount, day))
+            if self._periods is None or self._day != day:
+                self._periods = None
+                return
+            self._names[user_id] = name
+            for totals in self._periods.values():
+                totals.add(user_id, amount)
+            self.updates += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._periods = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'day': self._day if self._periods is not None else None,
+                'workers': len(self._periods['all']) if self._periods is not None else 0,
+                'loads': self.loads,
+                'replayed': self.replayed,
+                'updates': self.updates,
+                'invalidations': self.invalidations,
+            }
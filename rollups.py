@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Дневные агрегаты профитов (таблица profit_daily)
+Ключ: (day, user_id, team_id, direction), значения: сумма и количество профитов
+"""
+
+import logging
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+
+def create_profit_daily_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS profit_daily (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            team_id INTEGER,
+            direction TEXT,
+            total REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (day, user_id, team_id, direction)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_profit_daily_user '
+                 'ON profit_daily (user_id, day, direction, total, count)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_profit_daily_team '
+                 'ON profit_daily (team_id, day, user_id, total)')
+
+
+def apply_profit(cursor, user_id, direction, amount, day, count=1):
+    """Добавить профит в агрегаты; вызывается в той же транзакции, что и INSERT в profits"""
+    cursor.execute('''
+        UPDATE profit_daily SET total = total + ?, count = count + ?
+        WHERE day = ? AND user_id = ? AND direction IS ?
+    ''', (amount, count, day, user_id, direction))
+    if cursor.rowcount == 0:
+        cursor.execute('''
+            INSERT INTO profit_daily (day, user_id, team_id, direction, total, count)
+            VALUES (?, ?, (SELECT team_id FROM users WHERE id = ?), ?, ?, ?)
+        ''', (day, user_id, user_id, direction, amount, count))
+
+
+def apply_profits(cursor, groups):
+    """Добавить в агрегаты сгруппированные профиты: {(day, user_id, direction): [сумма, количество]}"""
+    for (day, user_id, direction), (amount, count) in groups.items():
+        apply_profit(cursor, user_id, direction, amount, day, count)
+
+
+def move_user_team(cursor, user_id, team_id):
+    """Перенести агрегаты пользователя в новую команду (статистика команды считается по текущему составу)"""
+    cursor.execute('UPDATE profit_daily SET team_id = ? WHERE user_id = ?', (team_id, user_id))
+
+
+def archived_until(conn):
+    """Первый день основной базы в формате хранения (None — архивов нет); раньше — только в архивах"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'profit_archives'"
+    ).fetchone()
+    if not exists:
+        return None
+    end_day = conn.execute('SELECT MAX(end_day) FROM profit_archives').fetchone()[0]
+    return storage.get_format(conn).day(end_day) if end_day else None
+
+
+def rebuild_profit_daily(conn):
+    """Пересобрать агрегаты из сырых профитов; агрегаты перенесённых в архив месяцев сохраняются"""
+    boundary = archived_until(conn)
+    condition, params = '', ()
+    if boundary is not None:
+        condition, params = 'AND p.date >= ?', (boundary,)
+        conn.execute('DELETE FROM profit_daily WHERE day >= ?', params)
+    else:
+        conn.execute('DELETE FROM profit_daily')
+    conn.execute(f'''
+        INSERT INTO profit_daily (day, user_id, team_id, direction, total, count)
+        SELECT p.date, p.user_id, u.team_id, p.direction, COALESCE(SUM(p.amount), 0), COUNT(*)
+        FROM profits p
+        LEFT JOIN users u ON p.user_id = u.id
+        WHERE p.user_id IS NOT NULL AND p.date IS NOT NULL {condition}
+        GROUP BY p.date, p.user_id, p.direction
+    ''', params)
+    rows = conn.execute('SELECT COUNT(*) FROM profit_daily').fetchone()[0]
+    logger.info(f"Агрегаты profit_daily пересобраны: {rows} строк")
+    return rows
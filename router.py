@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Декларативный маршрутизатор текстовых кнопок
+Маршрут ищется по ключу (состояние, текст кнопки) одним обращением к словарю
+"""
+
+import time
+from collections import namedtuple
+
+from metrics import ROUTE_LATENCY
+
+# Маршрут, действующий в любом состоянии
+ANY_STATE = '*'
+
+Route = namedtuple('Route', ['state', 'text', 'handler', 'roles'])
+
+
+class Router:
+    """Таблица маршрутов (состояние, текст) -> обработчик с запасными обработчиками по состояниям"""
+
+    def __init__(self, denied_text="Доступ запрещён."):
+        self.denied_text = denied_text
+        self._routes = {}
+        self._fallbacks = {}
+
+    def route(self, *texts, state=ANY_STATE, roles=None):
+        """Декоратор: зарегистрировать обработчик для кнопок texts в состоянии state"""
+        states = state if isinstance(state, (list, tuple)) else (state,)
+        roles = frozenset(roles) if roles else None
+
+        def decorator(handler):
+            for route_state in states:
+                for text in texts:
+                    key = (route_state, text)
+                    if key in self._routes:
+                        raise ValueError(f"Маршрут уже зарегистрирован: {key}")
+                    self._routes[key] = Route(route_state, text, handler, roles)
+            return handler
+        return decorator
+
+    def fallback(self, state=ANY_STATE, roles=None):
+        """Декоратор: обработчик текста, не совпавшего ни с одной кнопкой состояния"""
+        roles = frozenset(roles) if roles else None
+
+        def decorator(handler):
+            self._fallbacks[state] = Route(state, None, handler, roles)
+            return handler
+        return decorator
+
+    def resolve(self, state, text):
+        """Найти маршрут: кнопка состояния, глобальная кнопка, запасной обработчик состояния, общий"""
+        route = self._routes.get((state, text))
+        if route is None:
+            route = self._routes.get((ANY_STATE, text))
+        if route is None:
+            route = self._fallbacks.get(state) or self._fallbacks.get(ANY_STATE)
+        return route
+
+    async def dispatch(self, update, context, state, text, profile):
+        route = self.resolve(state, text)
+        if route is None:
+            return None
+        role = profile.role if profile else None
+        if route.roles is not None and role not in route.roles:
+            await update.message.reply_text(self.denied_text)
+            return route
+        started = time.perf_counter()
+        try:
+            await route.handler(update, context, profile)
+        finally:
+            ROUTE_LATENCY.observe(time.perf_counter() - started, (route.state, route.handler.__name__))
+        return route
+
+    def routes(self):
+        """Все маршруты (для отладки и бенчмарков)"""
+        return list(self._routes.values()) + list(self._fallbacks.values())
+
+    def states(self):
+        return sorted({route.state for route in self.routes()})
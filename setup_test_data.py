@@ -6,6 +6,9 @@
 
 import sqlite3
 
+import rollups
+import storage
+
 # Подключиться к базе данных
 conn = sqlite3.connect('bot_database.db')
 cursor = conn.cursor()
@@ -96,12 +99,11 @@ if worker_result:
         (worker_id, 'Binance', 250.00, datetime.datetime.now().strftime('%Y-%m-%d'), 'Тестовый профит 2'),
     ]
     
+    fmt = storage.get_format(conn)
     for user_id, direction, amount, date, comment in profits:
         try:
-            cursor.execute('''
-                INSERT INTO profits (user_id, direction, amount, date, comment)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, direction, amount, date, comment))
+            cursor.execute(fmt.insert_profit_sql, fmt.profit_row(user_id, direction, amount, date, comment))
+            rollups.apply_profit(cursor, user_id, direction, fmt.amount(amount), fmt.day(date))
             print(f"  ✓ Профит ${amount} добавлен")
         except Exception as e:
             print(f"  ✗ Ошибка при добавлении профита: {e}")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилище состояний диалогов пользователей
+В памяти — LRU с временем простоя, на диске — таблица user_sessions (запись пачками)
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from database import pool
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число пользователей в памяти
+STATE_CACHE_SIZE = 10000
+# Время простоя (секунды), после которого состояние выгружается из памяти
+STATE_IDLE_TTL = 3600
+# Период записи изменений на диск (секунды) и размер пачки, при котором запись идёт сразу
+STATE_FLUSH_INTERVAL = 1.0
+STATE_FLUSH_BATCH = 500
+
+# Маркер удалённой записи в очереди на запись
+_DELETED = None
+
+
+def create_user_sessions_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            telegram_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+class StateField:
+    """Словареподобное представление одного поля состояния (user_states, selected_period, ...)"""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def get(self, telegram_id, default=None):
+        return self.store.get(telegram_id, self.name, default)
+
+    def pop(self, telegram_id, default=None):
+        return self.store.pop(telegram_id, self.name, default)
+
+    def __getitem__(self, telegram_id):
+        value = self.store.get(telegram_id, self.name, _DELETED)
+        if value is _DELETED:
+            raise KeyError(telegram_id)
+        return value
+
+    def __setitem__(self, telegram_id, value):
+        self.store.set(telegram_id, self.name, value)
+
+    def __delitem__(self, telegram_id):
+        if self.store.pop(telegram_id, self.name, _DELETED) is _DELETED:
+            raise KeyError(telegram_id)
+
+    def __contains__(self, telegram_id):
+        return self.store.get(telegram_id, self.name, _DELETED) is not _DELETED
+
+
+class StateStore:
+    """Состояния пользователей: LRU + время простоя в памяти, запись пачками в SQLite"""
+
+    def __init__(self, maxsize=STATE_CACHE_SIZE, idle_ttl=STATE_IDLE_TTL,
+                 flush_interval=STATE_FLUSH_INTERVAL, flush_batch=STATE_FLUSH_BATCH):
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._lock = threading.Lock()
+        # telegram_id -> [время последнего обращения, данные]
+        self._entries = OrderedDict()
+        # telegram_id -> данные (или _DELETED), ещё не записанные на диск
+        self._dirty = {}
+        # Пачка, которая сейчас записывается: до фиксации _load берёт данные из неё, а не из базы
+        self._flushing = {}
+        self._flush_requested = None
+        self.lru_evictions = 0
+        self.idle_evictions = 0
+        self.loads = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def field(self, name):
+        return StateField(self, name)
+
+    # === Память ===
+
+    def _entry(self, telegram_id):
+        """Данные пользователя (загружаются с диска при первом обращении)"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None:
+                entry[0] = time.monotonic()
+                self._entries.move_to_end(telegram_id)
+                return entry[1]
+        data = self._load(telegram_id)
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                entry = [time.monotonic(), data]
+                self._entries[telegram_id] = entry
+                self._evict()
+            return entry[1]
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.lru_evictions += 1
+
+    def evict_idle(self):
+        """Выгрузить состояния пользователей, неактивных дольше idle_ttl"""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            while self._entries:
+                telegram_id, entry = next(iter(self._entries.items()))
+                if entry[0] > deadline:
+                    break
+                del self._entries[telegram_id]
+                self.idle_evictions += 1
+
+    def is_loaded(self, telegram_id):
+        return telegram_id in self._entries
+
+    def get(self, telegram_id, name, default=None):
+        return self._entry(telegram_id).get(name, default)
+
+    def set(self, telegram_id, name, value):
+        data = self._entry(telegram_id)
+        with self._lock:
+            data[name] = value
+            self._mark_dirty(telegram_id, data)
+
+    def pop(self, telegram_id, name, default=None):
+        data = self._entry(telegram_id)
+        with self._lock:
+            if name not in data:
+                return default
+            value = data.pop(name)
+            self._mark_dirty(telegram_id, data)
+            return value
+
+    def _mark_dirty(self, telegram_id, data):
+        self._dirty[telegram_id] = dict(data) if data else _DELETED
+        if len(self._dirty) >= self.flush_batch and self._flush_requested is not None:
+            self._flush_requested.set()
+
+    # === Диск ===
+
+    def _load(self, telegram_id):
+        with self._lock:
+            for batch in (self._dirty, self._flushing):
+                if telegram_id in batch:
+                    pending = batch[telegram_id]
+                    return dict(pending) if pending is not _DELETED else {}
+        self.loads += 1
+        with pool.reader() as conn:
+            row = conn.execute('SELECT data FROM user_sessions WHERE telegram_id = ?', (telegram_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def ensure_loaded(self, telegram_id, run_read):
+        """Подгрузить состояние пользователя вне event loop перед обработкой сообщения"""
+        if telegram_id not in self._entries:
+            await run_read(self._entry, telegram_id)
+
+    def flush(self):
+        """Записать накопленные изменения одной транзакцией (вызовы идут по одному — в полосе записи)"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty = self._dirty
+            self._dirty = {}
+            self._flushing = dirty
+        now = int(time.time())
+        upserts = []
+        deletes = []
+        for telegram_id, data in dirty.items():
+            if data is _DELETED:
+                deletes.append((telegram_id,))
+            else:
+                upserts.append((telegram_id, json.dumps(data, ensure_ascii=False, separators=(',', ':')), now))
+        try:
+            with pool.writer() as conn:
+                conn.executemany('INSERT OR REPLACE INTO user_sessions (telegram_id, data, updated_at) '
+                                 'VALUES (?, ?, ?)', upserts)
+                conn.executemany('DELETE FROM user_sessions WHERE telegram_id = ?', deletes)
+        except Exception:
+            # Возвращаем изменения в очередь, не затирая более свежие
+            with self._lock:
+                for telegram_id, data in dirty.items():
+                    self._dirty.setdefault(telegram_id, data)
+                self._flushing = {}
+            raise
+        with self._lock:
+            self._flushing = {}
+        self.flushes += 1
+        self.rows_flushed += len(dirty)
+        return len(dirty)
+
+    async def run_flusher(self, run_write):
+        """Фоновая задача: запись изменений раз в flush_interval или при заполнении пачки"""
+        self._flush_requested = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_requested.clear()
+                try:
+                    await run_write(self.flush)
+                except Exception as e:
+                    logger.error(f"Ошибка записи состояний: {e}")
+                self.evict_idle()
+        finally:
+            self._flush_requested = None
+
+    # === Метрики ===
+
+    def memory_usage(self):
+        """Приблизительный объём памяти, занятый состояниями (байты)"""
+        with self._lock:
+            entries = list(self._entries.items())
+        total = sys.getsizeof(self._entries)
+        for telegram_id, entry in entries:
+            data = entry[1]
+            total += sys.getsizeof(telegram_id) + sys.getsizeof(entry) + sys.getsizeof(data)
+            for key, value in data.items():
+                total += sys.getsizeof(key) + sys.getsizeof(value)
+        return total
+
+    def stats(self):
+        return {
+            'users': len(self._entries),
+            'dirty': len(self._dirty),
+            'memory_bytes': self.memory_usage(),
+            'lru_evictions': self.lru_evictions,
+            'idle_evictions': self.idle_evictions,
+            'loads': self.loads,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+        }
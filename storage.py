@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Форматы хранения сумм и дат профитов
+
+text    — amount REAL, date TEXT 'YYYY-MM-DD' (исходная схема, по умолчанию)
+compact — amount INTEGER в центах, date INTEGER — номер дня от 1970-01-01, created_at INTEGER — время
+          начисления в секундах epoch (для профитов, начисленных в боте)
+
+Формат определяется по схеме таблицы profits, поэтому бот продолжает работать во время и после
+онлайн-миграции (python maintenance.py compact-storage).
+"""
+
+import logging
+import time
+import weakref
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Строк за одну транзакцию копирования при миграции
+MIGRATION_BATCH_SIZE = 20000
+# Пауза между пачками, чтобы писатель бота успевал выполнять свои транзакции (секунды)
+MIGRATION_PAUSE = 0.01
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# julianday('1970-01-01')
+EPOCH_JULIAN_DAY = 2440587.5
+
+
+class TextFormat:
+    name = 'text'
+    insert_profit_sql = 'INSERT INTO profits (user_id, direction, amount, date, comment) VALUES (?, ?, ?, ?, ?)'
+
+    def amount(self, value):
+        return value
+
+    def amount_value(self, stored):
+        return stored or 0
+
+    def day(self, iso_day):
+        return iso_day
+
+    def day_value(self, stored):
+        return stored
+
+    def profit_row(self, user_id, direction, amount, day, comment, created_at=None):
+        return (user_id, direction, amount, day, comment)
+
+
+class CompactFormat:
+    name = 'compact'
+    insert_profit_sql = ('INSERT INTO profits (user_id, direction, amount, date, comment, created_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)')
+
+    def amount(self, value):
+        return int(round(value * 100))
+
+    def amount_value(self, stored):
+        return (stored or 0) / 100
+
+    def day(self, iso_day):
+        return date.fromisoformat(iso_day).toordinal() - EPOCH_ORDINAL
+
+    def day_value(self, stored):
+        return date.fromordinal(stored + EPOCH_ORDINAL).isoformat()
+
+    def profit_row(self, user_id, direction, amount, day, comment, created_at=None):
+        return (user_id, direction, self.amount(amount), self.day(day), comment, created_at)
+
+
+TEXT = TextFormat()
+COMPACT = CompactFormat()
+
+# Соединение -> (schema_version, формат); схема меняется редко, поэтому проверка — одна PRAGMA
+_detected = weakref.WeakKeyDictionary()
+
+
+def get_format(conn):
+    """Формат хранения базы, к которой относится соединение"""
+    version = conn.execute('PRAGMA schema_version').fetchone()[0]
+    try:
+        cached = _detected.get(conn)
+    except TypeError:
+        cached = None
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    columns = {row[1]: (row[2] or '').upper() for row in conn.execute('PRAGMA table_info(profits)')}
+    fmt = COMPACT if columns.get('amount') == 'INTEGER' else TEXT
+    try:
+        _detected[conn] = (version, fmt)
+    except TypeError:
+        # Обычное sqlite3.Connection (не из пула) не поддерживает слабые ссылки — без кэша
+        pass
+    return fmt
+
+
+def begin_write(conn):
+    """Начать транзакцию записи и вернуть формат: до commit схему никто не поменяет"""
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    return get_format(conn)
+
+
+def begin_read(conn):
+    """Начать транзакцию чтения, чтобы формат и данные относились к одному снимку базы"""
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    return get_format(conn)
+
+
+# === Онлайн-миграция text -> compact ===
+
+def compact_amount_sql(column):
+    return f'CAST(ROUND({column} * 100) AS INTEGER)'
+
+
+def compact_day_sql(column):
+    return f'CAST(julianday({column}) - {EPOCH_JULIAN_DAY} AS INTEGER)'
+
+
+PROFIT_COLUMNS = 'user_id, direction, amount, date, comment'
+DAILY_COLUMNS = 'day, user_id, team_id, direction, total, count'
+
+
+def profit_values(prefix):
+    return (f'{prefix}user_id, {prefix}direction, {compact_amount_sql(prefix + "amount")}, '
+            f'{compact_day_sql(prefix + "date")}, {prefix}comment')
+
+
+def daily_values(prefix):
+    return (f'{compact_day_sql(prefix + "day")}, {prefix}user_id, {prefix}team_id, {prefix}direction, '
+            f'{compact_amount_sql(prefix + "total")}, {prefix}count')
+
+
+SHADOW_SCHEMA = [
+    'DROP TRIGGER IF EXISTS profits_compact_insert',
+    'DROP TRIGGER IF EXISTS profits_compact_update',
+    'DROP TRIGGER IF EXISTS profits_compact_delete',
+    'DROP TRIGGER IF EXISTS profit_daily_compact_insert',
+    'DROP TRIGGER IF EXISTS profit_daily_compact_update',
+    'DROP TRIGGER IF EXISTS profit_daily_compact_delete',
+    'DROP TABLE IF EXISTS profits_compact',
+    'DROP TABLE IF EXISTS profit_daily_compact',
+    '''
+        CREATE TABLE profits_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            direction TEXT,
+            amount INTEGER,
+            date INTEGER,
+            comment TEXT,
+            created_at INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    'CREATE INDEX idx_profits_compact_user_date ON profits_compact (user_id, date, direction, amount)',
+    'CREATE INDEX idx_profits_compact_date ON profits_compact (date, user_id, amount)',
+    '''
+        CREATE TABLE profit_daily_compact (
+            day INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            team_id INTEGER,
+            direction TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (day, user_id, team_id, direction)
+        )
+    ''',
+    'CREATE INDEX idx_profit_daily_compact_user ON profit_daily_compact (user_id, day, direction, total, count)',
+    'CREATE INDEX idx_profit_daily_compact_team ON profit_daily_compact (team_id, day, user_id, total)',
+    # Изменения, сделанные ботом во время копирования, сразу попадают в теневые таблицы
+    f'''
+        CREATE TRIGGER profits_compact_insert AFTER INSERT ON profits BEGIN
+            INSERT OR REPLACE INTO profits_compact (id, {PROFIT_COLUMNS}, created_at)
+            VALUES (NEW.id, {profit_values('NEW.')},
+                    CASE WHEN NEW.date = date('now', 'localtime') THEN CAST(strftime('%s', 'now') AS INTEGER) END);
+        END
+    ''',
+    f'''
+        CREATE TRIGGER profits_compact_update AFTER UPDATE ON profits BEGIN
+            UPDATE profits_compact SET (id, {PROFIT_COLUMNS}) = (NEW.id, {profit_values('NEW.')})
+            WHERE id = OLD.id;
+        END
+    ''',
+    '''
+        CREATE TRIGGER profits_compact_delete AFTER DELETE ON profits BEGIN
+            DELETE FROM profits_compact WHERE id = OLD.id;
+        END
+    ''',
+    f'''
+        CREATE TRIGGER profit_daily_compact_insert AFTER INSERT ON profit_daily BEGIN
+            INSERT OR REPLACE INTO profit_daily_compact (rowid, {DAILY_COLUMNS})
+            VALUES (NEW.rowid, {daily_values('NEW.')});
+        END
+    ''',
+    f'''
+        CREATE TRIGGER profit_daily_compact_update AFTER UPDATE ON profit_daily BEGIN
+            UPDATE profit_daily_compact SET ({DAILY_COLUMNS}) = ({daily_values('NEW.')})
+            WHERE rowid = OLD.rowid;
+        END
+    ''',
+    '''
+        CREATE TRIGGER profit_daily_compact_delete AFTER DELETE ON profit_daily BEGIN
+            DELETE FROM profit_daily_compact WHERE rowid = OLD.rowid;
+        END
+    ''',
+]
+
+SWAP_SCHEMA = [
+    'DROP TRIGGER profits_compact_insert',
+    'DROP TRIGGER profits_compact_update',
+    'DROP TRIGGER profits_compact_delete',
+    'DROP TRIGGER profit_daily_compact_insert',
+    'DROP TRIGGER profit_daily_compact_update',
+    'DROP TRIGGER profit_daily_compact_delete',
+    'ALTER TABLE profits RENAME TO profits_legacy',
+    'ALTER TABLE profits_compact RENAME TO profits',
+    'ALTER TABLE profit_daily RENAME TO profit_daily_legacy',
+    'ALTER TABLE profit_daily_compact RENAME TO profit_daily',
+]
+
+
+def copy_table(pool, source, target, key, columns, values, max_key, batch_size, pause):
+    """Скопировать строки source с key <= max_key в target пачками; каждая пачка — своя транзакция
+
+    Строки, добавленные позже, уже перенесены триггерами.
+    """
+    with pool.writer() as conn:
+        last_key = conn.execute(f'SELECT COALESCE(MIN({key}), 1) - 1 FROM {source}').fetchone()[0]
+    copied = 0
+    while True:
+        with pool.writer() as conn:
+            upper, count = conn.execute(
+                f'SELECT MAX({key}), COUNT(*) FROM '
+                f'(SELECT {key} FROM {source} WHERE {key} > ? AND {key} <= ? ORDER BY {key} LIMIT ?)',
+                (last_key, max_key, batch_size)
+            ).fetchone()
+            if not count:
+                return copied
+            conn.execute(
+                f'INSERT OR IGNORE INTO {target} ({key}, {columns}) '
+                f'SELECT {key}, {values} FROM {source} WHERE {key} > ? AND {key} <= ?',
+                (last_key, upper)
+            )
+        last_key = upper
+        copied += count
+        if pause:
+            time.sleep(pause)
+
+
+def migrate_to_compact(pool, batch_size=MIGRATION_BATCH_SIZE, pause=MIGRATION_PAUSE, keep_legacy=False):
+    """Онлайн-перевод profits и profit_daily в компактный формат
+
+    Теневые таблицы заполняются пачками, изменения бота во время копирования переносятся триггерами,
+    затем таблицы меняются местами в одной короткой транзакции.
+    """
+    started = time.perf_counter()
+    with pool.writer() as conn:
+        if begin_write(conn) is COMPACT:
+            logger.info("База уже в компактном формате")
+            return None
+        for statement in SHADOW_SCHEMA:
+            conn.execute(statement)
+        # Граница копирования: всё, что появится после создания триггеров, они перенесут сами
+        max_profit = conn.execute('SELECT COALESCE(MAX(id), 0) FROM profits').fetchone()[0]
+        max_daily = conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM profit_daily').fetchone()[0]
+
+    profits = copy_table(pool, 'profits', 'profits_compact', 'id', PROFIT_COLUMNS,
+                         profit_values(''), max_profit, batch_size, pause)
+    logger.info(f"Скопировано профитов: {profits}")
+    daily = copy_table(pool, 'profit_daily', 'profit_daily_compact', 'rowid', DAILY_COLUMNS,
+                       daily_values(''), max_daily, batch_size, pause)
+    logger.info(f"Скопировано строк profit_daily: {daily}")
+
+    swap_started = time.perf_counter()
+    with pool.writer() as conn:
+        begin_write(conn)
+        for source, target in (('profits', 'profits_compact'), ('profit_daily', 'profit_daily_compact')):
+            expected = conn.execute(f'SELECT COUNT(*) FROM {source}').fetchone()[0]
+            actual = conn.execute(f'SELECT COUNT(*) FROM {target}').fetchone()[0]
+            if expected != actual:
+                raise RuntimeError(f"{target}: {actual} строк вместо {expected}")
+        for statement in SWAP_SCHEMA:
+            conn.execute(statement)
+    swap_seconds = time.perf_counter() - swap_started
+
+    if not keep_legacy:
+        drop_legacy(pool)
+    with pool.writer() as conn:
+        conn.execute('ANALYZE')
+    report = {
+        'profits': profits,
+        'profit_daily': daily,
+        'swap_seconds': swap_seconds,
+        'seconds': time.perf_counter() - started,
+    }
+    logger.info(f"База переведена в компактный формат: {report}")
+    return report
+
+
+def drop_legacy(pool):
+    """Удалить таблицы в старом формате, оставшиеся после миграции"""
+    for table in ('profits_legacy', 'profit_daily_legacy'):
+        with pool.writer() as conn:
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение форматов хранения text и compact: размер базы и скорость запросов
+
+Использование:
+    python generate_data.py --db bench_database.db --workers 2000 --days 365 --profits-per-day 5000
+    python storage_benchmark.py --db bench_database.db
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import benchmark
+from database import pool
+from storage import get_format, migrate_to_compact
+
+
+def database_size(path):
+    """Размер файла базы (после VACUUM) и размеры таблиц/индексов профитов в байтах"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('VACUUM')
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        sizes = {'file': os.path.getsize(path)}
+        try:
+            for name, pages in conn.execute('SELECT name, COUNT(*) FROM dbstat GROUP BY name'):
+                if 'profit' in name:
+                    # Индексы после миграции называются *_compact_*
+                    sizes[name.replace('_compact', '')] = pages * page_size
+        except sqlite3.OperationalError:
+            # SQLite собран без dbstat — только общий размер
+            pass
+        return sizes
+    finally:
+        conn.close()
+
+
+def summation_drift(path):
+    """Расхождение суммы дневных агрегатов с точной суммой профитов в центах"""
+    conn = sqlite3.connect(path)
+    try:
+        fmt = get_format(conn)
+        stored = conn.execute('SELECT SUM(total) FROM profit_daily').fetchone()[0] or 0
+        cents = 'amount' if fmt.name == 'compact' else 'CAST(ROUND(amount * 100) AS INTEGER)'
+        exact = conn.execute(f'SELECT SUM({cents}) FROM profits').fetchone()[0] or 0
+        return fmt.amount_value(stored) - exact / 100
+    finally:
+        conn.close()
+
+
+def measure_format(path, repeat, subjects):
+    pool.configure(path=path)
+    try:
+        return benchmark.run_benchmarks(repeat=repeat, subjects=subjects)['results']
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение форматов хранения text и compact')
+    parser.add_argument('--db', default='bench_database.db', help='база в формате text (generate_data.py)')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--subjects', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_path = os.path.join(tmp_dir, 'text.db')
+        compact_path = os.path.join(tmp_dir, 'compact.db')
+        shutil.copy(args.db, text_path)
+        shutil.copy(args.db, compact_path)
+
+        pool.configure(path=compact_path)
+        try:
+            report = migrate_to_compact(pool)
+        finally:
+            pool.close()
+        if report:
+            print(f"Миграция: {report['profits']} профитов за {report['seconds']:.1f} с, "
+                  f"переключение таблиц {report['swap_seconds'] * 1000:.0f} мс")
+
+        sizes = {name: database_size(path) for name, path in (('text', text_path), ('compact', compact_path))}
+        print(f"\n{'объект':36}{'text, МБ':>12}{'compact, МБ':>14}")
+        for name in sorted(set(sizes['text']) | set(sizes['compact'])):
+            text_size = sizes['text'].get(name, 0) / 1024 / 1024
+            compact_size = sizes['compact'].get(name, 0) / 1024 / 1024
+            print(f"{name:36}{text_size:>12.2f}{compact_size:>14.2f}")
+
+        print(f"\nОшибка суммы агрегатов: text {summation_drift(text_path):+.6f}, "
+              f"compact {summation_drift(compact_path):+.6f}")
+
+        print("\ntext:")
+        text_results = measure_format(text_path, args.repeat, args.subjects)
+        print("\ncompact:")
+        compact_results = measure_format(compact_path, args.repeat, args.subjects)
+
+    print(f"\n{'запрос':32}{'text, мс':>12}{'compact, мс':>14}{'x':>8}")
+    for old, new in zip(text_results, compact_results):
+        ratio = new['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        print(f"{old['name']:32}{old['median_ms']:>12.3f}{new['median_ms']:>14.3f}{ratio:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
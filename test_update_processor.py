@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверки KeyedUpdateProcessor: перемежающиеся обновления нескольких пользователей проходят через
+Application (Bot API — FakeBotApi в процессе), порядок внутри пользователя сохраняется,
+разные пользователи обрабатываются одновременно.
+
+Запуск:
+    python -m pytest -q test_update_processor.py
+"""
+
+import asyncio
+import random
+
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+
+from fake_bot_api import FakeBotApi, InProcessRequest, make_text_update
+from update_processor import KeyedUpdateProcessor
+
+FAKE_TOKEN = '123456:TEST'
+USERS = [9000000000 + number for number in range(6)]
+
+
+def interleaved_updates(rng, messages_per_user):
+    """[(chat_id, текст)]: сообщения пользователей вперемешку, у каждого — «1», «2», … по порядку"""
+    queues = {chat_id: [str(number) for number in range(1, messages_per_user + 1)] for chat_id in USERS}
+    stream = []
+    while queues:
+        chat_id = rng.choice(list(queues))
+        stream.append((chat_id, queues[chat_id].pop(0)))
+        if not queues[chat_id]:
+            del queues[chat_id]
+    return stream
+
+
+async def replay(stream, limit, seed=1):
+    """Подать поток в Application; возвращает журнал обработки и пиковые значения параллельности"""
+    rng = random.Random(seed)
+    api = FakeBotApi(history=0)
+    processor = KeyedUpdateProcessor(limit)
+    application = (
+        Application.builder()
+        .token(FAKE_TOKEN)
+        .request(InProcessRequest(api))
+        .get_updates_request(InProcessRequest(api))
+        .concurrent_updates(processor)
+        .build()
+    )
+    handled = []
+    active = {'total': 0, 'peak': 0, 'users': {}, 'user_peak': 0}
+
+    async def record(update, context):
+        chat_id = update.effective_user.id
+        active['total'] += 1
+        active['users'][chat_id] = active['users'].get(chat_id, 0) + 1
+        active['peak'] = max(active['peak'], active['total'])
+        active['user_peak'] = max(active['user_peak'], active['users'][chat_id])
+        # Разная длительность обработки: без очереди пользователя порядок бы перемешался
+        await asyncio.sleep(rng.uniform(0, 0.01))
+        handled.append((chat_id, update.message.text))
+        active['users'][chat_id] -= 1
+        active['total'] -= 1
+
+    application.add_handler(MessageHandler(filters.TEXT, record))
+    async with application:
+        await application.start()
+        for message_id, (chat_id, text) in enumerate(stream, 1):
+            data = make_text_update(chat_id, text, message_id)
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+        await asyncio.wait_for(application.update_queue.join(), 30)
+        await application.stop()
+    return handled, active, processor
+
+
+def per_user(handled):
+    result = {}
+    for chat_id, text in handled:
+        result.setdefault(chat_id, []).append(int(text))
+    return result
+
+
+def test_per_user_order_is_preserved():
+    stream = interleaved_updates(random.Random(1), 20)
+    handled, _, _ = asyncio.run(replay(stream, limit=8))
+    assert len(handled) == len(stream)
+    for chat_id, numbers in per_user(handled).items():
+        assert numbers == list(range(1, 21)), chat_id
+
+
+def test_users_are_processed_concurrently():
+    stream = interleaved_updates(random.Random(2), 10)
+    handled, active, _ = asyncio.run(replay(stream, limit=8))
+    assert len(handled) == len(stream)
+    # Одновременно работали обработчики разных пользователей, но одного пользователя — никогда
+    assert active['peak'] > 1
+    assert active['user_peak'] == 1
+
+
+def test_concurrency_limit_is_respected():
+    stream = interleaved_updates(random.Random(3), 10)
+    _, active, _ = asyncio.run(replay(stream, limit=2))
+    assert active['peak'] <= 2
+
+
+def test_user_queues_are_released():
+    stream = interleaved_updates(random.Random(4), 5)
+    _, _, processor = asyncio.run(replay(stream, limit=4))
+    stats = processor.stats()
+    assert stats['users'] == 0
+    assert stats['processed'] == len(stream)
+    assert stats['serialized'] > 0
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение задержки доставки обновлений: опрос getUpdates против webhook
+Бот работает против локальной имитации Bot API (fake_bot_api.py), Telegram не нужен.
+Задержка — от появления обновления до получения ответа sendMessage.
+
+Использование:
+    python transport_benchmark.py --updates 200
+"""
+
+import argparse
+import asyncio
+import os
+import secrets
+import socket
+import statistics
+import tempfile
+import time
+
+import httpx
+
+import bot
+from database import pool, shutdown_executors
+from fake_bot_api import FakeBotApi, make_text_update
+from webhook import SECRET_HEADER
+
+FAKE_TOKEN = '123456:BENCH'
+# Первый chat_id: у каждого обновления свой незарегистрированный пользователь
+CHAT_ID_BASE = 8000000000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_reply(api, chat_id, timeout=10.0):
+    """Время прихода первого ответа в чат chat_id"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        for sent_at, sent_chat, _ in api.sent:
+            if sent_chat == chat_id:
+                return sent_at
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise TimeoutError(f"Нет ответа в чат {chat_id}")
+        api.sent_event.clear()
+        try:
+            await asyncio.wait_for(api.sent_event.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_transport(mode, count, chat_base):
+    """Прогнать count обновлений /start по одному и вернуть задержки (мс)"""
+    api = await FakeBotApi().start()
+    application = bot.build_application(FAKE_TOKEN, base_url=api.base_url)
+    stop_event = asyncio.Event()
+    webhook_url = None
+    if mode == 'webhook':
+        bot.WEBHOOK_PORT = free_port()
+        bot.WEBHOOK_SECRET = secrets.token_urlsafe(16)
+        webhook_url = f'http://127.0.0.1:{bot.WEBHOOK_PORT}{bot.WEBHOOK_PATH}'
+    runner = asyncio.create_task(bot.run_application(application, stop_event, webhook_url))
+    while not application.running:
+        await asyncio.sleep(0.01)
+
+    latencies = []
+    # Одно keep-alive соединение, как у Telegram при доставке webhook
+    client = httpx.AsyncClient(headers={SECRET_HEADER: bot.WEBHOOK_SECRET or ''})
+    try:
+        for index in range(count):
+            chat_id = chat_base + index
+            update = make_text_update(chat_id, '/start', message_id=index + 1)
+            started = time.perf_counter()
+            if mode == 'webhook':
+                response = await client.post(webhook_url, json=update)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Webhook ответил {response.status_code}")
+            else:
+                api.push_update(update)
+            latencies.append((await wait_reply(api, chat_id) - started) * 1000)
+    finally:
+        await client.aclose()
+        stop_event.set()
+        await runner
+        await api.close()
+    return latencies
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'p50': statistics.median(ordered),
+        'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        'max': ordered[-1],
+    }
+
+
+async def run_all(count):
+    results = {}
+    for offset, mode in enumerate(('polling', 'webhook')):
+        results[mode] = summarize(await run_transport(mode, count, CHAT_ID_BASE + offset * count))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка обработки обновлений: polling против webhook')
+    parser.add_argument('--updates', type=int, default=200, help='обновлений на каждый режим')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='transport_')
+    os.close(fd)
+    pool.configure(path=path)
+    try:
+        bot.init_database()
+        results = asyncio.run(run_all(args.updates))
+    finally:
+        shutdown_executors()
+        pool.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f"{'режим':<10}{'обновлений':>12}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for mode, row in results.items():
+        print(f"{mode:<10}{row['count']:>12}{row['p50']:>10.2f}{row['p99']:>10.2f}{row['max']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Параллельная обработка обновлений с порядком по пользователю
+
+Обновления разных пользователей обрабатываются одновременно (не больше max_concurrent_updates),
+обновления одного пользователя — строго по очереди в порядке получения. Состояния диалогов
+(user_states, admin_temp_data) хранятся по telegram_id, поэтому последовательной обработки
+внутри пользователя достаточно, чтобы они оставались согласованными.
+
+Очередь пользователя — asyncio.Lock: ожидающие получают его в порядке прихода (FIFO), а задачи
+обновлений создаются Application в порядке получения. Блокировка пользователя берётся до слота
+параллельности, чтобы серия обновлений одного пользователя не занимала слоты других.
+"""
+
+import asyncio
+import sys
+
+from telegram.ext import BaseUpdateProcessor
+
+# Лимит семафора BaseUpdateProcessor: он берётся до do_process_update, то есть до блокировки
+# пользователя, поэтому не ограничивает — иначе ожидающие своей очереди обновления занимали бы слоты
+UNLIMITED = sys.maxsize
+
+
+def update_key(update):
+    """Ключ очереди: telegram_id отправителя (или чат); None — обновление без пользователя"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    return chat.id if chat is not None else None
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений: параллельно между пользователями, последовательно внутри пользователя
+
+    process_update в BaseUpdateProcessor финальный, поэтому очередь пользователя и собственный лимит
+    параллельности (семафор после блокировки пользователя) реализованы в do_process_update.
+    """
+
+    def __init__(self, max_concurrent_updates, key=update_key):
+        if max_concurrent_updates < 1:
+            raise ValueError('max_concurrent_updates должен быть положительным')
+        super().__init__(UNLIMITED)
+        self.limit = max_concurrent_updates
+        self._key = key
+        # Создаётся в initialize(), внутри event loop приложения
+        self._slots = None
+        self._active = 0
+        # ключ -> [блокировка, число обновлений в работе и в ожидании]
+        self._locks = {}
+        self.processed = 0
+        self.serialized = 0
+        self.max_queued = 0
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[1] > 1:
+            self.serialized += 1
+            self.max_queued = max(self.max_queued, entry[1])
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                # Очередь пуста — запись удаляется, словарь не растёт с числом пользователей
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._active += 1
+            try:
+                await coroutine
+            finally:
+                self._active -= 1
+                self.processed += 1
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.limit)
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self._active,
+            'users': len(self._locks),
+            'processed': self.processed,
+            'serialized': self.serialized,
+            'max_queued': self.max_queued,
+        }
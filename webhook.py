@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Приём обновлений по webhook на встроенном асинхронном HTTP-сервере
+
+Сервер только быстрее доставляет обновления в очередь приложения. Пропускная способность обработки
+зависит от параллельной обработки (KeyedUpdateProcessor, update_processor.py): без неё очередь
+разбирается по одному обновлению, как и при опросе.
+
+Отправка записанных обновлений на локальный webhook (для проверки без Telegram):
+    python webhook.py updates.jsonl --url http://127.0.0.1:8443/telegram --secret SECRET
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import time
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер тела запроса (байты)
+MAX_BODY_SIZE = 1024 * 1024
+# Время ожидания следующего запроса в keep-alive соединении (секунды)
+KEEPALIVE_TIMEOUT = 60
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+STATUS_TEXT = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large',
+}
+
+
+class WebhookServer:
+    """HTTP-сервер webhook: проверяет секрет и кладёт обновления в очередь приложения"""
+
+    def __init__(self, application, path, secret_token):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self._server = None
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Webhook слушает http://{host}:{port}{self.path}")
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        """Одно соединение может нести несколько запросов (keep-alive)"""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0) or 0)
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status = await self._handle_request(request_line, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line, headers, body):
+        parts = request_line.decode('latin-1').split()
+        if len(parts) < 2 or parts[1].split('?')[0] != self.path:
+            return 404
+        if parts[0] != 'POST':
+            return 405
+        if self.secret_token and not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self.secret_token):
+            self.rejected += 1
+            return 403
+        try:
+            payload = json.loads(body)
+            # Корректный JSON, но не объект ([], null, число) — тоже некорректное обновление
+            if not isinstance(payload, dict):
+                raise TypeError(f"ожидался объект, получен {type(payload).__name__}")
+            update = Update.de_json(payload, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Некорректное обновление webhook: {e}")
+            return 400
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return 200
+
+    @staticmethod
+    async def _respond(writer, status, keep_alive):
+        connection = 'keep-alive' if keep_alive else 'close'
+        writer.write(
+            f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Length: 0\r\n'
+            f'Connection: {connection}\r\n\r\n'.encode('latin-1')
+        )
+        await writer.drain()
+
+
+async def start_webhook(application, host, port, path, url, secret_token):
+    """Зарегистрировать webhook в Telegram и запустить сервер"""
+    server = await WebhookServer(application, path, secret_token).start(host, port)
+    await application.bot.set_webhook(url=url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+    return server
+
+
+# === Отправка записанных обновлений ===
+
+async def post_updates(updates, url, secret_token=None, concurrency=1):
+    """Отправить обновления (словари Update) на webhook; возвращает коды ответов и общее время"""
+    import httpx
+
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient() as client:
+        async def post(update):
+            async with semaphore:
+                response = await client.post(url, json=update, headers=headers)
+                return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(post(update) for update in updates))
+    return statuses, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отправить записанные обновления на webhook')
+    parser.add_argument('path', help='JSONL-файл с объектами Update')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', help='значение X-Telegram-Bot-Api-Secret-Token')
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+    with open(args.path, encoding='utf-8') as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    statuses, elapsed = asyncio.run(post_updates(updates, args.url, args.secret, args.concurrency))
+    accepted = statuses.count(200)
+    print(f"Отправлено: {len(statuses)}, принято: {accepted}, за {elapsed:.2f} с")
+
+
+if __name__ == '__main__':
+    main()